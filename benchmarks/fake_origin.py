@@ -0,0 +1,163 @@
+"""Local stand-in for habr.com, which replays the page fixture: ``python -m benchmarks.fake_origin``.
+
+Every path is answered with the same page, in which links to habr.com point to the fake origin itself, so that proxy
+rewrites them just like on the real site. Latency, jitter, chunked transfer and errors are configurable, see
+``--help``. Point proxy to it with ``HABRAPROXY_ORIGIN=http://127.0.0.1:8001``.
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, MutableMapping, NamedTuple, Optional, Sequence, Tuple
+
+import uvicorn
+
+FIXTURE_PATH = Path(__file__).resolve().parent.parent / 'tests' / 'fixtures' / 'example_response.html'
+REAL_ORIGIN = b'https://habr.com'
+
+Scope = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[MutableMapping[str, Any]]]
+Send = Callable[[MutableMapping[str, Any]], Awaitable[None]]
+
+
+class FakeOriginOptions(NamedTuple):
+    latency: float = 0.05
+    jitter: float = 0
+    chunk_size: int = 0
+    chunk_delay: float = 0
+    error_rate: float = 0
+
+
+DEFAULT_OPTIONS = FakeOriginOptions()
+
+
+class FakeOrigin:
+    """ASGI application, which serves a page with the given delays and failures.
+
+    Response is delayed by ``latency`` plus or minus uniformly distributed ``jitter`` (seconds). If ``chunk_size`` is
+    set, page is sent with chunked transfer encoding, pausing for ``chunk_delay`` between chunks. A share of requests,
+    given by ``error_rate``, is answered with ``503 Service Unavailable``. Pages have ETag, so that conditional
+    requests of proxy are answered with ``304 Not Modified``.
+    """
+
+    def __init__(self, page: bytes, options: FakeOriginOptions = DEFAULT_OPTIONS, seed: Optional[int] = None):
+        self.page = page
+        self.options = options
+        self.etag = '"{0}"'.format(hashlib.sha256(page).hexdigest()[:32])
+        self._random = random.Random(seed)
+        self._pages: Dict[bytes, bytes] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            return
+        await asyncio.sleep(max(0, self.options.latency + self._random.uniform(-1, 1) * self.options.jitter))
+        if self._random.random() < self.options.error_rate:
+            await _send_response(send, HTTPStatus.SERVICE_UNAVAILABLE, [(b'retry-after', b'1')], b'Unavailable')
+            return
+        headers = [(b'etag', self.etag.encode('ascii'))]
+        if self.etag in _header(scope, b'if-none-match').split(', '):
+            await _send_response(send, HTTPStatus.NOT_MODIFIED, headers, b'')
+            return
+
+        headers.append((b'content-type', b'text/html; charset=utf-8'))
+        page = self._get_page(_header(scope, b'host').encode('latin-1'))
+        if self.options.chunk_size:
+            await self._send_chunked_page(send, headers, page)
+        else:
+            await _send_response(send, HTTPStatus.OK, headers, page)
+
+    async def _send_chunked_page(self, send: Send, headers: List[Tuple[bytes, bytes]], page: bytes) -> None:
+        # Without content-length server uses chunked transfer encoding
+        await send({'type': 'http.response.start', 'status': HTTPStatus.OK, 'headers': headers})
+        for chunk_start in range(0, len(page), self.options.chunk_size):
+            if chunk_start:
+                await asyncio.sleep(self.options.chunk_delay)
+            chunk = page[chunk_start:chunk_start + self.options.chunk_size]
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    def _get_page(self, host: bytes) -> bytes:
+        page = self._pages.get(host)
+        if page is None:
+            page = self._pages[host] = self.page.replace(REAL_ORIGIN, b'http://' + host)
+        return page
+
+
+def add_options_arguments(parser: argparse.ArgumentParser, prefix: str = '') -> None:
+    """Add arguments for ``FakeOriginOptions``, which are prefixed, if parser has options for something else."""
+    parser.add_argument(
+        '--{0}latency'.format(prefix),
+        type=float,
+        default=DEFAULT_OPTIONS.latency,
+        help='delay of responses, in seconds (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--{0}jitter'.format(prefix),
+        type=float,
+        default=DEFAULT_OPTIONS.jitter,
+        help='max random deviation of the delay, in seconds',
+    )
+    parser.add_argument(
+        '--{0}chunk-size'.format(prefix),
+        type=int,
+        default=DEFAULT_OPTIONS.chunk_size,
+        help='send pages with chunked transfer encoding, by chunks of this size',
+    )
+    parser.add_argument(
+        '--{0}chunk-delay'.format(prefix),
+        type=float,
+        default=DEFAULT_OPTIONS.chunk_delay,
+        help='delay between chunks, in seconds',
+    )
+    parser.add_argument(
+        '--{0}error-rate'.format(prefix),
+        type=float,
+        default=DEFAULT_OPTIONS.error_rate,
+        help='share of requests, which are answered with 503',
+    )
+
+
+def options_from_arguments(arguments: argparse.Namespace, prefix: str = '') -> FakeOriginOptions:
+    attribute_prefix = prefix.replace('-', '_')
+    return FakeOriginOptions(**{
+        option_name: getattr(arguments, attribute_prefix + option_name) for option_name in FakeOriginOptions._fields
+    })
+
+
+def options_to_arguments(options: FakeOriginOptions) -> List[str]:
+    arguments: List[str] = []
+    for option_name, option_value in options._asdict().items():
+        arguments.extend(('--{0}'.format(option_name.replace('_', '-')), str(option_value)))
+    return arguments
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--page', type=Path, default=FIXTURE_PATH, help='HTML file, which is served for any path')
+    parser.add_argument('--seed', type=int, help='seed of random delays and errors')
+    add_options_arguments(parser)
+    arguments = parser.parse_args(argv)
+
+    fake_origin = FakeOrigin(arguments.page.read_bytes(), options_from_arguments(arguments), seed=arguments.seed)
+    uvicorn.run(fake_origin, host=arguments.host, port=arguments.port, lifespan='off', log_level='warning')
+
+
+async def _send_response(send: Send, status: int, headers: List[Tuple[bytes, bytes]], content: bytes) -> None:
+    headers = headers + [(b'content-length', str(len(content)).encode('ascii'))]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': content})
+
+
+def _header(scope: Scope, name: bytes) -> str:
+    for header_name, header_value in scope['headers']:
+        if header_name == name:
+            return header_value.decode('latin-1')
+    return ''
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""End-to-end load test of the proxy: ``python -m benchmarks.load`` (or ``make loadtest``).
+
+Requests are sent by ``--concurrency`` clients with keep-alive connections, each one sends the next request as soon
+as it receives the previous response. Proxy may be already running at ``--url``, or it may be started with
+``--server-command``, optionally together with a local fake origin (``--fake-origin``, see ``benchmarks.fake_origin``).
+CPU and memory are measured for the whole process tree of the server, so that all workers are taken into account.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from benchmarks import fake_origin
+
+PERCENTILES = (50, 95, 99)
+READINESS_TIMEOUT = 30
+MONITOR_INTERVAL = 0.5
+
+
+class LoadOptions(NamedTuple):
+    url: str = 'http://127.0.0.1:5000'
+    # Paths may contain "{0}", which is replaced with a random number below path_count
+    paths: Sequence[str] = ('/ru/', '/ru/post/{0}/')
+    path_count: int = 100
+    concurrency: int = 16
+    duration: float = 30
+    warmup: float = 5
+    timeout: float = 30
+    accept_encoding: str = ''
+
+
+DEFAULT_OPTIONS = LoadOptions()
+
+
+class ClientResults:
+    """Results of a single client, so that clients don't have to share anything while running."""
+
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.statuses: 'Counter[int]' = Counter()
+        self.errors: 'Counter[str]' = Counter()
+        self.response_bytes = 0
+
+
+class ResourceUsage(NamedTuple):
+    cpu_seconds: float
+    rss_bytes: int
+
+
+class ProcessTreeMonitor:
+    """Samples CPU time and memory of a process with all its descendants (like server workers), Linux only."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peak_rss_bytes = 0
+        self._clock_ticks = os.sysconf('SC_CLK_TCK')
+        self._page_size = os.sysconf('SC_PAGE_SIZE')
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample_periodically, daemon=True)
+
+    def start(self) -> ResourceUsage:
+        self._thread.start()
+        return self.sample()
+
+    def stop(self) -> ResourceUsage:
+        self._stopped.set()
+        self._thread.join()
+        return self.sample()
+
+    def sample(self) -> ResourceUsage:
+        process_stats = _read_process_stats()
+        children = defaultdict(list)
+        for pid, process_stat in process_stats.items():
+            children[int(process_stat[1])].append(pid)
+        tree_pids = [self.pid]
+        for tree_pid in tree_pids:
+            tree_pids.extend(children[tree_pid])
+        cpu_ticks = 0
+        rss_pages = 0
+        for pid in set(tree_pids) & process_stats.keys():
+            # Fields after the process name: state, ppid, ... utime (11), stime (12), ... rss (21)
+            cpu_ticks += int(process_stats[pid][11]) + int(process_stats[pid][12])
+            rss_pages += int(process_stats[pid][21])
+        usage = ResourceUsage(cpu_ticks / self._clock_ticks, rss_pages * self._page_size)
+        self.peak_rss_bytes = max(self.peak_rss_bytes, usage.rss_bytes)
+        return usage
+
+    def _sample_periodically(self) -> None:
+        while not self._stopped.wait(MONITOR_INTERVAL):
+            self.sample()
+
+
+def run_clients(options: LoadOptions) -> List[ClientResults]:
+    """Send requests for ``options.duration`` seconds."""
+    deadline = time.monotonic() + options.duration
+    clients_results = [ClientResults() for _ in range(options.concurrency)]
+    threads = [
+        threading.Thread(target=_run_client, args=(options, client_results, deadline))
+        for client_results in clients_results
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return clients_results
+
+
+def summarize(clients_results: Sequence[ClientResults], duration: float) -> Dict[str, Any]:
+    latencies = sorted(latency for client_results in clients_results for latency in client_results.latencies)
+    statuses: 'Counter[int]' = Counter()
+    errors: 'Counter[str]' = Counter()
+    for client_results in clients_results:
+        statuses.update(client_results.statuses)
+        errors.update(client_results.errors)
+    response_bytes = sum(client_results.response_bytes for client_results in clients_results)
+    summary: Dict[str, Any] = {
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / duration,
+        'megabytes_per_second': response_bytes / duration / 1e6,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'errors': dict(errors),
+        'latency_ms': {},
+    }
+    if latencies:
+        for percentile in PERCENTILES:
+            # Nearest-rank percentile
+            rank = max(1, -(-percentile * len(latencies) // 100))
+            summary['latency_ms']['p{0}'.format(percentile)] = latencies[rank - 1] * 1000
+        summary['latency_ms']['max'] = latencies[-1] * 1000
+    return summary
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    arguments = _parse_arguments(argv)
+    options = LoadOptions(
+        url=arguments.url,
+        paths=arguments.paths,
+        path_count=arguments.path_count,
+        concurrency=arguments.concurrency,
+        duration=arguments.duration,
+        warmup=arguments.warmup,
+        timeout=arguments.timeout,
+        accept_encoding=arguments.accept_encoding,
+    )
+    processes: List['subprocess.Popen[bytes]'] = []
+    try:
+        server_environment = dict(os.environ)
+        if arguments.fake_origin:
+            origin_options = fake_origin.options_from_arguments(arguments, prefix='origin-')
+            processes.append(_start_fake_origin(arguments.origin_port, origin_options))
+            server_environment['HABRAPROXY_ORIGIN'] = 'http://127.0.0.1:{0}'.format(arguments.origin_port)
+        server_pid = arguments.server_pid
+        if arguments.server_command:
+            server_process = subprocess.Popen(shlex.split(arguments.server_command), env=server_environment)
+            processes.append(server_process)
+            server_pid = server_process.pid
+        _wait_for_port(urllib.parse.urlsplit(options.url).netloc)
+
+        monitor = ProcessTreeMonitor(server_pid) if server_pid and sys.platform.startswith('linux') else None
+        results = _run_monitored(options, monitor)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+
+    _print_results(results)
+    if arguments.output:
+        arguments.output.write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+    return 0
+
+
+def _run_client(options: LoadOptions, client_results: ClientResults, deadline: float) -> None:
+    url = urllib.parse.urlsplit(options.url)
+    headers = {'Accept-Encoding': options.accept_encoding} if options.accept_encoding else {}
+    connection = http.client.HTTPConnection(url.netloc, timeout=options.timeout)
+    while True:
+        path = url.path.rstrip('/') + random.choice(options.paths).format(random.randrange(options.path_count))
+        started_at = time.monotonic()
+        if started_at >= deadline:
+            break
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException) as error:
+            connection.close()
+            client_results.errors[type(error).__name__] += 1
+            continue
+        client_results.latencies.append(time.monotonic() - started_at)
+        client_results.statuses[response.status] += 1
+        client_results.response_bytes += len(content)
+    connection.close()
+
+
+def _run_monitored(options: LoadOptions, monitor: Optional[ProcessTreeMonitor]) -> Dict[str, Any]:
+    # Warm-up is not measured, neither for clients, nor for server
+    if options.warmup:
+        run_clients(options._replace(duration=options.warmup))
+    start_usage = monitor.start() if monitor is not None else None
+    clients_results = run_clients(options)
+    results = {'options': options._asdict(), **summarize(clients_results, options.duration)}
+    if monitor is not None and start_usage is not None:
+        end_usage = monitor.stop()
+        results['server'] = {
+            'cpu_percent': (end_usage.cpu_seconds - start_usage.cpu_seconds) / options.duration * 100,
+            'peak_rss_bytes': monitor.peak_rss_bytes,
+            'final_rss_bytes': end_usage.rss_bytes,
+        }
+    return results
+
+
+def _start_fake_origin(port: int, options: fake_origin.FakeOriginOptions) -> 'subprocess.Popen[bytes]':
+    fake_origin_process = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.fake_origin', '--port', str(port), *fake_origin.options_to_arguments(options),
+    ])
+    _wait_for_port('127.0.0.1:{0}'.format(port))
+    return fake_origin_process
+
+
+def _wait_for_port(netloc: str) -> None:
+    host, _, port = netloc.rpartition(':')
+    deadline = time.monotonic() + READINESS_TIMEOUT
+    while True:
+        try:
+            socket.create_connection((host, int(port)), timeout=1).close()
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+        else:
+            return
+
+
+def _read_process_stats() -> Dict[int, List[str]]:
+    process_stats = {}
+    for stat_path in Path('/proc').glob('[0-9]*/stat'):
+        try:
+            process_stat = stat_path.read_text()
+        except OSError:
+            continue  # Process has already exited
+        # Process name may contain spaces and parentheses, so fields are taken after its closing parenthesis
+        process_stats[int(stat_path.parent.name)] = process_stat.rpartition(')')[2].split()
+    return process_stats
+
+
+def _parse_arguments(argv: Optional[Sequence[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=DEFAULT_OPTIONS.url, help='base url of the proxy')
+    parser.add_argument(
+        '--paths',
+        nargs='+',
+        default=list(DEFAULT_OPTIONS.paths),
+        help='requested paths, "{0}" is replaced with a random number below --path-count',
+    )
+    parser.add_argument('--path-count', type=int, default=DEFAULT_OPTIONS.path_count)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_OPTIONS.concurrency)
+    parser.add_argument('--duration', type=float, default=DEFAULT_OPTIONS.duration, help='seconds of measurement')
+    parser.add_argument('--warmup', type=float, default=DEFAULT_OPTIONS.warmup, help='seconds before measurement')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_OPTIONS.timeout)
+    parser.add_argument('--accept-encoding', default=DEFAULT_OPTIONS.accept_encoding)
+    parser.add_argument('--server-command', help='command, which starts the proxy, for example gunicorn')
+    parser.add_argument('--server-pid', type=int, help='pid of already running proxy, to measure its CPU and memory')
+    parser.add_argument('--fake-origin', action='store_true', help='start fake origin for the proxy')
+    parser.add_argument('--origin-port', type=int, default=8001)
+    fake_origin.add_options_arguments(parser, prefix='origin-')
+    parser.add_argument('--output', type=Path, help='write results to JSON file')
+    return parser.parse_args(argv)
+
+
+def _print_results(results: Dict[str, Any]) -> None:
+    sys.stdout.write('Requests: {0} ({1:.1f} per second, {2:.1f} MB/s)\n'.format(
+        results['requests'], results['requests_per_second'], results['megabytes_per_second'],
+    ))
+    sys.stdout.write('Statuses: {0}\n'.format(', '.join(
+        '{0}: {1}'.format(status, count) for status, count in results['statuses'].items()
+    ) or '-'))
+    if results['errors']:
+        sys.stdout.write('Errors: {0}\n'.format(', '.join(
+            '{0}: {1}'.format(error_name, count) for error_name, count in results['errors'].items()
+        )))
+    if results['latency_ms']:
+        sys.stdout.write('Latency: {0}\n'.format(', '.join(
+            '{0} {1:.1f} ms'.format(name, latency) for name, latency in results['latency_ms'].items()
+        )))
+    if 'server' in results:
+        sys.stdout.write('Server: CPU {0:.0f}% of a core, peak RSS {1:.1f} MiB\n'.format(
+            results['server']['cpu_percent'], results['server']['peak_rss_bytes'] / 2 ** 20,
+        ))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
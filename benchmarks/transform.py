@@ -0,0 +1,296 @@
+"""Microbenchmarks of page transformation stages.
+
+Each stage of ``SiteProxy`` is run separately over the real page fixture and over synthetic pages, that stress
+particular parts of the engine. Run ``python -m benchmarks.transform --help`` (or ``make bench``) for options.
+"""
+import argparse
+import json
+import platform
+import re
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+from lxml import etree, html
+
+from habraproxy import settings
+from habraproxy.marking import WordMarker
+from habraproxy.services import SiteProxy, extract_doctype
+
+FIXTURE_PATH = Path(__file__).resolve().parent.parent / 'tests' / 'fixtures' / 'example_response.html'
+BODY_PATTERN = re.compile(r'(<body[^>]*>)(.*)(</body>)', re.DOTALL | re.IGNORECASE)
+ORIGIN = 'https://habr.com'
+# libxml2 doesn't build trees deeper than 256 levels, deeper elements are flattened
+NESTING_DEPTH = 250
+STAGES = ('process_content', 'process_text', 'process_url', 'post_process_content')
+
+
+class Page(NamedTuple):
+    name: str
+    content: str
+
+
+class BenchmarkOptions(NamedTuple):
+    min_time: float = 0.2
+    repeat: int = 5
+    memo_size: int = 4096
+    memo_max_length: int = 256
+
+
+DEFAULT_OPTIONS = BenchmarkOptions()
+
+
+class StageInput(NamedTuple):
+    """Prepared arguments of a stage, so that only the stage itself is measured."""
+
+    function: Callable[[], Any]
+    size: int
+
+
+def fixture_page() -> Page:
+    return Page('fixture', FIXTURE_PATH.read_text(encoding='utf-8'))
+
+
+def scaled_page(scale: int) -> Page:
+    """Fixture with content of ``<body>`` repeated, so that it has ``scale`` times more nodes."""
+    body_match = BODY_PATTERN.search(fixture_page().content)
+    if body_match is None:
+        raise ValueError('Page fixture has no <body>')
+    content = '{0}{1}{2}{3}'.format(
+        body_match.string[:body_match.start(2)],
+        body_match.group(2) * scale,
+        body_match.group(3),
+        body_match.string[body_match.end(3):],
+    )
+    return Page('scaled_{0}x'.format(scale), content)
+
+
+def deep_nesting_page(subtrees: int = 40) -> Page:
+    level = '<div class="comment"><a href="https://habr.com/ru/users/author/">author</a> Ответ на комментарий'
+    subtree = level * NESTING_DEPTH + '</div>' * NESTING_DEPTH
+    return Page('deep_nesting', '<html><body>{0}</body></html>'.format(subtree * subtrees))
+
+
+def long_text_page(text_nodes: int = 20, words: int = 20000) -> Page:
+    text = ' '.join(('Python', 'парсер', 'https://habr.com/ru/', 'memory', 'нагрузка', 'lxml') * (words // 6))
+    paragraph = '<p>{0}</p>'.format(text)
+    return Page('long_text', '<html><body>{0}</body></html>'.format(paragraph * text_nodes))
+
+
+PAGE_BUILDERS: Dict[str, Callable[[], Page]] = {
+    'fixture': fixture_page,
+    'scaled_10x': lambda: scaled_page(10),
+    'scaled_100x': lambda: scaled_page(100),
+    'deep_nesting': deep_nesting_page,
+    'long_text': long_text_page,
+}
+
+
+def prepare_stages(site_proxy: SiteProxy, page: Page) -> Dict[str, StageInput]:
+    root_element = html.document_fromstring(page.content)
+    texts = [str(text) for text in root_element.xpath('//text()') if text.strip()]
+    urls = [str(url) for url in root_element.xpath('//@href | //@src')]
+    processed_root = html.document_fromstring(page.content)
+    site_proxy.process_element(processed_root)
+    serialized_content = html.tostring(
+        processed_root,
+        encoding='unicode',
+        method='html',
+        doctype=extract_doctype(page.content),
+    )
+    return {
+        'process_content': StageInput(lambda: site_proxy.process_content(page.content), _utf8_size(page.content)),
+        'process_text': StageInput(_cold(site_proxy, site_proxy.process_text, texts), _utf8_size(*texts)),
+        'process_url': StageInput(_cold(site_proxy, site_proxy.process_url, urls), _utf8_size(*urls)),
+        'post_process_content': StageInput(
+            lambda: site_proxy._post_process_content(serialized_content),
+            _utf8_size(serialized_content),
+        ),
+    }
+
+
+def measure(stage_input: StageInput, options: BenchmarkOptions) -> Dict[str, float]:
+    stage_input.function()  # Warm up memos and caches, as they are warm in a running server
+    iterations = _calibrate(stage_input.function, options.min_time)
+    timings = [_run(stage_input.function, iterations) / iterations for _ in range(options.repeat)]
+
+    tracemalloc.start()
+    stage_input.function()
+    _, peak_allocated = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best_time = min(timings)
+    return {
+        'seconds': best_time,
+        'median_seconds': statistics.median(timings),
+        'pages_per_second': 1 / best_time,
+        'megabytes_per_second': stage_input.size / best_time / 1e6,
+        'input_bytes': stage_input.size,
+        'peak_allocated_bytes': peak_allocated,
+    }
+
+
+def run_page(page_name: str, stages: Sequence[str], options: BenchmarkOptions) -> Dict[str, Any]:
+    """Benchmark a single page. Expected to be run in a fresh process, so that its peak RSS is not shared."""
+    page = PAGE_BUILDERS[page_name]()
+    site_proxy = SiteProxy(
+        ORIGIN,
+        word_marker=WordMarker(memo_size=options.memo_size, memo_max_length=options.memo_max_length),
+        origin_static_paths=settings.ORIGIN_STATIC_PATHS,
+    )
+    stage_inputs = prepare_stages(site_proxy, page)
+    stage_results = {stage: measure(stage_inputs[stage], options) for stage in stages}
+    return {
+        'page_bytes': _utf8_size(page.content),
+        'nodes': sum(1 for _ in html.document_fromstring(page.content).iter()),
+        'peak_rss_bytes': _peak_rss(),
+        'stages': stage_results,
+    }
+
+
+def run_benchmarks(pages: Sequence[str], stages: Sequence[str], options: BenchmarkOptions) -> Dict[str, Any]:
+    results = {}
+    for page_name in pages:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results[page_name] = executor.submit(run_page, page_name, stages, options).result()
+        _print_page_results(page_name, results[page_name])
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'lxml': '.'.join(map(str, etree.LXML_VERSION)),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+        },
+        'options': options._asdict(),
+        'pages': results,
+    }
+
+
+def find_regressions(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    threshold: float,
+) -> List[str]:
+    """Describe stages, which became slower than in the baseline by more than ``threshold`` (a fraction)."""
+    regressions = []
+    for page_name, page_results in results['pages'].items():
+        baseline_stages = baseline['pages'].get(page_name, {}).get('stages', {})
+        for stage, stage_results in page_results['stages'].items():
+            if stage not in baseline_stages:
+                continue
+            baseline_time = baseline_stages[stage]['seconds']
+            slowdown = stage_results['seconds'] / baseline_time - 1
+            if slowdown > threshold:
+                regressions.append('{0}/{1}: {2:.2f} ms -> {3:.2f} ms (+{4:.0%})'.format(
+                    page_name, stage, baseline_time * 1000, stage_results['seconds'] * 1000, slowdown,
+                ))
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    arguments = _parse_arguments(argv)
+    options = BenchmarkOptions(
+        min_time=arguments.min_time,
+        repeat=arguments.repeat,
+        memo_size=arguments.memo_size,
+        memo_max_length=arguments.memo_max_length,
+    )
+    results = run_benchmarks(arguments.pages, arguments.stages, options)
+    _write_json(arguments.output, results)
+
+    if arguments.save_baseline:
+        _write_json(arguments.baseline, results)
+        sys.stdout.write('Baseline is saved to {0}\n'.format(arguments.baseline))
+        return 0
+    if not arguments.baseline.exists():
+        sys.stdout.write('Baseline {0} is not found, nothing to compare with\n'.format(arguments.baseline))
+        return 1 if arguments.require_baseline else 0
+    regressions = find_regressions(results, json.loads(arguments.baseline.read_text()), arguments.threshold)
+    for regression in regressions:
+        sys.stdout.write('REGRESSION {0}\n'.format(regression))
+    return 1 if regressions else 0
+
+
+def _parse_arguments(argv: Optional[Sequence[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', nargs='+', choices=list(PAGE_BUILDERS), default=list(PAGE_BUILDERS))
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--output', type=Path, default=Path('benchmarks/results.json'))
+    parser.add_argument('--baseline', type=Path, default=Path('benchmarks/baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true', help='store results as the new baseline')
+    parser.add_argument('--require-baseline', action='store_true', help='fail, if there is no baseline to compare with')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.25,
+        help='max allowed slowdown of a stage against the baseline, as a fraction (default: %(default)s)',
+    )
+    parser.add_argument('--min-time', type=float, default=DEFAULT_OPTIONS.min_time, help='seconds per round')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_OPTIONS.repeat, help='number of rounds')
+    parser.add_argument('--memo-size', type=int, default=DEFAULT_OPTIONS.memo_size)
+    parser.add_argument('--memo-max-length', type=int, default=DEFAULT_OPTIONS.memo_max_length)
+    return parser.parse_args(argv)
+
+
+def _cold(site_proxy: SiteProxy, process: Callable[[str], str], values: Sequence[str]) -> Callable[[], List[str]]:
+    """Process all values of a page with empty memos, otherwise after the warm up only memo lookups are measured."""
+    def process_values() -> List[str]:
+        site_proxy.clear_memos()
+        return [process(value_to_process) for value_to_process in values]
+
+    return process_values
+
+
+def _calibrate(function: Callable[[], Any], min_time: float) -> int:
+    """Number of calls, which take at least ``min_time`` seconds."""
+    iterations = 1
+    while True:
+        elapsed = _run(function, iterations)
+        if elapsed >= min_time:
+            return iterations
+        iterations = max(iterations * 2, int(iterations * min_time / max(elapsed, 1e-9)))
+
+
+def _run(function: Callable[[], Any], iterations: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return time.perf_counter() - started_at
+
+
+def _peak_rss() -> int:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, but bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _utf8_size(*texts: str) -> int:
+    return sum(len(text.encode('utf-8')) for text in texts)
+
+
+def _print_page_results(page_name: str, page_results: Dict[str, Any]) -> None:
+    sys.stdout.write('{0}: {1:.1f} KiB, {2} nodes, peak RSS {3:.1f} MiB\n'.format(
+        page_name, page_results['page_bytes'] / 1024, page_results['nodes'], page_results['peak_rss_bytes'] / 2 ** 20,
+    ))
+    for stage, stage_results in page_results['stages'].items():
+        sys.stdout.write('  {0:<22}{1:>10.3f} ms{2:>10.1f} pages/s{3:>9.1f} MB/s{4:>10.1f} MiB allocated\n'.format(
+            stage,
+            stage_results['seconds'] * 1000,
+            stage_results['pages_per_second'],
+            stage_results['megabytes_per_second'],
+            stage_results['peak_allocated_bytes'] / 2 ** 20,
+        ))
+
+
+def _write_json(path: Path, results: Dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,144 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+
 from flask import Flask
 
 from habraproxy import views
+from habraproxy.assets import AssetProxy, AssetStore
+from habraproxy.cache import create_page_cache
+from habraproxy.compression import PageEncoder
+from habraproxy.marking import WordMarker
+from habraproxy.metrics import Metrics, collect_cache_samples
+from habraproxy.pages import AsyncPageService, RecentPages
+from habraproxy.services import SiteProxy
+from habraproxy.singleflight import SingleFlight
+from habraproxy.streaming import StreamingTransformer
+from habraproxy.transform_pool import SiteProxyOptions, TransformPool, TransformPoolSaturatedError
+from habraproxy.upstream import AsyncUpstreamClient, UpstreamClient
+from habraproxy.warmer import CacheWarmer
+
+# Static files are served by asset view, which falls back to origin for files that are not bundled
+app = Flask('habraproxy', static_folder=None)
+app.config.from_object('habraproxy.settings')
 
-app = Flask('habraproxy')
+# Shared between all requests and worker threads, so that upstream connections are reused
+upstream_client = UpstreamClient(
+    pool_size=app.config['UPSTREAM_POOL_SIZE'],
+    max_retries=app.config['UPSTREAM_MAX_RETRIES'],
+    backoff_factor=app.config['UPSTREAM_BACKOFF_FACTOR'],
+    connect_timeout=app.config['UPSTREAM_CONNECT_TIMEOUT'],
+    read_timeout=app.config['UPSTREAM_READ_TIMEOUT'],
+)
+# Used only in async mode. Connections are opened lazily, so it costs nothing in WSGI mode.
+async_upstream_client = AsyncUpstreamClient(
+    pool_size=app.config['ASYNC_UPSTREAM_POOL_SIZE'],
+    max_retries=app.config['UPSTREAM_MAX_RETRIES'],
+    backoff_factor=app.config['UPSTREAM_BACKOFF_FACTOR'],
+    connect_timeout=app.config['UPSTREAM_CONNECT_TIMEOUT'],
+    read_timeout=app.config['UPSTREAM_READ_TIMEOUT'],
+)
+metrics = Metrics(enabled=app.config['METRICS'])
+page_cache = create_page_cache(
+    app.config['PAGE_CACHE_BACKEND'],
+    ttl=app.config['PAGE_CACHE_TTL'],
+    max_size=app.config['PAGE_CACHE_MAX_SIZE'],
+    directory=app.config['PAGE_CACHE_DIR'],
+)
+site_proxy_options = SiteProxyOptions(
+    app.config['ORIGIN'],
+    extra_replacements=tuple((old, new) for old, new in app.config['EXTRA_REPLACEMENTS']),
+    memo_size=app.config['TEXT_MEMO_SIZE'],
+    memo_max_length=app.config['TEXT_MEMO_MAX_LENGTH'],
+    origin_static_paths=tuple(app.config['ORIGIN_STATIC_PATHS']),
+)
+site_proxy = SiteProxy(
+    site_proxy_options.origin,
+    client=upstream_client,
+    async_client=async_upstream_client,
+    metrics=metrics,
+    extra_replacements=site_proxy_options.extra_replacements,
+    word_marker=WordMarker(memo_size=site_proxy_options.memo_size, memo_max_length=site_proxy_options.memo_max_length),
+    origin_static_paths=site_proxy_options.origin_static_paths,
+)
+# Requested pages are tracked only for cache warmer, which has nothing to do without page cache
+is_warmer_enabled = app.config['WARMER'] and page_cache is not None
+recent_pages = RecentPages(max_size=app.config['WARMER_MAX_PAGES']) if is_warmer_enabled else None
+transform_pool = None
+if app.config['TRANSFORM_POOL_SIZE']:
+    transform_pool = TransformPool(
+        site_proxy_options,
+        max_workers=app.config['TRANSFORM_POOL_SIZE'],
+        max_queue_size=app.config['TRANSFORM_QUEUE_SIZE'],
+    )
+    # Application is loaded before server starts its threads (see post_fork hook in gunicorn_config), and processes of
+    # the pool have to be forked before them too
+    transform_pool.start()
+app.extensions['upstream_client'] = upstream_client
+app.extensions['page_service'] = AsyncPageService(
+    site_proxy,
+    executor=ThreadPoolExecutor(max_workers=app.config['ASYNC_TRANSFORM_WORKERS'] or None),
+    cache=page_cache,
+    single_flight=SingleFlight(lock_dir=app.config['SINGLE_FLIGHT_LOCK_DIR'] or None),
+    streaming_transformer=StreamingTransformer(site_proxy, flush_depth=app.config['STREAMING_FLUSH_DEPTH']),
+    stream_chunk_size=app.config['STREAMING_CHUNK_SIZE'],
+    bytes_pipeline=app.config['BYTES_PIPELINE'],
+    transform_pool=transform_pool,
+    recent_pages=recent_pages,
+)
+app.extensions['metrics'] = metrics
+# Pages from memory cache keep their compressed variants themselves
+is_variant_cache_enabled = app.config['PAGE_CACHE_BACKEND'] == 'disk'
+app.extensions['page_encoder'] = PageEncoder(
+    gzip_level=app.config['COMPRESSION_GZIP_LEVEL'],
+    brotli_quality=app.config['COMPRESSION_BROTLI_QUALITY'],
+    min_size=app.config['COMPRESSION_MIN_SIZE'],
+    variant_cache_size=app.config['COMPRESSION_VARIANT_CACHE_SIZE'] if is_variant_cache_enabled else 0,
+)
+app.extensions['asset_proxy'] = AssetProxy(
+    site_proxy_options.origin,
+    AssetStore(app.config['ASSET_CACHE_DIR'], max_size=app.config['ASSET_CACHE_MAX_SIZE']),
+    local_directory=os.path.join(app.root_path, 'static'),
+    client=upstream_client,
+)
+
+metrics.add_collector(partial(collect_cache_samples, app.extensions['page_service']))
+app.register_error_handler(TransformPoolSaturatedError, views.service_unavailable)
 
 app.add_url_rule('/', defaults={'path': ''}, view_func=views.HabrProxyView.as_view('habr_proxy_main'))
+app.add_url_rule('/static/<path:path>', view_func=views.AssetView.as_view('static'))
+app.add_url_rule(
+    '/images/<path:path>',
+    defaults={'origin_prefix': 'images/'},
+    view_func=views.AssetView.as_view('images'),
+)
 app.add_url_rule('/site.webmanifest', view_func=views.WebmanifestMockView.as_view('webmanifest_mock'))
+app.add_url_rule('/cache-stats', view_func=views.CacheStatsView.as_view('cache_stats'))
+app.add_url_rule('/metrics', view_func=views.MetricsView.as_view('metrics'))
 app.add_url_rule('/<path:path>', view_func=views.HabrProxyView.as_view('habr_proxy'))
+
+if is_warmer_enabled:
+    if app.config['PAGE_CACHE_BACKEND'] == 'disk':
+        # Cache is shared by worker processes, so only one of them warms it
+        warmer_lock_path: Optional[str] = os.path.join(app.config['PAGE_CACHE_DIR'], 'warmer.lock')
+        warmer_processes = 1
+    else:
+        # Each worker process warms its own cache, so they split limits of requests to origin
+        warmer_lock_path = None
+        warmer_processes = max(1, app.config['SERVER_WORKERS'])
+    # Started after routes are registered, because urls are matched against them
+    app.extensions['cache_warmer'] = CacheWarmer(
+        app.extensions['page_service'],
+        seeds=app.config['WARMER_SEEDS'],
+        page_path=partial(views.match_page_path, app.url_map),
+        recent_pages=recent_pages,
+        max_depth=app.config['WARMER_MAX_DEPTH'],
+        max_pages=app.config['WARMER_MAX_PAGES'],
+        concurrency=max(1, app.config['WARMER_CONCURRENCY'] // warmer_processes),
+        rate_limit=app.config['WARMER_RATE_LIMIT'] / warmer_processes,
+        interval=app.config['WARMER_INTERVAL'],
+        refresh_ahead=app.config['WARMER_REFRESH_AHEAD'],
+        lock_path=warmer_lock_path,
+    )
+    app.extensions['cache_warmer'].start()
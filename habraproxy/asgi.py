@@ -0,0 +1,129 @@
+"""ASGI application for serving proxy with an asyncio server, for example ``uvicorn habraproxy.asgi:application``.
+
+Pages are served natively: waiting for habr.com does not occupy any thread, and pages are processed in executor. All
+other routes (and streamed pages) are handled by the WSGI application in a thread pool.
+"""
+import asyncio
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable, MutableMapping, Optional, Sequence, Tuple, cast
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import Flask
+
+from habraproxy.app import app
+from habraproxy.compression import PageEncoder
+from habraproxy.metrics import Metrics
+from habraproxy.pages import AsyncPageService
+from habraproxy.transform_pool import TransformPoolSaturatedError
+from habraproxy.views import SERVICE_UNAVAILABLE_MESSAGE, SERVICE_UNAVAILABLE_RETRY_AFTER, match_page_path
+
+Scope = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[MutableMapping[str, Any]]]
+Send = Callable[[MutableMapping[str, Any]], Awaitable[None]]
+
+
+class HabrProxyApplication:
+    def __init__(self, wsgi_app: Flask):
+        self.wsgi_app = wsgi_app
+        # asgiref is not annotated
+        self.fallback_app = cast(Any, WsgiToAsgi)(wsgi_app)
+        self.page_service: AsyncPageService = wsgi_app.extensions['page_service']
+        self.page_encoder: PageEncoder = wsgi_app.extensions['page_encoder']
+        self.metrics: Metrics = wsgi_app.extensions['metrics']
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'lifespan':
+            await self._handle_lifespan(receive, send)
+            return
+        page_path = self._page_path(scope)
+        if page_path is None:
+            await self.fallback_app(scope, receive, send)
+            return
+        try:
+            await self._serve_page(page_path, scope, send)
+        except TransformPoolSaturatedError:
+            await _send_response(
+                send,
+                HTTPStatus.SERVICE_UNAVAILABLE,
+                SERVICE_UNAVAILABLE_MESSAGE.encode('utf-8'),
+                content_type=b'text/plain; charset=utf-8',
+                extra_headers=[(b'retry-after', SERVICE_UNAVAILABLE_RETRY_AFTER.encode('ascii'))],
+            )
+
+    async def _serve_page(self, page_path: str, scope: Scope, send: Send) -> None:
+        # Timings are passed explicitly, since concurrent requests of the loop may share a context
+        with self.metrics.time_async_request() as request_timings:
+            page = await self.page_service.get_page_async(page_path, request_timings=request_timings)
+            with self.metrics.stage('render', request_timings):
+                page_representation = self.page_encoder.represent(
+                    page,
+                    _host(scope),
+                    accept_encoding=_header(scope, b'accept-encoding'),
+                    if_none_match=_header(scope, b'if-none-match'),
+                )
+        headers = list(page_representation.headers)
+        if request_timings is not None:
+            headers.append(('Server-Timing', request_timings.header()))
+        await _send_response(
+            send,
+            page_representation.status,
+            page_representation.content,
+            extra_headers=[
+                (header_name.lower().encode('latin-1'), header_value.encode('latin-1'))
+                for header_name, header_value in headers
+            ],
+        )
+
+    def _page_path(self, scope: Scope) -> Optional[str]:
+        """Path of the proxied page, if request should be handled natively."""
+        if scope['type'] != 'http' or scope['method'] != 'GET' or self.wsgi_app.config['STREAMING']:
+            return None
+        return match_page_path(self.wsgi_app.url_map, scope['path'])
+
+    async def _handle_lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Cache warmer loads pages in this loop, together with requests of visitors
+                self.page_service.attach_event_loop(asyncio.get_event_loop())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if 'cache_warmer' in self.wsgi_app.extensions:
+                    # Warmer may be waiting for the loop, so the loop must not be blocked, while it stops
+                    await asyncio.get_event_loop().run_in_executor(None, self.wsgi_app.extensions['cache_warmer'].stop)
+                self.page_service.attach_event_loop(None)
+                await self.page_service.site_proxy.async_client.close()
+                if self.page_service.transform_pool is not None:
+                    self.page_service.transform_pool.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def _send_response(
+    send: Send,
+    status: int,
+    content: bytes,
+    content_type: bytes = b'text/html; charset=utf-8',
+    extra_headers: Sequence[Tuple[bytes, bytes]] = (),
+) -> None:
+    headers = [(b'content-type', content_type), (b'content-length', str(len(content)).encode('ascii'))]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers + list(extra_headers)})
+    await send({'type': 'http.response.body', 'body': content})
+
+
+def _header(scope: Scope, name: bytes) -> str:
+    for header_name, header_value in scope['headers']:
+        if header_name == name:
+            return header_value.decode('latin-1')
+    return ''
+
+
+def _host(scope: Scope) -> str:
+    host_header = _header(scope, b'host')
+    if host_header:
+        return host_header
+    host, port = scope.get('server') or ('localhost', None)
+    return host if port is None else '{0}:{1}'.format(host, port)
+
+
+application = HabrProxyApplication(app)
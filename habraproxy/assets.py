@@ -0,0 +1,276 @@
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+import threading
+from http import HTTPStatus
+from typing import Any, BinaryIO, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import urlpath
+from werkzeug.security import safe_join
+
+from habraproxy.singleflight import SingleFlight
+from habraproxy.upstream import UpstreamClient
+
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+# Only files of these types are downloaded from origin, anything else (like pages) is left to origin itself
+ASSET_CONTENT_TYPE_PREFIXES = (
+    'image/',
+    'font/',
+    'application/font-',
+    'application/x-font-',
+    'application/vnd.ms-fontobject',
+)
+# Extensions of assets, which origin may serve with a generic content type
+ASSET_EXTENSIONS = frozenset((
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg', '.ico', '.woff', '.woff2', '.ttf', '.otf', '.eot',
+))
+GENERIC_CONTENT_TYPES = frozenset((DEFAULT_CONTENT_TYPE, 'binary/octet-stream'))
+# Objects are scanned after this number of writes even if they seem to fit, to notice writes of other processes
+ASSET_RESCAN_INTERVAL = 100
+
+
+class AssetNotStoredError(Exception):
+    """Raised, when asset can't be served from the store, so client should download it from origin."""
+
+
+class AssetTooLargeError(AssetNotStoredError):
+    """Raised, when asset doesn't fit into the store."""
+
+
+class NotAnAssetError(AssetNotStoredError):
+    """Raised, when origin responds with something, that is not an asset (for example, with a page)."""
+
+
+class StoredAsset(NamedTuple):
+    path: str
+    size: int
+    content_type: str
+    etag: str
+
+
+class OpenedAsset(NamedTuple):
+    asset: StoredAsset
+    # File stays readable, even if it is evicted after it has been opened
+    file: BinaryIO
+
+
+class AssetStore:
+    """Content-addressed storage of assets in a local directory, which may be shared between processes.
+
+    Content of each asset is stored once in ``objects/``, under its SHA-256 digest, while ``index/`` maps urls to
+    digests. Recency of use is tracked with modification time of objects, so eviction removes objects that were not
+    read for the longest time. Index records of evicted objects are just ignored. Files are written in ``tmp/`` and
+    are moved to their places, when they are complete, so eviction never sees them.
+
+    Total size of objects is tracked in memory, so that they are scanned only when the limit is exceeded (or once in
+    a while, since other processes write there too).
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self.objects_directory = os.path.join(directory, 'objects')
+        self.index_directory = os.path.join(directory, 'index')
+        self.temp_directory = os.path.join(directory, 'tmp')
+        os.makedirs(self.objects_directory, exist_ok=True)
+        os.makedirs(self.index_directory, exist_ok=True)
+        os.makedirs(self.temp_directory, exist_ok=True)
+        self.size = sum(object_size for _, object_size, _ in _stored_objects(self.objects_directory))
+        self._writes_since_scan = 0
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Optional[StoredAsset]:
+        try:
+            with open(self._index_path(url)) as index_file:
+                index_record = json.load(index_file)
+            object_path = self._object_path(index_record['digest'])
+            os.utime(object_path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return StoredAsset(
+            path=object_path,
+            size=index_record['size'],
+            content_type=index_record['content_type'],
+            etag=index_record['digest'],
+        )
+
+    def open(self, url: str) -> Optional[OpenedAsset]:
+        """Return stored asset together with its opened file, or None, if it is not stored (or has been evicted)."""
+        asset = self.get(url)
+        if asset is None:
+            return None
+        try:
+            # Another process may evict the object right after it has been found
+            asset_file = open(asset.path, 'rb')  # noqa: WPS515
+        except FileNotFoundError:
+            return None
+        return OpenedAsset(asset, asset_file)
+
+    def put(self, url: str, chunks: Iterable[bytes], content_type: str) -> StoredAsset:
+        """Write content to the store by chunks, so that it is never kept in memory as a whole."""
+        digest = hashlib.sha256()
+        size = 0
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.temp_directory)
+        try:
+            with os.fdopen(file_descriptor, 'wb') as object_file:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise AssetTooLargeError('Asset {0} is larger than the whole store'.format(url))
+                    digest.update(chunk)
+                    object_file.write(chunk)
+            object_path = self._object_path(digest.hexdigest())
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            # Same content may be already stored for another url - in this case it is just replaced with a copy
+            replaced_size = _file_size(object_path)
+            os.replace(temp_path, object_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        self._write_index(url, {'digest': digest.hexdigest(), 'size': size, 'content_type': content_type})
+        self._account(size - replaced_size)
+        return StoredAsset(path=object_path, size=size, content_type=content_type, etag=digest.hexdigest())
+
+    def _write_index(self, url: str, index_record: Dict[str, Any]) -> None:
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.temp_directory)
+        with os.fdopen(file_descriptor, 'w') as index_file:
+            json.dump(index_record, index_file)
+        os.replace(temp_path, self._index_path(url))
+
+    def _index_path(self, url: str) -> str:
+        return os.path.join(self.index_directory, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_directory, digest[:2], digest)
+
+    def _account(self, size_change: int) -> None:
+        with self._lock:
+            self.size += size_change
+            self._writes_since_scan += 1
+            if self.size <= self.max_size and self._writes_since_scan < ASSET_RESCAN_INTERVAL:
+                return
+            objects = _stored_objects(self.objects_directory)
+            self.size = sum(object_size for _, object_size, _ in objects)
+            self._writes_since_scan = 0
+            self._evict(objects)
+
+    def _evict(self, objects: List[Tuple[float, int, str]]) -> None:
+        for _, object_size, path in sorted(objects):
+            if self.size <= self.max_size:
+                break
+            # Object may be already evicted by another process
+            if _remove(path):
+                self.size -= object_size
+
+
+class AssetProxy:
+    """Serves images, fonts and other static files of the site.
+
+    Files, which are bundled with the proxy, are served from ``local_directory``. Others are downloaded from origin
+    once, streaming straight into the store, and are served from there afterwards.
+    """
+
+    def __init__(
+        self,
+        origin: str,
+        store: AssetStore,
+        local_directory: Optional[str] = None,
+        client: Optional[UpstreamClient] = None,
+        single_flight: Optional[SingleFlight] = None,
+        chunk_size: int = 64 * 1024,
+    ):
+        self.origin = urlpath.URL(origin)
+        self.store = store
+        self.local_directory = local_directory
+        self.client = client or UpstreamClient()
+        self.single_flight = single_flight or SingleFlight()
+        self.chunk_size = chunk_size
+
+    def open_asset(self, path: str) -> Optional[OpenedAsset]:
+        """Return opened asset by its path at the origin, or None, if origin doesn't have it."""
+        local_asset = self._get_local_asset(path)
+        if local_asset is not None:
+            return OpenedAsset(local_asset, open(local_asset.path, 'rb'))  # noqa: WPS515
+        url = self.origin_url(path)
+        opened_asset = self.store.open(url)
+        if opened_asset is not None:
+            return opened_asset
+        if self.single_flight.do(url, lambda: self._fetch_asset(url)) is None:
+            return None
+        opened_asset = self.store.open(url)
+        if opened_asset is None:
+            raise AssetNotStoredError('Asset {0} was evicted right after it had been downloaded'.format(url))
+        return opened_asset
+
+    def origin_url(self, path: str) -> str:
+        return str(self.origin.joinpath(path))
+
+    def _get_local_asset(self, path: str) -> Optional[StoredAsset]:
+        if not self.local_directory:
+            return None
+        local_path = safe_join(self.local_directory, path)
+        if local_path is None or not os.path.isfile(local_path):
+            return None
+        stat = os.stat(local_path)
+        return StoredAsset(
+            path=local_path,
+            size=stat.st_size,
+            content_type=mimetypes.guess_type(local_path)[0] or DEFAULT_CONTENT_TYPE,
+            etag='{0:x}-{1:x}'.format(int(stat.st_mtime), stat.st_size),
+        )
+
+    def _fetch_asset(self, url: str) -> Optional[StoredAsset]:
+        # Asset could have been fetched by another thread, while this one was waiting for its turn
+        asset = self.store.get(url)
+        if asset is not None:
+            return asset
+        response = self.client.get(url, stream=True)
+        try:
+            if response.status_code != HTTPStatus.OK:
+                return None
+            content_type = response.headers.get('Content-Type', DEFAULT_CONTENT_TYPE)
+            if not is_asset(url, content_type):
+                raise NotAnAssetError('{0} is not an asset, but {1}'.format(url, content_type))
+            return self.store.put(url, response.iter_content(chunk_size=self.chunk_size), content_type)
+        finally:
+            response.close()
+
+
+def is_asset(url: str, content_type: str) -> bool:
+    media_type = content_type.partition(';')[0].strip().lower()
+    if media_type.startswith(ASSET_CONTENT_TYPE_PREFIXES):
+        return True
+    extension = os.path.splitext(urlpath.URL(url).path)[1].lower()
+    return media_type in GENERIC_CONTENT_TYPES and extension in ASSET_EXTENSIONS
+
+
+def _stored_objects(directory: str) -> List[Tuple[float, int, str]]:
+    """Modification time, size and path of each object in the directory."""
+    objects = []
+    for directory_path, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            path = os.path.join(directory_path, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # Evicted by another process
+            objects.append((stat.st_mtime, stat.st_size, path))
+    return objects
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
@@ -0,0 +1,339 @@
+import abc
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, BinaryIO, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from habraproxy.templates import OriginTemplate
+
+DISK_ENTRY_SUFFIX = '.entry'
+# First line of entry files, it changes together with their format, so that files in an old format are just misses
+DISK_ENTRY_HEADER = b'habraproxy-page-entry-1\n'
+# Directory is scanned after this number of writes even if it seems to fit, to notice writes of other processes
+DISK_RESCAN_INTERVAL = 100
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    size: int
+    expires_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        return (now if now is not None else time.time()) < self.expires_at
+
+
+class CacheStats:
+    """Thread-safe cache counters."""
+
+    fields = ('hits', 'misses', 'revalidations', 'evictions')
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(self.fields, 0)
+
+    def increment(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] += amount
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+
+class BaseCacheBackend(abc.ABC):
+    def __init__(self) -> None:
+        self.on_evict: Callable[[int], None] = lambda count: None
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Return stored entry (even an expired one) and mark it as recently used."""
+
+    @abc.abstractmethod
+    def peek(self, key: str) -> Optional[CacheEntry]:
+        """Return stored entry without changing its recency, for checks that are not caused by visitors."""
+
+    @abc.abstractmethod
+    def set(self, key: str, entry: CacheEntry) -> None:
+        """Store entry, evicting least recently used ones if needed."""
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove entry, if it exists."""
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        """Remove all entries."""
+
+
+class MemoryCacheBackend(BaseCacheBackend):
+    """In-process LRU storage, bounded by total size of stored values."""
+
+    def __init__(self, max_size: int) -> None:
+        super().__init__()
+        self.max_size = max_size
+        self.size = 0
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def peek(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        if entry.size > self.max_size:
+            # Entry would evict everything else and still not fit, but a previous version of it is outdated anyway
+            self.delete(key)
+            return
+        evicted = 0
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_size:
+                _, oldest_entry = self._entries.popitem(last=False)
+                self.size -= oldest_entry.size
+                evicted += 1
+        if evicted:
+            self.on_evict(evicted)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _pop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+
+class DiskCacheBackend(BaseCacheBackend):
+    """Storage in a local directory, which may be shared between processes.
+
+    Each entry is written into a separate file: a line of JSON metadata followed by segments of the page. Values are
+    never unpickled, so whoever can write into the directory can't execute code in the proxy. Recency of use is
+    tracked with file modification time, so eviction removes files that were not read for the longest time.
+
+    Total size of the directory is tracked in memory, so that it is scanned only when the limit is exceeded (or once
+    in a while, since other processes write there too).
+    """
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        super().__init__()
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.size = sum(file_size for _, file_size, _ in _entry_files(directory))
+        self._writes_since_scan = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        return self._read(key, touch=True)
+
+    def peek(self, key: str) -> Optional[CacheEntry]:
+        return self._read(key, touch=False)
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        if entry.size > self.max_size:
+            self.delete(key)
+            return
+        path = self._path(key)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(file_descriptor, 'wb') as entry_file:
+            _write_entry(entry_file, entry)
+            written_size = entry_file.tell()
+        replaced_size = _file_size(path)
+        # Replace is atomic, so concurrent readers never see a partially written entry
+        os.replace(temp_path, path)
+        self._account(written_size - replaced_size)
+
+    def delete(self, key: str) -> None:
+        path = self._path(key)
+        file_size = _file_size(path)
+        if _remove(path):
+            with self._lock:
+                self.size -= file_size
+
+    def clear(self) -> None:
+        with self._lock:
+            for _, _, path in _entry_files(self.directory):
+                _remove(path)
+            self.size = 0
+
+    def _read(self, key: str, touch: bool) -> Optional[CacheEntry]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                entry = _read_entry(entry_file)
+            if touch:
+                os.utime(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            # Missing, damaged or written in another format
+            return None
+        return entry
+
+    def _path(self, key: str) -> str:
+        file_name = hashlib.sha256(key.encode('utf-8')).hexdigest() + DISK_ENTRY_SUFFIX
+        return os.path.join(self.directory, file_name)
+
+    def _account(self, size_change: int) -> None:
+        with self._lock:
+            self.size += size_change
+            self._writes_since_scan += 1
+            if self.size <= self.max_size and self._writes_since_scan < DISK_RESCAN_INTERVAL:
+                return
+            files = _entry_files(self.directory)
+            self.size = sum(file_size for _, file_size, _ in files)
+            self._writes_since_scan = 0
+            evicted = self._evict(files)
+        if evicted:
+            self.on_evict(evicted)
+
+    def _evict(self, files: List[Tuple[float, int, str]]) -> int:
+        evicted = 0
+        for _, file_size, path in sorted(files):
+            if self.size <= self.max_size:
+                break
+            # File may be already evicted by another process
+            if _remove(path):
+                self.size -= file_size
+                evicted += 1
+        return evicted
+
+
+def _entry_files(directory: str) -> List[Tuple[float, int, str]]:
+    """Modification time, size and path of each entry file in the directory."""
+    files = []
+    for dir_entry in os.scandir(directory):
+        if dir_entry.name.endswith(DISK_ENTRY_SUFFIX):
+            stat = dir_entry.stat()
+            files.append((stat.st_mtime, stat.st_size, dir_entry.path))
+    return files
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _write_entry(entry_file: BinaryIO, entry: CacheEntry) -> None:
+    segments = entry.value.segments
+    metadata = {
+        'size': entry.size,
+        'expires_at': entry.expires_at,
+        'etag': entry.etag,
+        'last_modified': entry.last_modified,
+        'segment_lengths': [len(segment) for segment in segments],
+    }
+    entry_file.write(DISK_ENTRY_HEADER)
+    entry_file.write(json.dumps(metadata).encode('utf-8') + b'\n')
+    entry_file.writelines(segments)
+
+
+def _read_entry(entry_file: BinaryIO) -> CacheEntry:
+    if entry_file.readline() != DISK_ENTRY_HEADER:
+        raise ValueError('Unknown format of cache entry')
+    metadata = json.loads(entry_file.readline().decode('utf-8'))
+    segments = []
+    for segment_length in metadata['segment_lengths']:
+        segment = entry_file.read(segment_length)
+        if len(segment) != segment_length:
+            raise ValueError('Cache entry is truncated')
+        segments.append(segment)
+    return CacheEntry(
+        value=OriginTemplate(segments),
+        size=metadata['size'],
+        expires_at=metadata['expires_at'],
+        etag=metadata['etag'],
+        last_modified=metadata['last_modified'],
+    )
+
+
+class PageCache:
+    """Cache of processed pages with expiration and support for conditional revalidation."""
+
+    def __init__(self, backend: BaseCacheBackend, ttl: float) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = CacheStats()
+        backend.on_evict = lambda count: self.stats.increment('evictions', count)
+
+    def lookup(self, key: str) -> Optional[CacheEntry]:
+        """Return an entry for the key, which may already be expired and require revalidation."""
+        entry = self.backend.get(key)
+        if entry is not None and entry.is_fresh():
+            self.stats.increment('hits')
+        else:
+            self.stats.increment('misses')
+        return entry
+
+    def store(
+        self,
+        key: str,
+        value: Any,
+        size: int,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> CacheEntry:
+        entry = CacheEntry(
+            value=value,
+            size=size,
+            expires_at=time.time() + self.ttl,
+            etag=etag,
+            last_modified=last_modified,
+        )
+        self.backend.set(key, entry)
+        return entry
+
+    def refresh(self, key: str, entry: CacheEntry) -> CacheEntry:
+        """Extend lifetime of an expired entry, after origin has confirmed that it was not changed."""
+        self.stats.increment('revalidations')
+        refreshed_entry = entry._replace(expires_at=time.time() + self.ttl)
+        self.backend.set(key, refreshed_entry)
+        return refreshed_entry
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+
+def create_page_cache(backend_name: str, ttl: float, max_size: int, directory: str) -> Optional[PageCache]:
+    if backend_name == 'none':
+        return None
+    backend: BaseCacheBackend
+    if backend_name == 'memory':
+        backend = MemoryCacheBackend(max_size=max_size)
+    elif backend_name == 'disk':
+        backend = DiskCacheBackend(directory=directory, max_size=max_size)
+    else:
+        raise ValueError('Unknown page cache backend: {0}'.format(backend_name))
+    return PageCache(backend, ttl=ttl)
@@ -0,0 +1,126 @@
+import math
+import zlib
+from http import HTTPStatus
+from typing import List, NamedTuple, Optional, Tuple
+
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+
+from habraproxy.cache import CacheEntry, MemoryCacheBackend
+from habraproxy.templates import OriginTemplate
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Gzip container for deflate stream. Unlike gzip.compress(), it doesn't include current time, so output is stable.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class PageRepresentation(NamedTuple):
+    status: int
+    content: bytes
+    headers: List[Tuple[str, str]]
+
+
+class PageEncoder:
+    """Prepares processed pages for sending to a particular client.
+
+    Each page has a strong ETag per origin and content encoding, so that unchanged page is answered with
+    ``304 Not Modified`` without rendering it. Compressed variants are produced once and stored together with the
+    page, so while page is cached, it is not compressed again. Origin comes from request headers, so each page is
+    compressed for at most ``max_variants`` origins and encodings (and within its budget of variants), any other ones
+    receive the page uncompressed.
+
+    Pages, which are read from a disk cache, are new objects on each request, so their variants are also kept in a
+    per-process cache of ``variant_cache_size`` bytes, under fingerprints of pages.
+    """
+
+    def __init__(
+        self,
+        gzip_level: int = 9,
+        brotli_quality: int = 9,
+        min_size: int = 1024,
+        max_variants: int = 8,
+        variant_cache_size: int = 0,
+    ):
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+        self.max_variants = max_variants
+        self.variant_cache = MemoryCacheBackend(max_size=variant_cache_size) if variant_cache_size else None
+        # In order of preference, when client accepts several of them equally
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def represent(
+        self,
+        page: OriginTemplate,
+        origin: str,
+        accept_encoding: str = '',
+        if_none_match: str = '',
+    ) -> PageRepresentation:
+        encoding = self._choose_encoding(page, origin, accept_encoding)
+        if parse_etags(if_none_match).contains(_etag(page, origin, encoding)):
+            return PageRepresentation(HTTPStatus.NOT_MODIFIED, b'', _headers(page, origin, encoding))
+        content = None
+        if encoding is not None:
+            content = self._get_variant(page, origin, encoding)
+        if content is None:
+            # Variants, which don't fit into the budget of the page, are not sent, so that ETag stays the same
+            encoding = None
+            content = page.render(origin)
+        headers = _headers(page, origin, encoding)
+        if encoding is not None:
+            headers.append(('Content-Encoding', encoding))
+        return PageRepresentation(HTTPStatus.OK, content, headers)
+
+    def compress(self, content: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(content, quality=self.brotli_quality)
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, GZIP_WBITS)
+        return compressor.compress(content) + compressor.flush()
+
+    def _choose_encoding(self, page: OriginTemplate, origin: str, accept_encoding: str) -> Optional[str]:
+        if page.size < self.min_size:
+            return None
+        encoding = parse_accept_header(accept_encoding).best_match(self.encodings)
+        if encoding is None or (origin, encoding) in page.variants:
+            return encoding
+        if len(page.variants) < self.max_variants and page.variants_budget > 0:
+            return encoding
+        return None
+
+    def _get_variant(self, page: OriginTemplate, origin: str, encoding: str) -> Optional[bytes]:
+        variant_key = (origin, encoding)
+        variant = page.variants.get(variant_key)
+        if variant is None:
+            variant = self._cached_variant(page, origin, encoding)
+        if variant is None:
+            variant = self.compress(page.render(origin), encoding)
+            if not page.add_variant(variant_key, variant):
+                return None
+            self._cache_variant(page, origin, encoding, variant)
+        return variant
+
+    def _cached_variant(self, page: OriginTemplate, origin: str, encoding: str) -> Optional[bytes]:
+        if self.variant_cache is None:
+            return None
+        entry = self.variant_cache.get(_etag(page, origin, encoding))
+        return entry.value if entry is not None else None
+
+    def _cache_variant(self, page: OriginTemplate, origin: str, encoding: str, variant: bytes) -> None:
+        if self.variant_cache is not None:
+            # Fingerprint changes together with the page, so variants are never outdated, just evicted
+            entry = CacheEntry(value=variant, size=len(variant), expires_at=math.inf)
+            self.variant_cache.set(_etag(page, origin, encoding), entry)
+
+
+def _etag(page: OriginTemplate, origin: str, encoding: Optional[str]) -> str:
+    etag = page.fingerprint(origin)
+    if encoding is not None:
+        return '{0}-{1}'.format(etag, encoding)
+    return etag
+
+
+def _headers(page: OriginTemplate, origin: str, encoding: Optional[str]) -> List[Tuple[str, str]]:
+    return [('ETag', quote_etag(_etag(page, origin, encoding))), ('Vary', 'Accept-Encoding')]
@@ -0,0 +1,24 @@
+"""Configuration of production server: ``gunicorn -c python:habraproxy.gunicorn_config habraproxy.app:app``.
+
+Values are taken from application settings, so they may be overridden with ``HABRAPROXY_SERVER_*`` environment
+variables.
+"""
+import importlib
+from typing import Any
+
+from habraproxy import settings
+
+bind = settings.SERVER_BIND
+workers = settings.SERVER_WORKERS
+threads = settings.SERVER_THREADS
+worker_class = settings.SERVER_WORKER_CLASS
+timeout = settings.SERVER_TIMEOUT
+# Keep-alive connections from a load balancer are reused between requests
+keepalive = 5
+accesslog = '-'
+
+
+def post_fork(server: Any, worker: Any) -> None:
+    # Application is loaded right after fork, before worker starts its threads, so that processes of transform pool
+    # are forked by a process without threads (otherwise a child may deadlock on a lock held by some thread)
+    importlib.import_module('habraproxy.app')
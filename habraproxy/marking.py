@@ -0,0 +1,50 @@
+import re
+from functools import lru_cache
+from typing import Dict, Match
+
+WORD_PATTERN = r'(?<![A-Za-zА-Яа-яЁё\-_])([A-Za-zА-Яа-яЁё]{6})(?![A-Za-zА-Яа-яЁё\-_™])'
+# Space-separated chunks, that start with "http", are urls - we don't want to touch them, otherwise they'll become
+# broken. Such chunks are matched (and left as is) before any word inside of them could be matched.
+MARK_PATTERN = re.compile(r'(?<![^ ])http[^ ]*|{0}'.format(WORD_PATTERN))
+MARK = '™'
+
+
+class WordMarker:
+    """Adds a mark after each 6-letter word.
+
+    Results for short strings are memoized, because the same labels, hub names, nicknames and so on are repeated
+    many times on every page.
+    """
+
+    def __init__(self, memo_size: int = 4096, memo_max_length: int = 256):
+        self.memo_max_length = memo_max_length
+        self._memoized_mark = lru_cache(maxsize=memo_size)(self._mark)
+
+    def mark(self, text: str) -> str:
+        if len(text) <= self.memo_max_length:
+            return self._memoized_mark(text)
+        return self._mark(text)
+
+    def clear_memo(self) -> None:
+        self._memoized_mark.cache_clear()
+
+    def memo_stats(self) -> Dict[str, float]:
+        cache_info = self._memoized_mark.cache_info()
+        lookups = cache_info.hits + cache_info.misses
+        return {
+            'hits': cache_info.hits,
+            'misses': cache_info.misses,
+            'size': cache_info.currsize,
+            'hit_ratio': cache_info.hits / lookups if lookups else 0,
+        }
+
+    def _mark(self, text: str) -> str:
+        return MARK_PATTERN.sub(_mark_word, text)
+
+
+def _mark_word(match: Match[str]) -> str:
+    word = match.group(1)
+    if word is None:
+        # Url
+        return match.group()
+    return word + MARK
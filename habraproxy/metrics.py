@@ -0,0 +1,264 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Seconds, suitable both for stages that take microseconds and for slow upstream responses
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+NODE_COUNT_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+METRIC_PREFIX = 'habraproxy_'
+
+# Extra samples, which are collected only when metrics are rendered: name, type, help and (labels, value) pairs
+Samples = Tuple[str, str, str, Iterable[Tuple[Dict[str, str], float]]]
+
+
+class Histogram:
+    """Thread-safe histogram with cumulative buckets, split by a single label."""
+
+    def __init__(self, name: str, documentation: str, label_name: str, buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self.buckets = tuple(buckets)
+        self._values: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, observed_value: float) -> None:
+        bucket_index = bisect.bisect_left(self.buckets, observed_value)
+        with self._lock:
+            # Counts per bucket (the last one is "+Inf"), followed by sum of values
+            histogram_values = self._values.get(label_value)
+            if histogram_values is None:
+                histogram_values = self._values[label_value] = [0] * (len(self.buckets) + 2)
+            histogram_values[bucket_index] += 1
+            histogram_values[-1] += observed_value
+
+    def render(self) -> Iterator[str]:
+        yield '# HELP {0} {1}'.format(self.name, self.documentation)
+        yield '# TYPE {0} histogram'.format(self.name)
+        with self._lock:
+            values = {label_value: list(counts) for label_value, counts in self._values.items()}
+        bucket_bounds = [str(bucket) for bucket in self.buckets] + ['+Inf']
+        for label_value, histogram_values in sorted(values.items()):
+            labels = '{0}="{1}"'.format(self.label_name, _escape_label_value(label_value))
+            cumulative_count: float = 0
+            for bucket_bound, bucket_count in zip(bucket_bounds, histogram_values):
+                cumulative_count += bucket_count
+                yield '{0}_bucket{{{1},le="{2}"}} {3}'.format(self.name, labels, bucket_bound, cumulative_count)
+            yield '{0}_sum{{{1}}} {2}'.format(self.name, labels, histogram_values[-1])
+            yield '{0}_count{{{1}}} {2}'.format(self.name, labels, cumulative_count)
+
+
+class Counter:
+    """Thread-safe counter, split by a single label."""
+
+    def __init__(self, name: str, documentation: str, label_name: str):
+        self.name = name
+        self.documentation = documentation
+        self.label_name = label_name
+        self._values: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, label_value: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+        samples = [({self.label_name: label_value}, counter_value) for label_value, counter_value in values.items()]
+        yield from _render_samples((self.name, 'counter', self.documentation, samples))
+
+
+class RequestTimings:
+    """Durations of stages, which were passed while serving a single request."""
+
+    def __init__(self) -> None:
+        self.durations: Dict[str, float] = {}
+
+    def add(self, stage: str, duration: float) -> None:
+        self.durations[stage] = self.durations.get(stage, 0) + duration
+
+    def header(self) -> str:
+        """Value of ``Server-Timing`` header, durations are in milliseconds."""
+        return ', '.join(
+            '{0};dur={1:.1f}'.format(stage, duration * 1000) for stage, duration in self.durations.items()
+        )
+
+
+# Timings of the request, which is served by the current thread. Coroutines of an event loop may share a context (with
+# contextvars backport on Python 3.6), so requests, served by a loop, pass their timings explicitly instead.
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar('request_timings', default=None)
+
+
+class _StageTimer:
+    __slots__ = ('metrics', 'stage', 'request_timings', 'started_at')
+
+    def __init__(self, metrics: 'Metrics', stage: str, request_timings: Optional[RequestTimings]):
+        self.metrics = metrics
+        self.stage = stage
+        self.request_timings = request_timings
+        self.started_at = 0.0
+
+    def __enter__(self) -> None:
+        self.started_at = time.perf_counter()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.metrics.observe_stage(self.stage, time.perf_counter() - self.started_at, self.request_timings)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        """Do nothing, metrics are disabled."""
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Do nothing, metrics are disabled."""
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Instrumentation of page serving.
+
+    Stage durations are recorded into histograms and, if a request is being timed, into its ``Server-Timing``: either
+    into the given timings or into ones of the current context. When metrics are disabled, timing a stage costs just a
+    method call, which returns a shared no-op context manager.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stage_durations = Histogram(
+            METRIC_PREFIX + 'stage_duration_seconds',
+            'Duration of page serving stages.',
+            label_name='stage',
+            buckets=DURATION_BUCKETS,
+        )
+        self.document_nodes = Histogram(
+            METRIC_PREFIX + 'document_nodes',
+            'Number of nodes in processed documents.',
+            label_name='kind',
+            buckets=NODE_COUNT_BUCKETS,
+        )
+        self.upstream_responses = Counter(
+            METRIC_PREFIX + 'upstream_responses_total',
+            'Responses received from origin.',
+            label_name='status',
+        )
+        self.upstream_bytes = Counter(
+            METRIC_PREFIX + 'upstream_bytes_total',
+            'Bytes of page content received from origin.',
+            label_name='status',
+        )
+        self._collectors: List[Callable[[], Iterable[Samples]]] = []
+
+    def stage(self, stage: str, request_timings: Optional[RequestTimings] = None) -> Any:
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, stage, request_timings)
+
+    def observe_stage(self, stage: str, duration: float, request_timings: Optional[RequestTimings] = None) -> None:
+        self.stage_durations.observe(stage, duration)
+        if request_timings is None:
+            request_timings = _request_timings.get()
+        if request_timings is not None:
+            request_timings.add(stage, duration)
+
+    def observe_upstream(self, status: int, size: int) -> None:
+        if self.enabled:
+            self.upstream_responses.increment(str(status))
+            self.upstream_bytes.increment(str(status), size)
+
+    def observe_document(self, root_element: Any) -> None:
+        if self.enabled:
+            self.document_nodes.observe('element', sum(1 for _ in root_element.iter()))
+
+    @contextmanager
+    def time_request(self) -> Iterator[Optional[RequestTimings]]:
+        """Collect durations of all stages, which are passed in the current context, for ``Server-Timing``."""
+        with self.time_async_request() as request_timings:
+            with self.bind_request(request_timings):
+                yield request_timings
+
+    @contextmanager
+    def time_async_request(self) -> Iterator[Optional[RequestTimings]]:
+        """Collect durations of stages, which are given the yielded timings, for ``Server-Timing``."""
+        if not self.enabled:
+            yield None
+            return
+        request_timings = RequestTimings()
+        started_at = time.perf_counter()
+        try:
+            yield request_timings
+        finally:
+            request_timings.add('total', time.perf_counter() - started_at)
+
+    @contextmanager
+    def bind_request(self, request_timings: Optional[RequestTimings]) -> Iterator[None]:
+        """Record stages, which are passed in the current context (for example, in a thread), into the timings."""
+        token = _request_timings.set(request_timings)
+        try:
+            yield
+        finally:
+            _request_timings.reset(token)
+
+    def add_collector(self, collector: Callable[[], Iterable[Samples]]) -> None:
+        """Register a function, which provides additional samples (for example, cache counters) on rendering."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Render all metrics in Prometheus text format."""
+        lines: List[str] = []
+        metrics: Tuple[Union[Histogram, Counter], ...] = (
+            self.stage_durations,
+            self.document_nodes,
+            self.upstream_responses,
+            self.upstream_bytes,
+        )
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for samples in collector():
+                lines.extend(_render_samples(samples))
+        return '\n'.join(lines) + '\n'
+
+
+def collect_cache_samples(page_service: Any) -> Iterator[Samples]:
+    """Counters of page cache and text memo, which are collected anyway for ``/cache-stats``."""
+    if page_service.cache is not None:
+        yield (
+            METRIC_PREFIX + 'page_cache_events_total',
+            'counter',
+            'Page cache lookups and updates by outcome.',
+            [({'outcome': outcome}, count) for outcome, count in page_service.cache.stats.as_dict().items()],
+        )
+    memo_stats = page_service.site_proxy.word_marker.memo_stats()
+    yield (
+        METRIC_PREFIX + 'text_memo_lookups_total',
+        'counter',
+        'Lookups in memo of processed text strings by outcome.',
+        [({'outcome': 'hit'}, memo_stats['hits']), ({'outcome': 'miss'}, memo_stats['misses'])],
+    )
+
+
+def _render_samples(samples: Samples) -> Iterator[str]:
+    name, metric_type, documentation, values = samples
+    yield '# HELP {0} {1}'.format(name, documentation)
+    yield '# TYPE {0} {1}'.format(name, metric_type)
+    for labels, sample_value in sorted(values, key=lambda sample: sorted(sample[0].items())):
+        rendered_labels = ','.join(
+            '{0}="{1}"'.format(label_name, _escape_label_value(label_value))
+            for label_name, label_value in sorted(labels.items())
+        )
+        if labels:
+            yield '{0}{{{1}}} {2}'.format(name, rendered_labels, sample_value)
+        else:
+            yield '{0} {1}'.format(name, sample_value)
+
+
+def _escape_label_value(label_value: str) -> str:
+    return label_value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
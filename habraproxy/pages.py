@@ -0,0 +1,229 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+from functools import partial
+from http import HTTPStatus
+from typing import Iterator, List, Optional
+
+from habraproxy.cache import CacheEntry, PageCache
+from habraproxy.metrics import RequestTimings
+from habraproxy.services import SiteProxy, UpstreamPage
+from habraproxy.singleflight import AsyncSingleFlight, SingleFlight
+from habraproxy.streaming import StreamingTransformer
+from habraproxy.templates import OriginTemplate
+from habraproxy.transform_pool import TransformPool
+
+
+class RecentPages:
+    """Pages, which were requested recently, with time of the last request. Only ``max_size`` latest are kept."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._requested_at: 'OrderedDict[str, float]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, path: str) -> None:
+        with self._lock:
+            self._requested_at[path] = time.time()
+            self._requested_at.move_to_end(path)
+            if len(self._requested_at) > self.max_size:
+                self._requested_at.popitem(last=False)
+
+    def requested_since(self, timestamp: float) -> List[str]:
+        """Paths of pages, which were requested after the timestamp, starting from the latest one."""
+        with self._lock:
+            return [path for path, requested_at in reversed(self._requested_at.items()) if requested_at >= timestamp]
+
+
+class PageService:
+    """Provides processed pages, reusing cached results when possible.
+
+    Concurrent requests for the same page are coalesced, so that it is fetched and processed only once.
+    """
+
+    def __init__(
+        self,
+        site_proxy: SiteProxy,
+        cache: Optional[PageCache] = None,
+        single_flight: Optional[SingleFlight] = None,
+        streaming_transformer: Optional[StreamingTransformer] = None,
+        stream_chunk_size: int = 16 * 1024,
+        bytes_pipeline: bool = False,
+        transform_pool: Optional[TransformPool] = None,
+        recent_pages: Optional[RecentPages] = None,
+    ):
+        self.site_proxy = site_proxy
+        self.cache = cache
+        self.single_flight = single_flight or SingleFlight()
+        self.streaming_transformer = streaming_transformer or StreamingTransformer(site_proxy)
+        self.stream_chunk_size = stream_chunk_size
+        # Process raw content without decoding it into a string and encoding the result back
+        self.bytes_pipeline = bytes_pipeline
+        # Pages are processed in worker processes, if pool is given
+        self.transform_pool = transform_pool
+        # Requested pages are tracked only if somebody needs them (cache warmer)
+        self.recent_pages = recent_pages
+
+    def get_page(self, path: str) -> OriginTemplate:
+        if self.recent_pages is not None:
+            self.recent_pages.add(path)
+        if self.cache is not None:
+            entry = self.cache.lookup(path)
+            if entry is not None and entry.is_fresh():
+                return entry.value
+        return self.single_flight.do(path, lambda: self._load_page(path))
+
+    def iter_page(self, path: str) -> Iterator[OriginTemplate]:
+        """Yield processed page by parts, as soon as they are ready.
+
+        Cached page is returned as a whole. Otherwise page is processed while it is being downloaded - in this case
+        it is not cached, and concurrent requests are not coalesced.
+        """
+        if self.recent_pages is not None:
+            self.recent_pages.add(path)
+        if self.cache is not None:
+            entry = self.cache.lookup(path)
+            if entry is not None and entry.is_fresh():
+                yield entry.value
+                return
+        raw_chunks = self.site_proxy.stream_page(path, chunk_size=self.stream_chunk_size)
+        for processed_chunk in self.streaming_transformer.transform(raw_chunks):
+            yield OriginTemplate.from_string(processed_chunk)
+
+    def warm_page(self, path: str, fresh_for: float = 0) -> OriginTemplate:
+        """Load page into cache, unless it is cached and stays fresh for at least ``fresh_for`` seconds.
+
+        Page, which is going to expire soon, is revalidated in advance, so that visitors never wait for it.
+        """
+        return self.single_flight.do(path, lambda: self._load_page(path, fresh_for=fresh_for))
+
+    def _load_page(self, path: str, fresh_for: float = 0) -> OriginTemplate:
+        if self.cache is None:
+            return self._process(self.site_proxy.fetch_page(path, decode=not self.bytes_pipeline))
+
+        # Page could have been loaded by another process, while this one was waiting for its turn. Recency was already
+        # updated by the visitor's lookup (and must not be updated by cache warmer)
+        entry = self.cache.backend.peek(path)
+        if entry is not None and entry.is_fresh(time.time() + fresh_for):
+            return entry.value
+
+        etag, last_modified = (entry.etag, entry.last_modified) if entry is not None else (None, None)
+        upstream_page = self.site_proxy.fetch_page(
+            path,
+            etag=etag,
+            last_modified=last_modified,
+            decode=not self.bytes_pipeline,
+        )
+        return self._update_page(path, entry, upstream_page)
+
+    def _update_page(self, path: str, entry: Optional[CacheEntry], upstream_page: UpstreamPage) -> OriginTemplate:
+        if self.cache is None:
+            return self._process(upstream_page)
+        if entry is not None and upstream_page.not_modified:
+            return self.cache.refresh(path, entry).value
+
+        page = self._process(upstream_page)
+        if upstream_page.status == HTTPStatus.OK:
+            self.cache.store(
+                path,
+                page,
+                size=page.size_with_variants,
+                etag=upstream_page.etag,
+                last_modified=upstream_page.last_modified,
+            )
+        return page
+
+    def _process(self, upstream_page: UpstreamPage) -> OriginTemplate:
+        if self.transform_pool is not None:
+            # Stages inside of worker processes are not visible here, so only the whole processing is timed
+            with self.site_proxy.metrics.stage('transform_pool'):
+                return self.transform_pool.process(upstream_page, bytes_pipeline=self.bytes_pipeline)
+        return self.site_proxy.process_page(upstream_page, bytes_pipeline=self.bytes_pipeline)
+
+
+class AsyncPageService(PageService):
+    """Page service, which can also be used from an event loop.
+
+    Pages are fetched with the async upstream client, while processing (and storing to cache) is offloaded to
+    ``executor``, so the event loop is free to serve other requests, while pages are being downloaded or processed.
+    Synchronous methods are still available for WSGI views.
+
+    Cross-process locks of ``SingleFlight`` are not used here - concurrent requests are coalesced only inside of the
+    event loop. Once the loop is attached with ``attach_event_loop()``, pages are warmed there too, so that warming
+    and requests of visitors are coalesced with each other.
+    """
+
+    def __init__(
+        self,
+        site_proxy: SiteProxy,
+        executor: Optional[Executor] = None,
+        async_single_flight: Optional[AsyncSingleFlight] = None,
+        **kwargs,
+    ):
+        super().__init__(site_proxy, **kwargs)
+        # Default executor of the event loop is used, if no executor is given
+        self.executor = executor
+        self.async_single_flight = async_single_flight or AsyncSingleFlight()
+        self.event_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def attach_event_loop(self, event_loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        """Set the loop, which serves pages (or None, when it stops)."""
+        self.event_loop = event_loop
+
+    def warm_page(self, path: str, fresh_for: float = 0) -> OriginTemplate:
+        event_loop = self.event_loop
+        if event_loop is None:
+            return super().warm_page(path, fresh_for=fresh_for)
+        # Single flight of the loop is not thread-safe, so it is used from the loop only
+        return asyncio.run_coroutine_threadsafe(self.warm_page_async(path, fresh_for=fresh_for), event_loop).result()
+
+    async def warm_page_async(self, path: str, fresh_for: float = 0) -> OriginTemplate:
+        return await self.async_single_flight.do(path, lambda: self._load_page_async(path, fresh_for=fresh_for))
+
+    async def get_page_async(self, path: str, request_timings: Optional[RequestTimings] = None) -> OriginTemplate:
+        """Return page, timing its stages into ``request_timings`` (if they are given)."""
+        if self.recent_pages is not None:
+            self.recent_pages.add(path)
+        if self.cache is not None:
+            entry = self.cache.lookup(path)
+            if entry is not None and entry.is_fresh():
+                return entry.value
+        return await self.async_single_flight.do(
+            path,
+            lambda: self._load_page_async(path, request_timings=request_timings),
+        )
+
+    async def _load_page_async(
+        self,
+        path: str,
+        fresh_for: float = 0,
+        request_timings: Optional[RequestTimings] = None,
+    ) -> OriginTemplate:
+        entry = self.cache.backend.peek(path) if self.cache is not None else None
+        if entry is not None and entry.is_fresh(time.time() + fresh_for):
+            return entry.value
+
+        etag, last_modified = (entry.etag, entry.last_modified) if entry is not None else (None, None)
+        upstream_page = await self.site_proxy.fetch_page_async(
+            path,
+            etag=etag,
+            last_modified=last_modified,
+            decode=not self.bytes_pipeline,
+            request_timings=request_timings,
+        )
+        loop = asyncio.get_event_loop()
+        update_page = partial(self._update_page_timed, request_timings, path, entry, upstream_page)
+        return await loop.run_in_executor(self.executor, update_page)
+
+    def _update_page_timed(
+        self,
+        request_timings: Optional[RequestTimings],
+        path: str,
+        entry: Optional[CacheEntry],
+        upstream_page: UpstreamPage,
+    ) -> OriginTemplate:
+        # Thread of executor serves only this request, so stages are timed in its context
+        with self.site_proxy.metrics.bind_request(request_timings):
+            return self._update_page(path, entry, upstream_page)
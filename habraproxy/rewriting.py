@@ -0,0 +1,51 @@
+import re
+from typing import AnyStr, Dict, Iterable, Match, Sequence, Tuple
+
+Replacements = Sequence[Tuple[str, str]]
+
+
+class MultiReplacer:
+    """Replaces several literal substrings in a single pass over the text.
+
+    All substrings are compiled into one alternation pattern, so the text is scanned once and copied once, instead
+    of making a new copy for each ``str.replace()`` call.
+    """
+
+    def __init__(self, replacements: Replacements):
+        self.replacements: Dict[str, str] = {}
+        for old, new in replacements:
+            # Empty substring would match at every position of the text
+            if not old:
+                raise ValueError('Replaced substring must not be empty')
+            if old in self.replacements:
+                raise ValueError('Substring is replaced more than once: {0!r}'.format(old))
+            self.replacements[old] = new
+        self.pattern = re.compile(_alternation(self.replacements))
+        # Same replacements for UTF-8 encoded content
+        self.bytes_replacements: Dict[bytes, bytes] = {
+            old.encode('utf-8'): new.encode('utf-8') for old, new in self.replacements.items()
+        }
+        self.bytes_pattern = re.compile(_alternation(self.bytes_replacements))
+
+    def replace(self, text: str) -> str:
+        if not self.replacements:
+            return text
+        return self.pattern.sub(self._substitute, text)
+
+    def replace_bytes(self, content: bytes) -> bytes:
+        if not self.bytes_replacements:
+            return content
+        return self.bytes_pattern.sub(self._substitute_bytes, content)
+
+    def _substitute(self, match: Match[str]) -> str:
+        return self.replacements[match.group()]
+
+    def _substitute_bytes(self, match: Match[bytes]) -> bytes:
+        return self.bytes_replacements[match.group()]
+
+
+def _alternation(alternatives: Iterable[AnyStr]) -> AnyStr:
+    # Longer substrings go first, otherwise substring, which is a prefix of another one, would always win
+    escaped_alternatives = [re.escape(alternative) for alternative in sorted(alternatives, key=len, reverse=True)]
+    separator = b'|' if escaped_alternatives and isinstance(escaped_alternatives[0], bytes) else '|'
+    return separator.join(escaped_alternatives)  # type: ignore
@@ -1,103 +1,426 @@
+import codecs
 import re
+from functools import lru_cache
+from http import HTTPStatus
+from typing import Any, Callable, Dict, Iterator, NamedTuple, Optional, Sequence, Tuple
 
-import requests
 import urlpath
-from lxml import html
+from lxml import etree, html
 
-REPLACE_PATTERN = re.compile(r'(?<![A-Za-zА-Яа-яЁё\-_])([A-Za-zА-Яа-яЁё]{6})(?![A-Za-zА-Яа-яЁё\-_™])')
+from habraproxy.marking import WordMarker
+from habraproxy.metrics import Metrics, RequestTimings
+from habraproxy.rewriting import MultiReplacer, Replacements
+from habraproxy.templates import ORIGIN_PLACEHOLDER, OriginTemplate
+from habraproxy.upstream import AsyncUpstreamClient, UpstreamClient
 
+DOCTYPE_PATTERN = re.compile(r'<!DOCTYPE (.+?)>', flags=re.IGNORECASE)
+# Doctype has to be at the very beginning of the document, there is no need to scan the rest of it
+DOCTYPE_SEARCH_LIMIT = 1024
+HEADER_CHARSET_PATTERN = re.compile(r'charset=["\']?([\w.:-]+)', flags=re.IGNORECASE)
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', flags=re.IGNORECASE)
+# Meta tags with charset are expected to be at the beginning of <head>
+META_CHARSET_SEARCH_LIMIT = 2048
+DEFAULT_ENCODING = 'utf-8'
 
-class SiteProxy:
-    def __init__(self, origin: str):
-        self.origin = urlpath.URL(origin)
+# Content of these elements is left as is
+SKIPPED_TAGS = frozenset(('style', 'script'))
+# Text nodes in a subtree, which are not located inside skipped elements (there is still need to check, that text
+# node is not a tail of skipped element or comment)
+TEXT_NODES = etree.XPath('descendant-or-self::*[not(self::script or self::style)]/text()')
+TEXT_ATTRIBUTES = etree.XPath(
+    'descendant-or-self::*[not(self::script or self::style)]/@title | descendant-or-self::meta/@content',
+)
+# Scripts and styles are not rewritten, because proxy would process them like pages
+URL_ATTRIBUTES = etree.XPath(
+    'descendant-or-self::a/@href | descendant-or-self::iframe/@src | descendant-or-self::form/@action',
+)
+# Images are rewritten only if they are served by asset routes of the proxy (see ASSET_PATH_PREFIXES)
+IMAGE_URL_ATTRIBUTES = etree.XPath('descendant-or-self::*[self::img or self::source]/@src')
+SRCSET_ATTRIBUTES = etree.XPath('descendant-or-self::*[self::img or self::source]/@srcset')
+ASSET_PATH_PREFIXES = ('/images/', '/static/')
+# Candidates of srcset are separated by commas with whitespace, while urls themselves may contain commas
+SRCSET_SEPARATOR_PATTERN = re.compile(r'(,\s+)')
+# Url, which starts with a host (with or without scheme)
+ABSOLUTE_URL_PATTERN = re.compile(r'(?:https?:)?//([^/?#]*)(.*)', flags=re.IGNORECASE | re.DOTALL)
+URL_MEMO_SIZE = 8192
+# Beginning of urls, which point to the proxy
+ORIGIN_URL_PREFIX = 'http://{0}'.format(ORIGIN_PLACEHOLDER)
 
-    def request_page(self, path: str) -> str:
-        url = str(self.origin.joinpath(path))
-        response = requests.get(url)
-        return response.content.decode('utf-8')
+# Changes for content that has already been processed and converted back to text
+POST_PROCESSING_REPLACEMENTS: Tuple[Tuple[str, str], ...] = (
+    # lxml escapes ampersands - we have to restore them manually
+    ('&amp;', '&'),
+    # Restore svg viewBox attribute - it is case-sensitive
+    ('viewbox=', 'viewBox='),
+    # Restore non-breaking spaces as named HTML entities
+    ('\u00a0', '&nbsp;'),
+    # Unescape origin placeholders in urls, so that they can be substituted
+    # (depending on libxml2 version, either only spaces or all unsafe symbols are escaped)
+    ('%7B%7B%20origin%20%7D%7D', ORIGIN_PLACEHOLDER),
+    ('{{%20origin%20}}', ORIGIN_PLACEHOLDER),
+)
+# Urls of static files, which are served by proxy itself
+STATIC_URL_REPLACEMENTS: Tuple[Tuple[str, str], ...] = (
+    ('url(/fonts', 'url(/static/fonts'),
+    ('href="/images', 'href="/static/images'),
+)
+
+
+class UpstreamPage(NamedTuple):
+    status: int
+    # Content is empty, if origin has confirmed that cached version is still valid,
+    # or if it was requested without decoding
+    content: Optional[str]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # Raw content is kept only if page was requested without decoding
+    raw_content: Optional[bytes] = None
+    # Encoding, declared in response headers (if Python knows it)
+    encoding: Optional[str] = None
+    # Size of received content in bytes
+    size: int = 0
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == HTTPStatus.NOT_MODIFIED
+
+
+class PageTransformer:
+    """Processes pages of the site: marks words and points urls of the origin to the proxy.
+
+    Transformer doesn't request anything, so it is cheap to create one, where only processing is needed (for
+    example, in worker processes).
+    """
+
+    def __init__(
+        self,
+        origin: str,
+        extra_replacements: Replacements = (),
+        word_marker: Optional[WordMarker] = None,
+        metrics: Optional[Metrics] = None,
+        origin_static_paths: Sequence[str] = (),
+    ):
+        self.origin = urlpath.URL(origin)
+        self.origin_host = self.origin.hostinfo.lower()
+        self.word_marker = word_marker or WordMarker()
+        self.metrics = metrics or Metrics(enabled=False)
+        # Static files, which are served by proxy itself, even if they are referenced by absolute urls of the origin
+        origin_static_replacements = tuple(
+            (str(self.origin.joinpath(static_path)), '/static/{0}'.format(static_path))
+            for static_path in origin_static_paths
+        )
+        self.post_processor = MultiReplacer(_merge_replacements(
+            POST_PROCESSING_REPLACEMENTS + origin_static_replacements + STATIC_URL_REPLACEMENTS,
+            tuple((old, new) for old, new in extra_replacements),
+        ))
 
     def process_text(self, text: str) -> str:
-        # Split text by spaces and process each word separately.
-        # We _could_ apply regexp to the whole string, but this brings problems in some cases,
-        # for example, when we have urls.
-        chunks = text.split(' ')
-        processed_chunks = []
-        for chunk in chunks:
-            if chunk.startswith('http'):
-                # We don't want to touch urls, otherwise they'll become broken.
-                processed_chunks.append(chunk)
-            else:
-                processed_chunks.append(REPLACE_PATTERN.sub(r'\1™', chunk))
-        return ' '.join(processed_chunks)
+        return self.word_marker.mark(text)
 
     def process_url(self, url_to_process: str) -> str:
-        url = urlpath.URL(url_to_process)
-        if url.hostinfo == self.origin.hostinfo:
-            return str(url.with_components(scheme='http', hostname='{{ origin }}'))
-        elif not url.hostinfo and url.parts[0] == self.origin.hostinfo:
-            # Url does not have schema, but is not relative
-            return str(url.with_components(
-                scheme='http',
-                hostname='{{ origin }}',
-                path='/'.join(url.parts[1:]),
-            ))
-        else:
-            return url_to_process
+        return _rewrite_url(url_to_process, self.origin_host)
 
-    def process_content(self, content: str) -> str:
-        # Manually extract doctype, because lxml looses it.
-        doctype = None
-        doctype_search = re.search(r'<!DOCTYPE (.+?)>', content, flags=re.IGNORECASE)
-        if doctype_search:
-            doctype = '<!DOCTYPE {0}>'.format(doctype_search.group(1))
+    def clear_memos(self) -> None:
+        """Forget memoized texts and urls (memo of urls is shared by the whole process), for example, in benchmarks."""
+        self.word_marker.clear_memo()
+        _rewrite_url.cache_clear()
+
+    def process_asset_url(self, url_to_process: str) -> str:
+        """Point url to the proxy, only if proxy serves it as an asset (other paths are processed like pages)."""
+        processed_url = self.process_url(url_to_process)
+        if processed_url[len(ORIGIN_URL_PREFIX):].startswith(ASSET_PATH_PREFIXES):
+            return processed_url
+        return url_to_process
 
-        root_element = html.document_fromstring(content)
-        self._process_element(root_element)
+    def process_srcset(self, srcset: str) -> str:
+        """Process each url in a list of image candidates, like ``image.png 1x, image@2x.png 2x``."""
+        if 'data:' in srcset:
+            # Data urls may contain anything, including separators of candidates
+            return srcset
+        parts = SRCSET_SEPARATOR_PATTERN.split(srcset)
+        # Candidates are at even positions, separators between them are kept as is
+        for index in range(0, len(parts), 2):
+            leading_space, url, descriptor = _split_candidate(parts[index])
+            parts[index] = leading_space + self.process_asset_url(url) + descriptor
+        return ''.join(parts)
 
-        processed_content = html.tostring(root_element, encoding='unicode', method='html', doctype=doctype)
-        processed_content = self._post_process_content(processed_content)
+    def process_content(self, content: str) -> str:
+        doctype = extract_doctype(content)
+        with self.metrics.stage('parse'):
+            root_element = html.document_fromstring(content)
+        self.metrics.observe_document(root_element)
+        with self.metrics.stage('process'):
+            self.process_element(root_element)
+
+        with self.metrics.stage('serialize'):
+            processed_content = html.tostring(root_element, encoding='unicode', method='html', doctype=doctype)
+        with self.metrics.stage('post_process'):
+            processed_content = self._post_process_content(processed_content)
         return processed_content
 
-    def _process_element_content(self, element: html.HtmlMixin, attribute_name: str) -> None:
-        value = getattr(element, attribute_name, None)
-        if value is not None:
-            setattr(element, attribute_name, self.process_text(value))
+    def process_page(self, upstream_page: UpstreamPage, bytes_pipeline: bool = False) -> OriginTemplate:
+        """Process received page into a template, that can be rendered for any origin."""
+        if bytes_pipeline:
+            processed_content = self.process_content_bytes(upstream_page.raw_content or b'', upstream_page.encoding)
+            return OriginTemplate.from_bytes(processed_content)
+        return OriginTemplate.from_string(self.process_content(upstream_page.content or ''))
+
+    def process_content_bytes(self, content: bytes, encoding: Optional[str] = None) -> bytes:
+        """Same as ``process_content()``, but works with raw content and returns UTF-8 encoded result.
+
+        Content is never decoded into a separate string - parser reads it directly, using given encoding, or the one,
+        declared in the document itself.
+        """
+        head = content[:DOCTYPE_SEARCH_LIMIT].decode('ascii', errors='ignore')
+        doctype = extract_doctype(head)
+        encoding = encoding or detect_encoding(content)
+        with self.metrics.stage('parse'):
+            root_element = html.document_fromstring(content, parser=html.HTMLParser(encoding=encoding))
+        self.metrics.observe_document(root_element)
+        with self.metrics.stage('process'):
+            self.process_element(root_element)
 
-    def _process_element_attribute(self, element: html.HtmlMixin, attribute_name: str) -> None:
-        if attribute_name in element.attrib:
-            element.attrib[attribute_name] = self.process_text(element.attrib[attribute_name])
+        with self.metrics.stage('serialize'):
+            processed_content = html.tostring(root_element, encoding='utf-8', method='html', doctype=doctype)
+        with self.metrics.stage('post_process'):
+            return self.post_processor.replace_bytes(processed_content)
 
-    def _process_element(self, element: html.HtmlMixin) -> html.HtmlMixin:
-        if element.tag in {'style', 'script'} or isinstance(element, html.HtmlComment):
-            # Don't process styles, scripts and HTML comments
-            # (Even if they have some text to replace, it would require too much efforts to parse it correctly)
+    def process_element(self, element: html.HtmlMixin, with_tail: bool = True) -> html.HtmlMixin:
+        """Process the whole subtree of an element.
+
+        Instead of walking through every element, compiled XPath expressions select only nodes, that may need
+        changes, skipping styles, scripts and HTML comments at all
+        (Even if they have some text to replace, it would require too much efforts to parse it correctly).
+        """
+        if is_skipped(element):
             return element
-        self._process_element_content(element, 'text')
-        self._process_element_content(element, 'tail')
-        self._process_element_attribute(element, 'title')
-        if element.tag == 'meta':
-            self._process_element_attribute(element, 'content')
-        for child in element:
-            self._process_element(child)
-        if element.tag == 'a' and 'href' in element.attrib:
-            element.attrib['href'] = self.process_url(element.attrib['href'])
+        if with_tail:
+            self._process_tail(element)
+        for text_node in TEXT_NODES(element):
+            self._process_text_node(text_node)
+        attribute_processors = (
+            (TEXT_ATTRIBUTES, self.process_text),
+            (URL_ATTRIBUTES, self.process_url),
+            (IMAGE_URL_ATTRIBUTES, self.process_asset_url),
+            (SRCSET_ATTRIBUTES, self.process_srcset),
+        )
+        for attributes, processor in attribute_processors:
+            for attribute_value in attributes(element):
+                self._process_attribute(attribute_value, processor)
         return element
 
+    def _process_tail(self, element: html.HtmlMixin) -> None:
+        if element.tail is not None:
+            processed_tail = self.process_text(element.tail)
+            if processed_tail != element.tail:
+                element.tail = processed_tail
+
+    def _process_text_node(self, text_node: Any) -> None:
+        parent = text_node.getparent()
+        # XPath results keep references to the tree, they must not get into memoized values
+        text = str(text_node)
+        if text_node.is_tail:
+            if is_skipped(parent):
+                return
+            processed_text = self.process_text(text)
+            if processed_text != text:
+                parent.tail = processed_text
+        else:
+            processed_text = self.process_text(text)
+            if processed_text != text:
+                parent.text = processed_text
+
+    def _process_attribute(self, attribute_value: Any, processor: Callable[[str], str]) -> None:
+        value = str(attribute_value)
+        processed_value = processor(value)
+        if processed_value != value:
+            attribute_value.getparent().attrib[attribute_value.attrname] = processed_value
+
     def _post_process_content(self, processed_content: str) -> str:
         """Make additional changes for content that has already been processed and converted back to text."""
-        # lxml escapes ampersands - we have to restore them manually
-        processed_content = processed_content.replace('&amp;', '&')
-        # Restore svg viewBox attribute - it is case-sensitive
-        processed_content = processed_content.replace('viewbox=', 'viewBox=')
-        # Restore non-breaking spaces as named HTML entities
-        processed_content = processed_content.replace('\u00a0', '&nbsp;')
-        # Unescape urls - Jinja will take care about them
-        processed_content = processed_content.replace('%7B%7B%20origin%20%7D%7D', '{{ origin }}')
-        # Update static urls
-        processed_content = processed_content.replace(
-            'https://habr.com/images/1567794742/common-svg-sprite.svg',
-            '/static/images/1567794742/common-svg-sprite.svg',
+        return self.post_processor.replace(processed_content)
+
+
+class SiteProxy(PageTransformer):
+    def __init__(
+        self,
+        origin: str,
+        client: Optional[UpstreamClient] = None,
+        extra_replacements: Replacements = (),
+        word_marker: Optional[WordMarker] = None,
+        async_client: Optional[AsyncUpstreamClient] = None,
+        metrics: Optional[Metrics] = None,
+        origin_static_paths: Sequence[str] = (),
+    ):
+        super().__init__(
+            origin,
+            extra_replacements=extra_replacements,
+            word_marker=word_marker,
+            metrics=metrics,
+            origin_static_paths=origin_static_paths,
         )
-        processed_content = processed_content.replace('url(/fonts', 'url(/static/fonts')
-        processed_content = processed_content.replace('href="/images', 'href="/static/images')
-        return processed_content
+        # Client is expected to be shared, but fallback to a private one, so that proxy can be used standalone
+        self.client = client or UpstreamClient()
+        self._async_client = async_client
+
+    @property
+    def async_client(self) -> AsyncUpstreamClient:
+        # Private async client is created only when it is needed, so that synchronous usage has nothing to close
+        if self._async_client is None:
+            self._async_client = AsyncUpstreamClient()
+        return self._async_client
+
+    def request_page(self, path: str) -> str:
+        return self.fetch_page(path).content or ''
+
+    def fetch_page(
+        self,
+        path: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        decode: bool = True,
+    ) -> UpstreamPage:
+        """Request page, conditionally, if validators of previously received version are given.
+
+        If ``decode`` is false, only raw content is returned, without making a decoded copy of it.
+        """
+        url, headers = self._page_request(path, etag, last_modified)
+        with self.metrics.stage('fetch'):
+            upstream_page = _upstream_page(self.client.get(url, headers=headers), decode)
+        self.metrics.observe_upstream(upstream_page.status, upstream_page.size)
+        return upstream_page
+
+    async def fetch_page_async(
+        self,
+        path: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        decode: bool = True,
+        request_timings: Optional[RequestTimings] = None,
+    ) -> UpstreamPage:
+        """Same as ``fetch_page()``, but without blocking the event loop while waiting for the origin."""
+        url, headers = self._page_request(path, etag, last_modified)
+        with self.metrics.stage('fetch', request_timings):
+            upstream_page = _upstream_page(await self.async_client.get(url, headers=headers), decode)
+        self.metrics.observe_upstream(upstream_page.status, upstream_page.size)
+        return upstream_page
+
+    def stream_page(self, path: str, chunk_size: int = 16 * 1024) -> Iterator[bytes]:
+        """Request page and yield its raw content by chunks, as soon as they are received."""
+        url = str(self.origin.joinpath(path))
+        response = self.client.get(url, stream=True)
+        try:
+            yield from response.iter_content(chunk_size=chunk_size)
+        finally:
+            response.close()
+
+    def _page_request(
+        self,
+        path: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+    ) -> Tuple[str, Dict[str, str]]:
+        url = str(self.origin.joinpath(path))
+        headers: Dict[str, str] = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return url, headers
+
+
+def extract_doctype(content: str) -> Optional[str]:
+    # Manually extract doctype, because lxml looses it.
+    doctype_search = DOCTYPE_PATTERN.search(content, 0, DOCTYPE_SEARCH_LIMIT)
+    if doctype_search:
+        return '<!DOCTYPE {0}>'.format(doctype_search.group(1))
+    return None
+
+
+def _upstream_page(response: Any, decode: bool) -> UpstreamPage:
+    # Both requests and httpx responses have the same interface
+    encoding = _header_charset(response.headers.get('Content-Type', ''))
+    raw_content = None
+    content = None
+    size = 0
+    if response.status_code != HTTPStatus.NOT_MODIFIED:
+        raw_content = response.content
+        size = len(raw_content)
+        if decode:
+            # Pages are processed anyway, even if some bytes don't match declared encoding
+            content = raw_content.decode(encoding or detect_encoding(raw_content), errors='replace')
+            raw_content = None
+    return UpstreamPage(
+        status=response.status_code,
+        content=content,
+        etag=response.headers.get('ETag'),
+        last_modified=response.headers.get('Last-Modified'),
+        raw_content=raw_content,
+        encoding=encoding,
+        size=size,
+    )
+
+
+def detect_encoding(content: bytes) -> str:
+    """Find encoding, declared in <meta> tag of the document."""
+    meta_charset_search = META_CHARSET_PATTERN.search(content, 0, META_CHARSET_SEARCH_LIMIT)
+    if meta_charset_search:
+        return _known_encoding(meta_charset_search.group(1).decode('ascii')) or DEFAULT_ENCODING
+    return DEFAULT_ENCODING
+
+
+def _header_charset(content_type: str) -> Optional[str]:
+    charset_search = HEADER_CHARSET_PATTERN.search(content_type)
+    if charset_search:
+        return _known_encoding(charset_search.group(1))
+    return None
+
+
+def _known_encoding(encoding: str) -> Optional[str]:
+    # Declared charset may be misspelled or not supported by Python, like "utf8mb4"
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        return None
+    return encoding
+
+
+def _split_candidate(candidate: str) -> Tuple[str, str, str]:
+    """Split image candidate into leading whitespace, url and the rest (descriptor with whitespace around it)."""
+    url_start = len(candidate) - len(candidate.lstrip())
+    url_end = url_start
+    while url_end < len(candidate) and not candidate[url_end].isspace():
+        url_end += 1
+    return candidate[:url_start], candidate[url_start:url_end], candidate[url_end:]
+
+
+def _merge_replacements(built_in: Replacements, extra: Replacements) -> Replacements:
+    """Extra replacements override built-in ones for the same substrings."""
+    overridden = {old for old, _ in extra}
+    return tuple((old, new) for old, new in built_in if old not in overridden) + tuple(extra)
+
+
+def is_skipped(element: html.HtmlMixin) -> bool:
+    # Comments and processing instructions have factory functions instead of string tags
+    return not isinstance(element.tag, str) or element.tag in SKIPPED_TAGS
+
+
+@lru_cache(maxsize=URL_MEMO_SIZE)
+def _rewrite_url(url: str, origin_host: str) -> str:
+    """Point url to the proxy, if it leads to the origin host.
+
+    Pages have hundreds of links, and most of them are repeated, so results are memoized for the whole process.
+    """
+    absolute_url_match = ABSOLUTE_URL_PATTERN.fullmatch(url)
+    if absolute_url_match is not None:
+        host, rest = absolute_url_match.groups()
+        # Drop user info, if any
+        host = host.rpartition('@')[2]
+        if host.lower() == origin_host:
+            return ORIGIN_URL_PREFIX + rest
+        return url
+    host_end = len(origin_host)
+    if url[:host_end].lower() == origin_host and url[host_end:host_end + 1] in {'', '/', '?', '#'}:
+        # Url does not have schema, but is not relative
+        return ORIGIN_URL_PREFIX + url[host_end:]
+    return url
@@ -0,0 +1,126 @@
+"""Default application settings.
+
+Every value may be overridden with an environment variable of the same name prefixed with ``HABRAPROXY_``,
+for example ``HABRAPROXY_UPSTREAM_POOL_SIZE=50``.
+"""
+import json
+import multiprocessing
+import os
+from typing import Any
+
+
+def _env_str(name: str, default: str) -> str:
+    return os.environ.get('HABRAPROXY_{0}'.format(name), default)
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get('HABRAPROXY_{0}'.format(name), default))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get('HABRAPROXY_{0}'.format(name), default))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    env_value = os.environ.get('HABRAPROXY_{0}'.format(name))
+    return default if env_value is None else env_value.lower() in {'1', 'true', 'yes', 'on'}
+
+
+def _env_json(name: str, default: Any) -> Any:
+    env_value = os.environ.get('HABRAPROXY_{0}'.format(name))
+    return default if env_value is None else json.loads(env_value)
+
+
+# Site, which is proxied. Links to its host are rewritten to point to the proxy.
+ORIGIN = _env_str('ORIGIN', 'https://habr.com')
+
+# Upstream HTTP client
+UPSTREAM_POOL_SIZE = _env_int('UPSTREAM_POOL_SIZE', 10)
+UPSTREAM_MAX_RETRIES = _env_int('UPSTREAM_MAX_RETRIES', 2)
+UPSTREAM_BACKOFF_FACTOR = _env_float('UPSTREAM_BACKOFF_FACTOR', 0.2)
+UPSTREAM_CONNECT_TIMEOUT = _env_float('UPSTREAM_CONNECT_TIMEOUT', 3.05)
+UPSTREAM_READ_TIMEOUT = _env_float('UPSTREAM_READ_TIMEOUT', 10)
+
+# Cache of processed pages. Backend is one of "memory", "disk" or "none".
+PAGE_CACHE_BACKEND = _env_str('PAGE_CACHE_BACKEND', 'memory')
+PAGE_CACHE_TTL = _env_float('PAGE_CACHE_TTL', 60)
+PAGE_CACHE_MAX_SIZE = _env_int('PAGE_CACHE_MAX_SIZE', 64 * 1024 * 1024)
+PAGE_CACHE_DIR = _env_str('PAGE_CACHE_DIR', '/tmp/habraproxy/pages')  # noqa: S108
+
+# Cache of images, fonts and other static files, downloaded from habr.com. ASSET_MAX_AGE is lifetime of assets in
+# browser caches, in seconds.
+ASSET_CACHE_DIR = _env_str('ASSET_CACHE_DIR', '/tmp/habraproxy/assets')  # noqa: S108
+ASSET_CACHE_MAX_SIZE = _env_int('ASSET_CACHE_MAX_SIZE', 256 * 1024 * 1024)
+ASSET_MAX_AGE = _env_int('ASSET_MAX_AGE', 7 * 24 * 60 * 60)
+
+# Compression of pages: gzip level (1-9) and brotli quality (0-11, brotli package has to be installed). Compressed
+# variants are reused while page is cached, so high levels are affordable. Smaller pages are not compressed. With disk
+# page cache variants are kept in memory of each process, within COMPRESSION_VARIANT_CACHE_SIZE bytes.
+COMPRESSION_GZIP_LEVEL = _env_int('COMPRESSION_GZIP_LEVEL', 9)
+COMPRESSION_BROTLI_QUALITY = _env_int('COMPRESSION_BROTLI_QUALITY', 9)
+COMPRESSION_MIN_SIZE = _env_int('COMPRESSION_MIN_SIZE', 1024)
+COMPRESSION_VARIANT_CACHE_SIZE = _env_int('COMPRESSION_VARIANT_CACHE_SIZE', 16 * 1024 * 1024)
+
+# Background warming of page cache: seeds (urls of the proxy) and pages, which were requested within PAGE_CACHE_TTL,
+# are crawled every WARMER_INTERVAL seconds, following links up to WARMER_MAX_DEPTH. Pages, which are not cached, are
+# loaded, while seeds and requested pages are revalidated WARMER_REFRESH_AHEAD seconds before they expire. At most
+# WARMER_MAX_PAGES pages are visited per round, origin is requested by WARMER_CONCURRENCY threads at most
+# WARMER_RATE_LIMIT times per second. With disk page cache only one server worker process warms it, otherwise each one
+# warms its own cache, and these limits are split between SERVER_WORKERS processes.
+WARMER = _env_bool('WARMER', False)
+WARMER_SEEDS = _env_json('WARMER_SEEDS', ['/ru/', '/ru/top/', '/ru/news/', '/ru/hubs/', '/ru/flows/develop/'])
+WARMER_INTERVAL = _env_float('WARMER_INTERVAL', 10)
+WARMER_REFRESH_AHEAD = _env_float('WARMER_REFRESH_AHEAD', 15)
+WARMER_MAX_DEPTH = _env_int('WARMER_MAX_DEPTH', 1)
+WARMER_MAX_PAGES = _env_int('WARMER_MAX_PAGES', 200)
+WARMER_CONCURRENCY = _env_int('WARMER_CONCURRENCY', 4)
+WARMER_RATE_LIMIT = _env_float('WARMER_RATE_LIMIT', 5)
+
+# Instrumentation: durations of page serving stages (in Server-Timing header of pages), upstream responses and cache
+# counters, which are available at /metrics in Prometheus text format. Disabled instrumentation costs almost nothing.
+METRICS = _env_bool('METRICS', False)
+
+# Directory for lock files, which coalesce loading of the same page between processes (requires "disk" page cache).
+# Empty value means that loading is coalesced only between threads of the same process.
+SINGLE_FLIGHT_LOCK_DIR = _env_str('SINGLE_FLIGHT_LOCK_DIR', '')
+
+# Memo of processed text nodes: number of remembered strings and max length of a string, that may be remembered
+TEXT_MEMO_SIZE = _env_int('TEXT_MEMO_SIZE', 4096)
+TEXT_MEMO_MAX_LENGTH = _env_int('TEXT_MEMO_MAX_LENGTH', 256)
+
+# Paths of static files, which are bundled with proxy (at habraproxy/static), so their absolute urls of the origin are
+# replaced with local ones
+ORIGIN_STATIC_PATHS = _env_json('ORIGIN_STATIC_PATHS', ['images/1567794742/common-svg-sprite.svg'])
+# Additional literal replacements for processed pages, as a list of [old, new] pairs. They are applied together with
+# built-in ones in a single pass and override them for the same substrings, for example:
+# '[["/images/1567794742/", "/static/images/1567794742/"]]'
+EXTRA_REPLACEMENTS = _env_json('EXTRA_REPLACEMENTS', [])
+
+# Streaming mode: pages, that are not cached, are processed and sent to client by parts while they are being
+# downloaded. Parts are emitted, when an element not deeper than STREAMING_FLUSH_DEPTH is closed (<html> has depth 0).
+STREAMING = _env_bool('STREAMING', False)
+STREAMING_FLUSH_DEPTH = _env_int('STREAMING_FLUSH_DEPTH', 3)
+STREAMING_CHUNK_SIZE = _env_int('STREAMING_CHUNK_SIZE', 16 * 1024)
+
+# Bytes pipeline: raw content is parsed in encoding, declared by habr.com, and serialized directly to UTF-8 bytes,
+# without intermediate decoded copies of the page.
+BYTES_PIPELINE = _env_bool('BYTES_PIPELINE', False)
+
+# Async (ASGI) serving mode: max number of connections to habr.com, shared by all in-flight requests of a process, and
+# number of threads, which process pages (0 means default number of threads of ThreadPoolExecutor).
+ASYNC_UPSTREAM_POOL_SIZE = _env_int('ASYNC_UPSTREAM_POOL_SIZE', 100)
+ASYNC_TRANSFORM_WORKERS = _env_int('ASYNC_TRANSFORM_WORKERS', 0)
+
+# Production server (gunicorn, see habraproxy/gunicorn_config.py). Use "uvicorn.workers.UvicornWorker" worker class
+# together with habraproxy.asgi:application for async mode.
+SERVER_BIND = _env_str('SERVER_BIND', '0.0.0.0:5000')  # noqa: S104
+SERVER_WORKERS = _env_int('SERVER_WORKERS', multiprocessing.cpu_count())
+SERVER_THREADS = _env_int('SERVER_THREADS', 8)
+SERVER_WORKER_CLASS = _env_str('SERVER_WORKER_CLASS', 'gthread')
+SERVER_TIMEOUT = _env_int('SERVER_TIMEOUT', 30)
+
+# Pool of processes, which process pages, per server worker (0 means that pages are processed by request threads).
+# At most TRANSFORM_POOL_SIZE + TRANSFORM_QUEUE_SIZE pages are processed or wait for processing, requests above this
+# limit receive 503 response.
+TRANSFORM_POOL_SIZE = _env_int('TRANSFORM_POOL_SIZE', 0)
+TRANSFORM_QUEUE_SIZE = _env_int('TRANSFORM_QUEUE_SIZE', 16)
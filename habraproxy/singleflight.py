@@ -0,0 +1,104 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class InterruptedCallError(RuntimeError):
+    """Shared execution was interrupted (for example, by worker timeout), so it has no result for waiting callers."""
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[Exception] = None
+
+
+def _wait(call: _Call) -> Any:
+    call.done.wait()
+    if call.error is not None:
+        raise call.error
+    return call.result
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into a single execution.
+
+    First caller for a key executes the function, while all callers that come for the same key before it is
+    finished just wait and receive the same result (or the same exception).
+
+    If ``lock_dir`` is given, execution is additionally serialized between processes with lock files. Keys are
+    spread over ``lock_stripes`` files, so their number does not grow with the number of keys (but different keys
+    sometimes wait for each other). Other processes don't receive the result directly, so the function itself should
+    check some shared storage (for example, disk cache) for a result that was produced while it was waiting for the
+    lock.
+    """
+
+    def __init__(self, lock_dir: Optional[str] = None, lock_stripes: int = 64):
+        self.lock_dir = lock_dir
+        self.lock_stripes = lock_stripes
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key: str, function: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            return _wait(call)
+
+        try:
+            call.result = self._execute(key, function)
+        except Exception as error:
+            call.error = error
+            raise
+        except BaseException as error:
+            # SystemExit or KeyboardInterrupt belong to the leader only, but waiters must not take None for a result
+            call.error = InterruptedCallError('Execution for {0} was interrupted'.format(key))
+            call.error.__cause__ = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _execute(self, key: str, function: Callable[[], Any]) -> Any:
+        if not self.lock_dir:
+            return function()
+        key_hash = int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:8], 'big')
+        lock_name = 'stripe-{0}.lock'.format(key_hash % self.lock_stripes)
+        with open(os.path.join(self.lock_dir, lock_name), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                return function()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class AsyncSingleFlight:
+    """Asyncio counterpart of ``SingleFlight``, for calls made from a single event loop.
+
+    Waiting callers are shielded from the shared execution: if one of them is cancelled (for example, because its
+    client has disconnected), the others still receive the result.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, 'asyncio.Future[Any]'] = {}
+
+    async def do(self, key: str, function: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(function())
+            self._calls[key] = call
+            call.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(call)
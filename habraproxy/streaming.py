@@ -0,0 +1,151 @@
+import re
+from html import escape
+from typing import Iterable, Iterator, List, Optional, Set
+
+from lxml import etree, html
+
+from habraproxy.services import DOCTYPE_SEARCH_LIMIT, SiteProxy, extract_doctype, is_skipped
+
+PARSER_EVENTS = ('start', 'end', 'comment', 'pi')
+RAW_TEXT_TAG_PATTERN = re.compile(rb'<(/?)(?:script|style)\b', flags=re.IGNORECASE)
+
+
+class StreamingTransformer:
+    """Processes page while it is being downloaded.
+
+    Raw content is fed into an incremental parser. As soon as an element, which is located not deeper than
+    ``flush_depth`` (``<html>`` has depth 0, ``<head>`` and ``<body>`` - 1 and so on) is closed, it is processed,
+    serialized and emitted, so client may start receiving the page before the whole of it has been downloaded.
+    Emitted elements are removed from the tree, so memory usage does not grow with the page size.
+
+    Output is the same as of ``SiteProxy.process_content()``.
+    """
+
+    def __init__(self, site_proxy: SiteProxy, flush_depth: int = 3, encoding: Optional[str] = 'utf-8'):
+        self.site_proxy = site_proxy
+        self.flush_depth = flush_depth
+        self.encoding = encoding
+
+    def transform(self, chunks: Iterable[bytes]) -> Iterator[str]:
+        return _TransformationState(self).run(chunks)
+
+
+class _TransformationState:
+    """State of a single page transformation."""
+
+    def __init__(self, transformer: StreamingTransformer):
+        self.site_proxy = transformer.site_proxy
+        self.flush_depth = transformer.flush_depth
+        self.parser = etree.HTMLPullParser(events=PARSER_EVENTS, encoding=transformer.encoding)
+        self.parser.set_element_class_lookup(html.HtmlElementClassLookup())
+        self.head: Optional[bytes] = b''
+        # Elements, which start tag and text have been already emitted
+        self.opened_elements: Set[html.HtmlMixin] = set()
+        # Last emitted element - its tail has to be emitted later, when it is completely parsed
+        self.pending_tail_element: Optional[html.HtmlMixin] = None
+
+    def run(self, chunks: Iterable[bytes]) -> Iterator[str]:
+        for chunk in _with_whole_raw_text_elements(chunks):
+            if self.head is not None and len(self.head) < DOCTYPE_SEARCH_LIMIT:
+                self.head += chunk
+            self.parser.feed(chunk)
+            yield from self._handle_events()
+        self.parser.close()
+        yield from self._handle_events()
+
+    def _handle_events(self) -> Iterator[str]:
+        output: List[str] = []
+        for event, node in self.parser.read_events():
+            if event != 'start' and self._depth(node) <= self.flush_depth:
+                if self.head is not None:
+                    output.extend(self._start())
+                output.extend(self._flush(node))
+        if output:
+            yield self.site_proxy.post_processor.replace(''.join(output))
+
+    def _start(self) -> Iterator[str]:
+        # Doctype is already parsed at the moment, when the first element is closed
+        doctype = extract_doctype((self.head or b'').decode('utf-8', errors='ignore'))
+        self.head = None
+        if doctype:
+            yield '{0}\n'.format(doctype)
+
+    def _flush(self, node: html.HtmlMixin) -> Iterator[str]:
+        yield from self._flush_pending_tail()
+        parent = node.getparent()
+        if parent is not None:
+            yield from self._open(parent)
+        if node in self.opened_elements:
+            self.opened_elements.remove(node)
+            yield '</{0}>'.format(node.tag)
+        else:
+            self.site_proxy.process_element(node, with_tail=False)
+            yield html.tostring(node, encoding='unicode', method='html', with_tail=False)
+        self.pending_tail_element = node
+
+    def _flush_pending_tail(self) -> Iterator[str]:
+        element = self.pending_tail_element
+        if element is None:
+            return
+        self.pending_tail_element = None
+        if element.tail:
+            tail = element.tail if is_skipped(element) else self.site_proxy.process_text(element.tail)
+            yield escape(tail, quote=False)
+        parent = element.getparent()
+        if parent is not None:
+            # Element is completely emitted and is not needed anymore
+            parent.remove(element)
+
+    def _open(self, element: html.HtmlMixin) -> Iterator[str]:
+        if element in self.opened_elements:
+            return
+        parent = element.getparent()
+        if parent is not None:
+            yield from self._open(parent)
+        self.opened_elements.add(element)
+        # Serialize a childless copy of the element, and drop its end tag (which is omitted for some empty elements)
+        element_copy = element.makeelement(element.tag, element.attrib)
+        element_copy.text = element.text
+        self.site_proxy.process_element(element_copy, with_tail=False)
+        serialized_element = html.tostring(element_copy, encoding='unicode', method='html')
+        end_tag = '</{0}>'.format(element.tag)
+        if serialized_element.endswith(end_tag):
+            serialized_element = serialized_element[:-len(end_tag)]
+        yield serialized_element
+
+    def _depth(self, node: html.HtmlMixin) -> int:
+        depth = 0
+        parent = node.getparent()
+        while parent is not None:
+            depth += 1
+            parent = parent.getparent()
+        return depth
+
+
+def _with_whole_raw_text_elements(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Regroup chunks, so that they are split only after a tag and never inside of a script or style.
+
+    libxml2 push parser may lose the end of such element, if it is split between chunks, and treat all the rest of
+    the document as its content.
+    """
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        split_position = _split_position(buffer)
+        if split_position:
+            yield buffer[:split_position]
+            buffer = buffer[split_position:]
+    if buffer:
+        yield buffer
+
+
+def _split_position(buffer: bytes) -> int:
+    """Position after the last tag, which is not located inside of an unclosed script or style (0 if there is none)."""
+    safe_length = len(buffer)
+    for tag_match in RAW_TEXT_TAG_PATTERN.finditer(buffer):
+        if tag_match.group(1):
+            # End tag
+            safe_length = len(buffer)
+        elif safe_length == len(buffer):
+            safe_length = tag_match.start()
+    return buffer.rfind(b'>', 0, safe_length) + 1
@@ -0,0 +1,88 @@
+import hashlib
+import html
+import re
+from typing import Any, Dict, Iterable, Iterator, Match, Optional, Tuple, cast
+
+ORIGIN_PLACEHOLDER = '{{ origin }}'
+# Rest of url after the placeholder, which ends with a quote of attribute value
+ORIGIN_URL_REST_PATTERN = re.compile(rb'[^"\'\s<>]*')
+# End of the segment before placeholder of a link: among rewritten urls only <a> elements have "href" attribute
+# (and xlink:href of svg is not preceded by whitespace)
+LINK_PLACEHOLDER_PREFIX_PATTERN = re.compile(rb'\shref=["\']?http://\Z')
+LINK_PLACEHOLDER_PREFIX_MAX_LENGTH = 16
+# Rendered variants of a page may take this share of the size of the page itself
+VARIANTS_SIZE_RATIO = 0.75
+
+
+class OriginTemplate:
+    """Processed page, split into static segments around origin placeholders.
+
+    Splitting is done once per page, after that rendering for a particular origin is just a join of byte strings.
+    Unlike rendering page as a Jinja template, this does not execute anything that page content itself may contain.
+    """
+
+    __slots__ = ('segments', 'variants', 'variants_budget', '_digest')
+
+    def __init__(self, segments: Iterable[bytes]):
+        self.segments = tuple(segments)
+        # Rendered (and usually compressed) content for particular origins, which is reused while page is cached
+        self.variants: Dict[Tuple[str, str], bytes] = {}
+        # Bytes, which are left for variants
+        self.variants_budget = int(self.size * VARIANTS_SIZE_RATIO)
+        self._digest: Optional[bytes] = None
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, OriginTemplate) and self.segments == other.segments
+
+    def __repr__(self) -> str:
+        return '<OriginTemplate: {0} segments, {1} bytes>'.format(len(self.segments), self.size)
+
+    @classmethod
+    def from_string(cls, content: str, placeholder: str = ORIGIN_PLACEHOLDER) -> 'OriginTemplate':
+        return cls(segment.encode('utf-8') for segment in content.split(placeholder))
+
+    @classmethod
+    def from_bytes(cls, content: bytes, placeholder: str = ORIGIN_PLACEHOLDER) -> 'OriginTemplate':
+        return cls(content.split(placeholder.encode('utf-8')))
+
+    @property
+    def size(self) -> int:
+        return sum(len(segment) for segment in self.segments)
+
+    @property
+    def size_with_variants(self) -> int:
+        """Size of the page together with all variants, that it may ever have."""
+        return self.size + int(self.size * VARIANTS_SIZE_RATIO)
+
+    def add_variant(self, key: Tuple[str, str], content: bytes) -> bool:
+        """Remember rendered content, if it fits into the budget. Once something doesn't fit, budget is closed."""
+        if len(content) > self.variants_budget:
+            # Otherwise the same content would be rendered again and again
+            self.variants_budget = 0
+            return False
+        self.variants[key] = content
+        self.variants_budget -= len(content)
+        return True
+
+    def fingerprint(self, origin: str) -> str:
+        """Identifier of the page, rendered for the origin, which changes when page content does."""
+        if self._digest is None:
+            template_hash = hashlib.sha256()
+            for segment in self.segments:
+                # Length prefix keeps boundaries of segments, which are the positions of placeholders
+                template_hash.update(len(segment).to_bytes(8, 'big'))
+                template_hash.update(segment)
+            self._digest = template_hash.digest()
+        return hashlib.sha256(self._digest + origin.encode('utf-8')).hexdigest()[:32]
+
+    def origin_links(self) -> Iterator[str]:
+        """Paths (with query and fragment) of ``<a href>`` links, which were rewritten to point to the proxy."""
+        for previous_segment, segment in zip(self.segments, self.segments[1:]):
+            if LINK_PLACEHOLDER_PREFIX_PATTERN.search(previous_segment[-LINK_PLACEHOLDER_PREFIX_MAX_LENGTH:]):
+                # Pattern matches an empty string too, so there is always a match
+                rest_match = cast(Match[bytes], ORIGIN_URL_REST_PATTERN.match(segment))
+                yield rest_match.group().decode('utf-8', errors='replace')
+
+    def render(self, origin: str) -> bytes:
+        # Origin comes from request headers, so it has to be escaped the same way as Jinja would do this
+        return html.escape(origin).encode('utf-8').join(self.segments)
@@ -0,0 +1,120 @@
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, partial
+from typing import NamedTuple, Optional, Tuple
+
+from habraproxy.marking import WordMarker
+from habraproxy.services import PageTransformer, UpstreamPage
+from habraproxy.templates import OriginTemplate
+
+
+class TransformPoolSaturatedError(Exception):
+    """Raised, when there are already too many pages waiting for processing."""
+
+
+class SiteProxyOptions(NamedTuple):
+    """Everything, that is needed to build the same page transformer in a worker process."""
+
+    origin: str
+    extra_replacements: Tuple[Tuple[str, str], ...] = ()
+    memo_size: int = 4096
+    memo_max_length: int = 256
+    origin_static_paths: Tuple[str, ...] = ()
+
+
+class TransformPool:
+    """Processes pages in a pool of worker processes, so that processing is not serialized by the GIL.
+
+    Number of pages, which are being processed or waiting for a free worker, is limited by ``max_workers +
+    max_queue_size``. When the limit is reached, new pages are rejected immediately instead of making clients wait
+    for a queue, which only grows.
+
+    If a worker process dies (for example, it is killed by OOM killer), the pool is broken and is replaced with a new
+    one, and the page, which was being processed, is submitted once again.
+    """
+
+    def __init__(self, options: SiteProxyOptions, max_workers: int, max_queue_size: int = 16):
+        self.options = options
+        self.max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_size)
+        # Worker processes are started by start() or on the first submit, so the pool may be created before server forks
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start worker processes now, while the current process has no threads yet.
+
+        Forking a process, which already has threads, may deadlock the child (if some other thread holds a lock).
+        """
+        self._get_executor().submit(int).result()
+
+    def submit(self, upstream_page: UpstreamPage, bytes_pipeline: bool = False) -> 'Future[OriginTemplate]':
+        if not self._slots.acquire(blocking=False):
+            raise TransformPoolSaturatedError('All workers are busy and processing queue is full')
+        try:
+            future = self._submit(upstream_page, bytes_pipeline)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def process(self, upstream_page: UpstreamPage, bytes_pipeline: bool = False) -> OriginTemplate:
+        try:
+            return self.submit(upstream_page, bytes_pipeline).result()
+        except BrokenProcessPool:
+            # Worker has died while processing the page, the pool is already replaced
+            return self.submit(upstream_page, bytes_pipeline).result()
+
+    def shutdown(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _submit(self, upstream_page: UpstreamPage, bytes_pipeline: bool) -> 'Future[OriginTemplate]':
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_process_page, self.options, upstream_page, bytes_pipeline)
+        except BrokenProcessPool:
+            self._drop_executor(executor)
+            executor = self._get_executor()
+            future = executor.submit(_process_page, self.options, upstream_page, bytes_pipeline)
+        future.add_done_callback(partial(self._check_executor, executor))
+        return future
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                # After a broken pool, processes of the new one are forked from a process with threads, it is the
+                # only option left though
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _check_executor(self, executor: ProcessPoolExecutor, future: 'Future[OriginTemplate]') -> None:
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._drop_executor(executor)
+
+    def _drop_executor(self, executor: ProcessPoolExecutor) -> None:
+        """Forget broken executor, so that the next submit creates a new one."""
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+
+def _process_page(options: SiteProxyOptions, upstream_page: UpstreamPage, bytes_pipeline: bool) -> OriginTemplate:
+    return _worker_transformer(options).process_page(upstream_page, bytes_pipeline=bytes_pipeline)
+
+
+@lru_cache(maxsize=None)
+def _worker_transformer(options: SiteProxyOptions) -> PageTransformer:
+    # Transformer is created once per worker process, so that its memos are reused for all pages. Workers don't
+    # request anything, so they don't need upstream clients of the site proxy
+    return PageTransformer(
+        options.origin,
+        extra_replacements=options.extra_replacements,
+        word_marker=WordMarker(memo_size=options.memo_size, memo_max_length=options.memo_max_length),
+        origin_static_paths=options.origin_static_paths,
+    )
@@ -0,0 +1,98 @@
+import asyncio
+from typing import Any, Dict, Mapping, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Only idempotent requests are retried, and only on errors that are likely to be temporary
+RETRY_METHODS = frozenset(('GET', 'HEAD'))
+RETRY_STATUSES = frozenset((502, 503, 504))
+
+
+class UpstreamClient:
+    """Long-lived HTTP client for the proxied site.
+
+    Keeps a pool of keep-alive connections per host, so that TCP and TLS handshakes are not repeated for every
+    proxied page. An instance is meant to be created once per application and shared between requests and threads.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        max_retries: int = 2,
+        backoff_factor: float = 0.2,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        retry_methods: Dict[str, Any] = {_retry_methods_argument(): RETRY_METHODS}
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False,
+            **retry_methods,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url: str, headers: Optional[Mapping[str, str]] = None, stream: bool = False) -> requests.Response:
+        return self.session.get(url, headers=headers, stream=stream, timeout=self.timeout)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncUpstreamClient:
+    """Asyncio counterpart of ``UpstreamClient``.
+
+    Waiting for the origin does not block anything, so a single process can keep thousands of requests in flight,
+    while they share a pool of keep-alive connections. Requests, which are not able to get a connection from the pool,
+    wait for it in the event loop. Failed requests are retried with the same policy, as ``UpstreamClient`` has.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 100,
+        max_retries: int = 2,
+        backoff_factor: float = 0.2,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10,
+    ):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def get(self, url: str, headers: Optional[Mapping[str, str]] = None) -> httpx.Response:
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.get(url, headers=headers)
+            except httpx.TransportError:
+                if attempt >= self.max_retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+            attempt += 1
+            await asyncio.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def _retry_methods_argument() -> str:
+    # urllib3 1.26 renamed `method_whitelist` to `allowed_methods`, and 2.0 dropped the old name
+    if hasattr(Retry, 'DEFAULT_ALLOWED_METHODS'):
+        return 'allowed_methods'
+    return 'method_whitelist'
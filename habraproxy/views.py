@@ -1,20 +1,75 @@
+import urllib.parse
 from http import HTTPStatus
-from typing import Any
+from typing import Any, Optional
 
-from flask import abort, jsonify, render_template_string, request
+from flask import Response, abort, current_app, jsonify, redirect, request
 from flask.views import MethodView
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map
+from werkzeug.wsgi import wrap_file
 
-from habraproxy.services import SiteProxy
+from habraproxy.assets import AssetNotStoredError
+
+# Seconds, after which overloaded proxy is worth trying again
+SERVICE_UNAVAILABLE_RETRY_AFTER = '1'
+SERVICE_UNAVAILABLE_MESSAGE = 'Proxy is overloaded, try again later'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Endpoints of proxied pages, see app.py
+PAGE_ENDPOINTS = frozenset(('habr_proxy_main', 'habr_proxy'))
 
 
 class HabrProxyView(MethodView):
     def get(self, path: str) -> Any:
-        if path.startswith('images/'):
+        page_service = current_app.extensions['page_service']
+        origin = request.host
+        if current_app.config['STREAMING']:
+            page_parts = page_service.iter_page(path)
+            return Response((page_part.render(origin) for page_part in page_parts), mimetype='text/html')
+        metrics = current_app.extensions['metrics']
+        with metrics.time_request() as request_timings:
+            page = page_service.get_page(path)
+            with metrics.stage('render'):
+                page_representation = current_app.extensions['page_encoder'].represent(
+                    page,
+                    origin,
+                    accept_encoding=request.headers.get('Accept-Encoding', ''),
+                    if_none_match=request.headers.get('If-None-Match', ''),
+                )
+        response = Response(
+            page_representation.content,
+            status=page_representation.status,
+            headers=page_representation.headers,
+            mimetype='text/html',
+        )
+        if request_timings is not None:
+            response.headers['Server-Timing'] = request_timings.header()
+        return response
+
+
+class AssetView(MethodView):
+    """Images, fonts and other static files - either bundled with proxy, or downloaded from habr.com."""
+
+    def get(self, path: str, origin_prefix: str = '') -> Any:
+        asset_proxy = current_app.extensions['asset_proxy']
+        try:
+            opened_asset = asset_proxy.open_asset(origin_prefix + path)
+        except AssetNotStoredError:
+            # Such files are not worth caching (or are not assets at all), let client download them from origin
+            return redirect(asset_proxy.origin_url(origin_prefix + path))
+        if opened_asset is None:
             return abort(HTTPStatus.NOT_FOUND)
-        site_proxy = SiteProxy('https://habr.com')
-        original_content = site_proxy.request_page(path)
-        processed_content = site_proxy.process_content(original_content)
-        return render_template_string(processed_content, origin=request.host)
+        asset = opened_asset.asset
+        # File is sent with sendfile(), if server supports it, and never read into memory as a whole
+        response = Response(
+            wrap_file(request.environ, opened_asset.file),
+            content_type=asset.content_type,
+            direct_passthrough=True,
+        )
+        response.content_length = asset.size
+        response.set_etag(asset.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['ASSET_MAX_AGE']
+        return response.make_conditional(request, accept_ranges=True, complete_length=asset.size)
 
 
 class WebmanifestMockView(MethodView):
@@ -41,3 +96,46 @@ class WebmanifestMockView(MethodView):
             'display': 'standalone',
         }
         return jsonify(data)
+
+
+class CacheStatsView(MethodView):
+    def get(self) -> Any:
+        page_service = current_app.extensions['page_service']
+        page_cache_stats = {'enabled': False}
+        if page_service.cache is not None:
+            page_cache_stats = dict(page_service.cache.stats.as_dict(), enabled=True)
+        return jsonify({
+            'page_cache': page_cache_stats,
+            'text_memo': page_service.site_proxy.word_marker.memo_stats(),
+        })
+
+
+class MetricsView(MethodView):
+    def get(self) -> Any:
+        metrics = current_app.extensions['metrics']
+        if not metrics.enabled:
+            return abort(HTTPStatus.NOT_FOUND)
+        return Response(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def service_unavailable(error: Exception) -> Any:
+    """Response for requests, which can't be served right now, because proxy is overloaded."""
+    response = Response(
+        SERVICE_UNAVAILABLE_MESSAGE,
+        status=HTTPStatus.SERVICE_UNAVAILABLE,
+        mimetype='text/plain',
+    )
+    response.headers['Retry-After'] = SERVICE_UNAVAILABLE_RETRY_AFTER
+    return response
+
+
+def match_page_path(url_map: Map, url: str) -> Optional[str]:
+    """Path of the proxied page, which is served at the url, or None, if url belongs to another route."""
+    url_adapter = url_map.bind('localhost')
+    try:
+        endpoint, view_arguments = url_adapter.match(urllib.parse.urlsplit(url).path or '/', method='GET')
+    except HTTPException:
+        return None
+    if endpoint not in PAGE_ENDPOINTS:
+        return None
+    return view_arguments['path']
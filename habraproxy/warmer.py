@@ -0,0 +1,163 @@
+import fcntl
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Iterable, List, Optional, Sequence, Set, TextIO
+
+from habraproxy.pages import PageService, RecentPages
+from habraproxy.templates import OriginTemplate
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Spreads calls evenly in time, so that there are at most ``rate`` calls per second (0 means no limit)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self._next_call_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            call_at = max(now, self._next_call_at)
+            self._next_call_at = call_at + self.interval
+        if call_at > now:
+            time.sleep(call_at - now)
+
+
+class CacheWarmer:
+    """Loads pages into the page cache in background, before visitors request them.
+
+    Every ``interval`` seconds warmer crawls seeds (urls like ``/ru/``) and pages, which were requested recently,
+    following links on them up to ``max_depth``, and loads pages, which are not cached. Seeds and recently requested
+    pages are also revalidated ``refresh_ahead`` seconds before they expire, so while they are popular, they are never
+    requested from origin by visitors. Each round visits at most ``max_pages`` pages, origin is requested by at most
+    ``concurrency`` threads and at most ``rate_limit`` times per second.
+
+    If cache is shared by processes, they are given the same ``lock_path``: rounds are run only by the process, which
+    holds the lock, and once it exits, another one takes over.
+    """
+
+    def __init__(
+        self,
+        page_service: PageService,
+        seeds: Sequence[str],
+        page_path: Callable[[str], Optional[str]],
+        recent_pages: Optional[RecentPages] = None,
+        max_depth: int = 1,
+        max_pages: int = 200,
+        concurrency: int = 4,
+        rate_limit: float = 5,
+        interval: float = 10,
+        refresh_ahead: float = 15,
+        lock_path: Optional[str] = None,
+    ):
+        if page_service.cache is None:
+            raise ValueError('Cache warmer requires page cache')
+        self.page_service = page_service
+        self.cache = page_service.cache
+        self.seeds = tuple(seeds)
+        # Converts url into path of the page, or None, if url is not a page of the proxy
+        self.page_path = page_path
+        self.recent_pages = recent_pages
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.interval = interval
+        self.refresh_ahead = refresh_ahead
+        self.lock_path = lock_path
+        self._lock_file: Optional[TextIO] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='cache-warmer', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def run_round(self, executor: ThreadPoolExecutor) -> int:
+        """Crawl pages once, return number of visited pages."""
+        hot_paths = [self.page_path(seed) for seed in self.seeds]
+        if self.recent_pages is not None:
+            hot_paths.extend(self.recent_pages.requested_since(time.time() - self.cache.ttl))
+        frontier = _unique(path for path in hot_paths if path is not None)[:self.max_pages]
+        visited = set(frontier)
+        fresh_for = self.refresh_ahead
+        for depth in range(self.max_depth + 1):
+            pages = list(executor.map(partial(self._warm_page, fresh_for=fresh_for), frontier))
+            if depth == self.max_depth:
+                break
+            frontier = []
+            for page in pages:
+                frontier.extend(self._new_links(page, visited))
+            # Pages, which were just discovered, are only loaded, if they are not cached
+            fresh_for = 0
+        return len(visited)
+
+    def _run(self) -> None:
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='cache-warmer') as executor:
+            while not self._stopped.is_set():
+                try:
+                    if self._acquire_lock():
+                        self.run_round(executor)
+                except Exception:
+                    logger.exception('Cache warming failed')
+                self._stopped.wait(self.interval)
+        if self._lock_file is not None:
+            # Closing the file releases the lock
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _acquire_lock(self) -> bool:
+        """Whether this process warms the cache: it has no lock to share or holds it already."""
+        if self.lock_path is None or self._lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another process is warming the cache
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _warm_page(self, path: str, fresh_for: float) -> Optional[OriginTemplate]:
+        # Checks of the warmer must not make pages look recently used, otherwise they would evict requested ones
+        entry = self.cache.backend.peek(path)
+        if entry is not None and entry.is_fresh(time.time() + fresh_for):
+            return entry.value
+        self.rate_limiter.wait()
+        try:
+            return self.page_service.warm_page(path, fresh_for=fresh_for)
+        except Exception:
+            logger.warning('Page %s was not warmed', path, exc_info=True)
+            return None
+
+    def _new_links(self, page: Optional[OriginTemplate], visited: Set[str]) -> List[str]:
+        new_links: List[str] = []
+        if page is None:
+            return new_links
+        for url in page.origin_links():
+            if len(visited) >= self.max_pages:
+                break
+            path = self.page_path(url)
+            if path is not None and path not in visited:
+                visited.add(path)
+                new_links.append(path)
+        return new_links
+
+
+def _unique(paths: Iterable[str]) -> List[str]:
+    return list(dict.fromkeys(paths))
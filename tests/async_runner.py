@@ -0,0 +1,12 @@
+import asyncio
+from typing import Any, Awaitable
+
+
+def run_async(awaitable: Awaitable[Any]) -> Any:
+    """Run awaitable in a new event loop, like ``asyncio.run()``, which is not available in Python 3.6."""
+    event_loop = asyncio.new_event_loop()
+    try:
+        return event_loop.run_until_complete(awaitable)
+    finally:
+        event_loop.run_until_complete(event_loop.shutdown_asyncgens())
+        event_loop.close()
@@ -0,0 +1,50 @@
+import asyncio
+from http import HTTPStatus
+from typing import Dict, Optional
+
+import httpx
+from hamcrest import assert_that, contains_string, equal_to, greater_than, is_, none
+
+from benchmarks.fake_origin import FakeOrigin, FakeOriginOptions
+from tests.async_runner import run_async
+
+PAGE = b'<html><body><a href="https://habr.com/ru/">Link</a></body></html>'
+
+
+def request(fake_origin: FakeOrigin, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    async def send_request() -> httpx.Response:
+        transport = httpx.ASGITransport(app=fake_origin)
+        async with httpx.AsyncClient(transport=transport, base_url='http://127.0.0.1:8001') as client:
+            return await client.get('/ru/', headers=headers)
+
+    return run_async(send_request())
+
+
+class TestFakeOrigin:
+    def test_page_points_to_fake_origin(self):
+        response = request(FakeOrigin(PAGE, FakeOriginOptions(latency=0)))
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.OK)))
+        assert_that(response.text, contains_string('href="http://127.0.0.1:8001/ru/"'))
+
+    def test_conditional_request_answered_with_304(self):
+        fake_origin = FakeOrigin(PAGE, FakeOriginOptions(latency=0))
+
+        response = request(fake_origin, headers={'If-None-Match': fake_origin.etag})
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.NOT_MODIFIED)))
+
+    def test_page_sent_by_chunks(self, mocker):
+        fake_origin = FakeOrigin(PAGE, FakeOriginOptions(latency=0, chunk_size=10))
+        sleep_spy = mocker.spy(asyncio, 'sleep')
+
+        response = request(fake_origin)
+
+        assert_that(response.headers.get('content-length'), is_(none()))
+        assert_that(response.content, is_(equal_to(PAGE.replace(b'https://habr.com', b'http://127.0.0.1:8001'))))
+        assert_that(sleep_spy.call_count, is_(greater_than(5)))
+
+    def test_errors_returned(self):
+        response = request(FakeOrigin(PAGE, FakeOriginOptions(latency=0, error_rate=1)))
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.SERVICE_UNAVAILABLE)))
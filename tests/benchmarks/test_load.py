@@ -0,0 +1,44 @@
+from typing import Dict, List, Optional
+
+from hamcrest import assert_that, equal_to, has_entries, is_
+
+from benchmarks.load import ClientResults, summarize
+
+
+def _client_results(
+    latencies: List[float],
+    statuses: Dict[int, int],
+    errors: Optional[Dict[str, int]] = None,
+) -> ClientResults:
+    client_results = ClientResults()
+    client_results.latencies.extend(latencies)
+    client_results.statuses.update(statuses)
+    client_results.errors.update(errors or {})
+    client_results.response_bytes = 1000 * len(latencies)
+    return client_results
+
+
+class TestSummarize:
+    def test_results_of_clients_merged(self):
+        summary = summarize([
+            _client_results([0.01 * index for index in range(1, 51)], {200: 50}),
+            _client_results([0.01 * index for index in range(51, 101)], {200: 49, 503: 1}, {'ConnectionError': 2}),
+        ], duration=10)
+
+        assert_that(summary, has_entries(
+            requests=100,
+            requests_per_second=10,
+            statuses={'200': 99, '503': 1},
+            errors={'ConnectionError': 2},
+        ))
+        assert_that({name: round(latency) for name, latency in summary['latency_ms'].items()}, is_(equal_to({
+            'p50': 500,
+            'p95': 950,
+            'p99': 990,
+            'max': 1000,
+        })))
+
+    def test_no_latencies_without_responses(self):
+        summary = summarize([_client_results([], {}, {'ConnectionRefusedError': 3})], duration=10)
+
+        assert_that(summary, has_entries(requests=0, latency_ms={}))
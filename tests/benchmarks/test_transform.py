@@ -0,0 +1,94 @@
+from typing import Any, Dict
+
+from hamcrest import assert_that, equal_to, greater_than, has_entries, is_
+from lxml import html
+
+from benchmarks.transform import (
+    BenchmarkOptions,
+    Page,
+    StageInput,
+    deep_nesting_page,
+    find_regressions,
+    fixture_page,
+    main,
+    measure,
+    prepare_stages,
+    scaled_page,
+)
+from habraproxy.services import SiteProxy
+
+
+def _results(**stage_seconds: float) -> Dict[str, Any]:
+    return {'pages': {'fixture': {'stages': {
+        stage: {'seconds': seconds} for stage, seconds in stage_seconds.items()
+    }}}}
+
+
+class TestPages:
+    def test_scaled_page_has_more_nodes(self):
+        fixture_nodes = sum(1 for _ in html.document_fromstring(fixture_page().content).iter())
+
+        scaled_nodes = sum(1 for _ in html.document_fromstring(scaled_page(3).content).iter())
+
+        assert_that(scaled_nodes, is_(greater_than(fixture_nodes * 2)))
+
+    def test_deep_nesting_page_is_deep(self):
+        root_element = html.document_fromstring(deep_nesting_page(subtrees=1).content)
+
+        depth = max(sum(1 for _ in element.iterancestors()) for element in root_element.iter())
+
+        assert_that(depth, is_(greater_than(200)))
+
+
+class TestPrepareStages:
+    def test_text_processed_with_empty_memo(self):
+        site_proxy = SiteProxy('https://habr.com')
+        stage_inputs = prepare_stages(site_proxy, Page('page', '<html><body><p>Python</p><p>Python</p></body></html>'))
+
+        stage_inputs['process_text'].function()
+        stage_inputs['process_text'].function()
+
+        memo_stats = site_proxy.word_marker.memo_stats()
+        assert_that((memo_stats['hits'], memo_stats['misses']), is_(equal_to((1, 1))))
+
+
+class TestMeasure:
+    def test_throughput_reported(self):
+        stage_results = measure(StageInput(lambda: 'a' * 1000, size=1000), BenchmarkOptions(min_time=0.001, repeat=2))
+
+        assert_that(stage_results, has_entries(
+            pages_per_second=greater_than(0),
+            megabytes_per_second=greater_than(0),
+            input_bytes=1000,
+        ))
+
+
+class TestFindRegressions:
+    def test_slower_stage_reported(self):
+        regressions = find_regressions(
+            _results(process_content=0.013, process_text=0.0021),
+            _results(process_content=0.01, process_text=0.002),
+            threshold=0.2,
+        )
+
+        assert_that(regressions, is_(equal_to(['fixture/process_content: 10.00 ms -> 13.00 ms (+30%)'])))
+
+    def test_stages_missing_in_baseline_ignored(self):
+        regressions = find_regressions(_results(process_url=1), {'pages': {}}, threshold=0.2)
+
+        assert_that(regressions, is_(equal_to([])))
+
+
+class TestMain:
+    def test_missing_baseline_fails_when_required(self, tmp_path):
+        arguments = [
+            '--pages', 'deep_nesting',
+            '--stages', 'process_url',
+            '--min-time', '0.001',
+            '--repeat', '1',
+            '--output', str(tmp_path / 'results.json'),
+            '--baseline', str(tmp_path / 'baseline.json'),
+        ]
+
+        assert_that(main(arguments), is_(equal_to(0)))
+        assert_that(main(arguments + ['--require-baseline']), is_(equal_to(1)))
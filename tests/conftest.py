@@ -6,6 +6,9 @@ from habraproxy.app import app
 @pytest.fixture
 def client():
     app.config['TESTING'] = True
+    page_cache = app.extensions['page_service'].cache
+    if page_cache is not None:
+        page_cache.clear()
 
     with app.test_client() as test_client:
         yield test_client
@@ -0,0 +1,111 @@
+import asyncio
+from http import HTTPStatus
+from typing import Any, List, MutableMapping
+
+import httpx
+import pytest
+from hamcrest import all_of, assert_that, contains_string, equal_to, has_entries, is_
+
+from habraproxy.app import app
+from habraproxy.assets import AssetStore
+from habraproxy.asgi import application
+from habraproxy.services import SiteProxy, UpstreamPage
+from habraproxy.transform_pool import TransformPoolSaturatedError
+from tests.async_runner import run_async
+
+
+def request(path: str) -> httpx.Response:
+    async def send_request() -> httpx.Response:
+        transport = httpx.ASGITransport(app=application)
+        async with httpx.AsyncClient(transport=transport, base_url='http://127.0.0.1:5000') as client:
+            return await client.get(path)
+
+    return run_async(send_request())
+
+
+@pytest.fixture(autouse=True)
+def clear_page_cache():
+    page_cache = app.extensions['page_service'].cache
+    if page_cache is not None:
+        page_cache.clear()
+
+
+class TestHabrProxyApplication:
+    def test_page_served_asynchronously(self, mocker):
+        fetch_page_mock = mocker.patch.object(SiteProxy, 'fetch_page')
+        fetch_page_async_mock = mocker.patch.object(SiteProxy, 'fetch_page_async')
+        fetch_page_async_mock.return_value = UpstreamPage(
+            status=HTTPStatus.OK,
+            content='<html><body><a href="https://habr.com/ru/news">Follow me</a></body></html>',
+        )
+
+        response = request('/ru/')
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.OK)))
+        assert_that(response.headers, has_entries({'content-type': 'text/html; charset=utf-8'}))
+        assert_that(response.content, is_(equal_to(
+            '<html><body><a href="http://127.0.0.1:5000/ru/news">Follow™ me</a></body></html>'.encode('utf-8'),
+        )))
+        assert_that(fetch_page_mock.call_count, is_(equal_to(0)))
+
+    def test_server_timing_sent(self, mocker):
+        mocker.patch.object(app.extensions['metrics'], 'enabled', True)
+        fetch_page_async_mock = mocker.patch.object(SiteProxy, 'fetch_page_async')
+        fetch_page_async_mock.return_value = UpstreamPage(status=HTTPStatus.OK, content='<html><body></body></html>')
+
+        response = request('/ru/')
+
+        assert_that(response.headers['server-timing'], all_of(
+            contains_string('parse;dur='),
+            contains_string('render;dur='),
+            contains_string('total;dur='),
+        ))
+
+    def test_503_returned_when_overloaded(self, mocker):
+        mocker.patch('habraproxy.pages.AsyncPageService.get_page_async', side_effect=TransformPoolSaturatedError)
+
+        response = request('/ru/')
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.SERVICE_UNAVAILABLE)))
+        assert_that(response.headers, has_entries({'retry-after': '1'}))
+
+    def test_other_routes_served_by_wsgi_app(self):
+        response = request('/site.webmanifest')
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.OK)))
+        assert_that(response.json(), has_entries({'name': 'Habr'}))
+
+    def test_asset_served_by_wsgi_app(self, tmp_path, mocker):
+        asset_store = AssetStore(str(tmp_path), max_size=10000)
+        asset_store.put('https://habr.com/images/a.png', [b'abcdef'], 'image/png')
+        mocker.patch.object(app.extensions['asset_proxy'], 'store', asset_store)
+
+        response = request('/images/a.png')
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.OK)))
+        assert_that(response.content, is_(equal_to(b'abcdef')))
+
+    def test_event_loop_attached_while_running(self, mocker):
+        page_service = app.extensions['page_service']
+        lifespan_events: List[Any] = []
+
+        async def close_client() -> None:
+            lifespan_events.append('closed')
+
+        mocker.patch.object(page_service.site_proxy.async_client, 'close', side_effect=close_client)
+
+        async def run_lifespan() -> asyncio.AbstractEventLoop:
+            messages: 'asyncio.Queue[MutableMapping[str, Any]]' = asyncio.Queue()
+
+            async def send(message: MutableMapping[str, Any]) -> None:
+                lifespan_events.append(page_service.event_loop)
+                if message['type'] == 'lifespan.startup.complete':
+                    await messages.put({'type': 'lifespan.shutdown'})
+
+            await messages.put({'type': 'lifespan.startup'})
+            await application({'type': 'lifespan'}, messages.get, send)
+            return asyncio.get_event_loop()
+
+        event_loop = run_async(run_lifespan())
+
+        assert_that(lifespan_events, is_(equal_to([event_loop, 'closed', None])))
@@ -0,0 +1,177 @@
+import os
+import time
+from typing import Iterator, Optional
+
+import pytest
+import requests_mock
+from hamcrest import assert_that, equal_to, has_property, is_, none, not_none
+
+from habraproxy.assets import AssetProxy, AssetStore, AssetTooLargeError, NotAnAssetError, OpenedAsset, StoredAsset
+
+
+def read_asset(asset: StoredAsset) -> bytes:
+    with open(asset.path, 'rb') as asset_file:
+        return asset_file.read()
+
+
+def read_opened_asset(opened_asset: Optional[OpenedAsset]) -> bytes:
+    assert opened_asset is not None
+    with opened_asset.file:
+        return opened_asset.file.read()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AssetStore(str(tmp_path), max_size=100)
+
+
+class TestAssetStore:
+    def test_stored_asset_returned(self, store):
+        store.put('https://habr.com/images/a.png', iter([b'abc', b'def']), 'image/png')
+
+        asset = store.get('https://habr.com/images/a.png')
+
+        assert_that(read_asset(asset), is_(equal_to(b'abcdef')))
+        assert_that(asset.size, is_(equal_to(6)))
+        assert_that(asset.content_type, is_(equal_to('image/png')))
+
+    def test_unknown_asset_not_found(self, store):
+        assert_that(store.get('https://habr.com/images/a.png'), is_(none()))
+
+    def test_same_content_stored_once(self, store):
+        first_asset = store.put('https://habr.com/images/a.png', [b'abcdef'], 'image/png')
+        second_asset = store.put('https://habr.com/images/b.png', [b'abcdef'], 'image/png')
+
+        assert_that(first_asset.path, is_(equal_to(second_asset.path)))
+        assert_that(first_asset.etag, is_(equal_to(second_asset.etag)))
+
+    def test_least_recently_used_asset_evicted(self, store):
+        store.put('https://habr.com/images/a.png', [b'a' * 40], 'image/png')
+        store.put('https://habr.com/images/b.png', [b'b' * 40], 'image/png')
+        old_time = time.time() - 10
+        os.utime(store.get('https://habr.com/images/b.png').path, (old_time, old_time))
+
+        store.put('https://habr.com/images/c.png', [b'c' * 40], 'image/png')
+
+        assert_that(store.get('https://habr.com/images/a.png'), is_(not_none()))
+        assert_that(store.get('https://habr.com/images/b.png'), is_(none()))
+        assert_that(store.get('https://habr.com/images/c.png'), is_(not_none()))
+
+    def test_opened_asset_readable_after_eviction(self, store):
+        store.put('https://habr.com/images/a.png', [b'abcdef'], 'image/png')
+        opened_asset = store.open('https://habr.com/images/a.png')
+
+        os.remove(opened_asset.asset.path)
+
+        assert_that(read_opened_asset(opened_asset), is_(equal_to(b'abcdef')))
+        assert_that(store.open('https://habr.com/images/a.png'), is_(none()))
+
+    def test_files_being_written_not_evicted(self, store):
+        chunks_written = []
+
+        def chunks() -> Iterator[bytes]:
+            yield b'a' * 40
+            # Another process stores an asset, while this one is still downloading
+            store.put('https://habr.com/images/b.png', [b'b' * 80], 'image/png')
+            chunks_written.append(True)
+            yield b'a' * 40
+
+        asset = store.put('https://habr.com/images/a.png', chunks(), 'image/png')
+
+        assert_that(chunks_written, is_(equal_to([True])))
+        assert_that(read_asset(asset), is_(equal_to(b'a' * 80)))
+
+    def test_too_large_asset_not_stored(self, store):
+        with pytest.raises(AssetTooLargeError):
+            store.put('https://habr.com/images/a.png', [b'a' * 60, b'a' * 60], 'image/png')
+
+        assert_that(os.listdir(store.objects_directory), is_(equal_to([])))
+
+    def test_objects_walked_only_when_limit_exceeded(self, store, mocker):
+        mocked_walk = mocker.patch('os.walk', wraps=os.walk)
+
+        store.put('https://habr.com/images/a.png', [b'a' * 40], 'image/png')
+        store.put('https://habr.com/images/b.png', [b'b' * 40], 'image/png')
+        walks_within_limit = mocked_walk.call_count
+        store.put('https://habr.com/images/c.png', [b'c' * 40], 'image/png')
+
+        assert_that(walks_within_limit, is_(equal_to(0)))
+        assert_that(mocked_walk.call_count, is_(equal_to(1)))
+        assert_that(store.size, is_(equal_to(80)))
+
+
+class TestAssetProxy:
+    def test_asset_fetched_once(self, store):
+        asset_proxy = AssetProxy('https://habr.com', store)
+
+        with requests_mock.Mocker() as requests_mocker:
+            requests_mocker.get(
+                'https://habr.com/images/a.png',
+                content=b'abcdef',
+                headers={'Content-Type': 'image/png'},
+            )
+
+            read_opened_asset(asset_proxy.open_asset('images/a.png'))
+            opened_asset = asset_proxy.open_asset('images/a.png')
+
+            assert_that(requests_mocker.call_count, is_(equal_to(1)))
+        assert_that(read_opened_asset(opened_asset), is_(equal_to(b'abcdef')))
+        assert_that(opened_asset, has_property('asset', has_property('content_type', equal_to('image/png'))))
+
+    def test_missing_asset_not_stored(self, store):
+        asset_proxy = AssetProxy('https://habr.com', store)
+
+        with requests_mock.Mocker() as requests_mocker:
+            requests_mocker.get('https://habr.com/images/a.png', status_code=404, content=b'Not found')
+
+            assert_that(asset_proxy.open_asset('images/a.png'), is_(none()))
+        assert_that(store.get('https://habr.com/images/a.png'), is_(none()))
+
+    def test_local_asset_served(self, store, tmp_path):
+        local_directory = tmp_path / 'static'
+        local_directory.joinpath('images').mkdir(parents=True)
+        local_directory.joinpath('images', 'a.png').write_bytes(b'local')
+        asset_proxy = AssetProxy('https://habr.com', store, local_directory=str(local_directory))
+
+        opened_asset = asset_proxy.open_asset('images/a.png')
+
+        assert_that(read_opened_asset(opened_asset), is_(equal_to(b'local')))
+        assert_that(opened_asset, has_property('asset', has_property('content_type', equal_to('image/png'))))
+
+    def test_path_outside_of_local_directory_not_served(self, store, tmp_path):
+        local_directory = tmp_path / 'static'
+        local_directory.mkdir()
+        tmp_path.joinpath('secret.txt').write_bytes(b'secret')
+        asset_proxy = AssetProxy('https://habr.com', store, local_directory=str(local_directory))
+
+        with requests_mock.Mocker() as requests_mocker:
+            requests_mocker.get(requests_mock.ANY, status_code=404)
+
+            assert_that(asset_proxy.open_asset('../secret.txt'), is_(none()))
+
+    @pytest.mark.parametrize('path, content_type', [
+        ('images/a.png', 'image/png'),
+        ('fonts/a.woff2', 'font/woff2'),
+        ('fonts/a.woff', 'application/octet-stream'),
+    ])
+    def test_asset_types_stored(self, store, path, content_type):
+        asset_proxy = AssetProxy('https://habr.com', store)
+
+        with requests_mock.Mocker() as requests_mocker:
+            requests_mocker.get(requests_mock.ANY, content=b'abcdef', headers={'Content-Type': content_type})
+
+            assert_that(read_opened_asset(asset_proxy.open_asset(path)), is_(equal_to(b'abcdef')))
+
+    @pytest.mark.parametrize('path, content_type', [
+        ('images/ru/post/1/', 'text/html; charset=utf-8'),
+        ('images/a.html', 'application/octet-stream'),
+    ])
+    def test_other_files_not_stored(self, store, path, content_type):
+        asset_proxy = AssetProxy('https://habr.com', store)
+
+        with requests_mock.Mocker() as requests_mocker:
+            requests_mocker.get(requests_mock.ANY, content=b'<html></html>', headers={'Content-Type': content_type})
+
+            with pytest.raises(NotAnAssetError):
+                asset_proxy.open_asset(path)
+        assert_that(store.get(asset_proxy.origin_url(path)), is_(none()))
@@ -0,0 +1,246 @@
+import os
+import time
+from typing import List, Optional
+
+import pytest
+from hamcrest import assert_that, equal_to, has_entries, has_properties, has_property, is_, less_than, none
+
+from habraproxy.cache import CacheEntry, DiskCacheBackend, MemoryCacheBackend, PageCache, create_page_cache
+from habraproxy.templates import OriginTemplate
+
+
+def make_entry(value: str, size: int = 10, expires_at: Optional[float] = None) -> CacheEntry:
+    return CacheEntry(
+        value=OriginTemplate.from_string(value),
+        size=size,
+        expires_at=time.time() + 60 if expires_at is None else expires_at,
+    )
+
+
+@pytest.fixture(params=['memory', 'disk'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryCacheBackend(max_size=30)
+    return DiskCacheBackend(directory=str(tmp_path), max_size=4096)
+
+
+class TestCacheBackends:
+    def test_stores_entry(self, backend):
+        backend.set('/ru/', make_entry('content'))
+
+        assert_that(backend.get('/ru/'), has_property('value', equal_to(OriginTemplate.from_string('content'))))
+
+    def test_missing_entry(self, backend):
+        assert_that(backend.get('/ru/'), is_(none()))
+
+    def test_deletes_entry(self, backend):
+        backend.set('/ru/', make_entry('content'))
+
+        backend.delete('/ru/')
+
+        assert_that(backend.get('/ru/'), is_(none()))
+
+    def test_clears_entries(self, backend):
+        backend.set('/ru/', make_entry('content'))
+        backend.set('/en/', make_entry('content'))
+
+        backend.clear()
+
+        assert_that(backend.get('/ru/'), is_(none()))
+        assert_that(backend.get('/en/'), is_(none()))
+
+    def test_ignores_entry_larger_than_cache(self, backend):
+        backend.set('/ru/', make_entry('content', size=backend.max_size + 1))
+
+        assert_that(backend.get('/ru/'), is_(none()))
+
+    def test_entry_larger_than_cache_removes_previous_one(self, backend):
+        backend.set('/ru/', make_entry('content'))
+
+        backend.set('/ru/', make_entry('new content', size=backend.max_size + 1))
+
+        assert_that(backend.get('/ru/'), is_(none()))
+
+
+class TestMemoryCacheBackend:
+    def test_evicts_least_recently_used(self):
+        backend = MemoryCacheBackend(max_size=30)
+        evictions: List[int] = []
+        backend.on_evict = evictions.append
+        backend.set('first', make_entry('1'))
+        backend.set('second', make_entry('2'))
+        backend.set('third', make_entry('3'))
+        backend.get('first')
+
+        backend.set('fourth', make_entry('4'))
+
+        assert_that(backend.get('second'), is_(none()))
+        assert_that(backend.get('first'), has_property('value', equal_to(OriginTemplate.from_string('1'))))
+        assert_that(backend.size, is_(equal_to(30)))
+        assert_that(evictions, is_(equal_to([1])))
+
+    def test_peek_does_not_change_recency(self):
+        backend = MemoryCacheBackend(max_size=30)
+        backend.set('first', make_entry('1'))
+        backend.set('second', make_entry('2'))
+        backend.set('third', make_entry('3'))
+
+        assert_that(backend.peek('first'), has_property('value', equal_to(OriginTemplate.from_string('1'))))
+        backend.set('fourth', make_entry('4'))
+
+        assert_that(backend.peek('first'), is_(none()))
+
+    def test_replacing_entry_does_not_grow_size(self):
+        backend = MemoryCacheBackend(max_size=30)
+
+        backend.set('first', make_entry('1'))
+        backend.set('first', make_entry('2'))
+
+        assert_that(backend.size, is_(equal_to(10)))
+        assert_that(len(backend), is_(equal_to(1)))
+
+
+class TestDiskCacheBackend:
+    def test_evicts_least_recently_used(self, tmp_path):
+        backend = DiskCacheBackend(directory=str(tmp_path), max_size=1024)
+        evictions: List[int] = []
+        backend.on_evict = evictions.append
+        backend.set('first', make_entry('1' * 300))
+        backend.set('second', make_entry('2' * 300))
+        first_path = backend._path('first')
+        second_path = backend._path('second')
+        now = time.time()
+        # File modification time defines recency of usage
+        os.utime(first_path, (now, now))
+        os.utime(second_path, (now - 100, now - 100))
+
+        backend.set('third', make_entry('3' * 300))
+
+        assert_that(backend.get('second'), is_(none()))
+        assert_that(backend.get('first'), has_property('value', equal_to(OriginTemplate.from_string('1' * 300))))
+        assert_that(evictions, is_(equal_to([1])))
+
+    def test_directory_scanned_only_when_limit_exceeded(self, tmp_path, mocker):
+        backend = DiskCacheBackend(directory=str(tmp_path), max_size=1024)
+        mocked_scandir = mocker.patch('os.scandir', wraps=os.scandir)
+
+        backend.set('first', make_entry('1' * 300))
+        backend.set('first', make_entry('2' * 300))
+        backend.set('second', make_entry('3' * 300))
+        backend.delete('second')
+        scans_within_limit = mocked_scandir.call_count
+        backend.set('second', make_entry('4' * 300))
+        backend.set('third', make_entry('5' * 300))
+
+        assert_that(scans_within_limit, is_(equal_to(0)))
+        assert_that(mocked_scandir.call_count, is_(equal_to(1)))
+        assert_that(backend.size, is_(equal_to(sum(entry.stat().st_size for entry in os.scandir(str(tmp_path))))))
+
+    def test_size_of_existing_entries_counted(self, tmp_path):
+        DiskCacheBackend(directory=str(tmp_path), max_size=1024).set('/ru/', make_entry('content'))
+
+        backend = DiskCacheBackend(directory=str(tmp_path), max_size=1024)
+
+        assert_that(backend.size, is_(equal_to(os.path.getsize(backend._path('/ru/')))))
+
+    def test_peek_does_not_change_recency(self, tmp_path):
+        backend = DiskCacheBackend(directory=str(tmp_path), max_size=1024)
+        backend.set('first', make_entry('1'))
+        os.utime(backend._path('first'), (100, 100))
+
+        assert_that(backend.peek('first'), has_property('value', equal_to(OriginTemplate.from_string('1'))))
+        assert_that(os.stat(backend._path('first')).st_mtime, is_(equal_to(100)))
+
+    def test_entries_shared_between_instances(self, tmp_path):
+        DiskCacheBackend(directory=str(tmp_path), max_size=1024).set('/ru/', make_entry('content'))
+
+        entry = DiskCacheBackend(directory=str(tmp_path), max_size=1024).get('/ru/')
+
+        assert_that(entry, has_property('value', equal_to(OriginTemplate.from_string('content'))))
+
+    def test_entry_metadata_restored(self, tmp_path):
+        backend = DiskCacheBackend(directory=str(tmp_path), max_size=1024)
+        backend.set('/ru/', CacheEntry(
+            value=OriginTemplate.from_string('<a href="{{ origin }}/ru/">Хабр</a>'),
+            size=10,
+            expires_at=100.5,
+            etag='"abc"',
+            last_modified='Wed, 21 Oct 2015 07:28:00 GMT',
+        ))
+
+        entry = backend.get('/ru/')
+
+        assert_that(entry, has_properties(
+            value=has_property('segments', equal_to(('<a href="'.encode(), '/ru/">Хабр</a>'.encode()))),
+            size=10,
+            expires_at=100.5,
+            etag='"abc"',
+            last_modified='Wed, 21 Oct 2015 07:28:00 GMT',
+        ))
+
+    @pytest.mark.parametrize('content', [
+        b'\x80\x04\x95\x00',
+        b'habraproxy-page-entry-1\n{"size": 10}\n',
+        b'habraproxy-page-entry-1\n{"size": 10, "expires_at": 0, "etag": null, "last_modified": null, '
+        b'"segment_lengths": [100]}\ncontent',
+    ])
+    def test_foreign_files_are_misses(self, tmp_path, content):
+        backend = DiskCacheBackend(directory=str(tmp_path), max_size=1024)
+        with open(backend._path('/ru/'), 'wb') as entry_file:
+            entry_file.write(content)
+
+        assert_that(backend.get('/ru/'), is_(none()))
+
+    def test_directory_private(self, tmp_path):
+        directory = tmp_path / 'pages'
+
+        DiskCacheBackend(directory=str(directory), max_size=1024)
+
+        assert_that(directory.stat().st_mode & 0o777, is_(equal_to(0o700)))
+
+
+class TestPageCache:
+    def test_counts_hits_and_misses(self):
+        page_cache = PageCache(MemoryCacheBackend(max_size=100), ttl=60)
+        page_cache.lookup('/ru/')
+        page_cache.store('/ru/', 'content', size=10)
+
+        page_cache.lookup('/ru/')
+
+        assert_that(page_cache.stats.as_dict(), has_entries(hits=1, misses=1, revalidations=0, evictions=0))
+
+    def test_expired_entry_is_a_miss(self):
+        page_cache = PageCache(MemoryCacheBackend(max_size=100), ttl=-1)
+        page_cache.store('/ru/', 'content', size=10, etag='"abc"')
+
+        entry = page_cache.lookup('/ru/')
+
+        assert_that(entry, has_properties(etag='"abc"', expires_at=less_than(time.time())))
+        assert_that(page_cache.stats.as_dict(), has_entries(hits=0, misses=1))
+
+    def test_refresh_extends_lifetime(self):
+        page_cache = PageCache(MemoryCacheBackend(max_size=100), ttl=60)
+        entry = make_entry('content', expires_at=time.time() - 1)
+
+        refreshed_entry = page_cache.refresh('/ru/', entry)
+
+        assert_that(refreshed_entry.is_fresh(), is_(True))
+        assert_that(page_cache.lookup('/ru/'), has_property('value', equal_to(OriginTemplate.from_string('content'))))
+        assert_that(page_cache.stats.as_dict(), has_entries(revalidations=1))
+
+    def test_counts_evictions(self):
+        page_cache = PageCache(MemoryCacheBackend(max_size=15), ttl=60)
+        page_cache.store('first', 'content', size=10)
+
+        page_cache.store('second', 'content', size=10)
+
+        assert_that(page_cache.stats.as_dict(), has_entries(evictions=1))
+
+
+class TestCreatePageCache:
+    def test_cache_disabled(self):
+        assert_that(create_page_cache('none', ttl=60, max_size=100, directory=''), is_(none()))
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            create_page_cache('redis', ttl=60, max_size=100, directory='')
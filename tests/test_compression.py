@@ -0,0 +1,128 @@
+import os
+import time
+import zlib
+from http import HTTPStatus
+
+import pytest
+from hamcrest import assert_that, equal_to, has_item, is_, is_not
+
+from habraproxy.cache import CacheEntry, DiskCacheBackend
+from habraproxy.compression import GZIP_WBITS, PageEncoder
+from habraproxy.templates import OriginTemplate
+
+PAGE_CONTENT = '<html><body><a href="http://{{ origin }}/ru/">Link</a>' + '<p>abcdef™</p>' * 100 + '</body></html>'
+
+
+@pytest.fixture
+def page():
+    return OriginTemplate.from_string(PAGE_CONTENT)
+
+
+class TestPageEncoder:
+    def test_page_compressed(self, page):
+        page_representation = PageEncoder().represent(page, '127.0.0.1', accept_encoding='gzip, deflate')
+
+        assert_that(page_representation.status, is_(equal_to(HTTPStatus.OK)))
+        assert_that(page_representation.headers, has_item(('Content-Encoding', 'gzip')))
+        assert_that(zlib.decompress(page_representation.content, GZIP_WBITS), is_(equal_to(page.render('127.0.0.1'))))
+
+    def test_brotli_preferred(self, page):
+        brotli = pytest.importorskip('brotli')
+
+        page_representation = PageEncoder().represent(page, '127.0.0.1', accept_encoding='gzip, deflate, br')
+
+        assert_that(page_representation.headers, has_item(('Content-Encoding', 'br')))
+        assert_that(brotli.decompress(page_representation.content), is_(equal_to(page.render('127.0.0.1'))))
+
+    def test_compressed_variant_reused(self, page, mocker):
+        page_encoder = PageEncoder()
+        compress_spy = mocker.spy(page_encoder, 'compress')
+
+        page_encoder.represent(page, '127.0.0.1', accept_encoding='gzip')
+        page_representation = page_encoder.represent(page, '127.0.0.1', accept_encoding='gzip')
+
+        assert_that(zlib.decompress(page_representation.content, GZIP_WBITS), is_(equal_to(page.render('127.0.0.1'))))
+        assert_that(compress_spy.call_count, is_(equal_to(1)))
+
+    def test_compressed_variant_reused_with_disk_cache(self, page, tmp_path, mocker):
+        backend = DiskCacheBackend(directory=str(tmp_path), max_size=1024 * 1024)
+        backend.set('/ru/', CacheEntry(value=page, size=page.size_with_variants, expires_at=time.time() + 60))
+        page_encoder = PageEncoder(variant_cache_size=1024 * 1024)
+        compress_spy = mocker.spy(page_encoder, 'compress')
+
+        page_representations = []
+        for _ in range(5):
+            # Each read from disk is a new page object without variants of its own
+            entry = backend.get('/ru/')
+            assert entry is not None
+            page_representations.append(page_encoder.represent(entry.value, '127.0.0.1', accept_encoding='gzip'))
+
+        assert_that(page_representations[4].headers, has_item(('Content-Encoding', 'gzip')))
+        assert_that(
+            zlib.decompress(page_representations[4].content, GZIP_WBITS),
+            is_(equal_to(page.render('127.0.0.1'))),
+        )
+        assert_that(compress_spy.call_count, is_(equal_to(1)))
+
+    def test_variants_limited(self, page):
+        page_encoder = PageEncoder(max_variants=2)
+
+        page_representations = [
+            page_encoder.represent(page, origin, accept_encoding='gzip')
+            for origin in ('127.0.0.1', '127.0.0.2', '127.0.0.3')
+        ]
+
+        assert_that(list(page.variants), is_(equal_to([('127.0.0.1', 'gzip'), ('127.0.0.2', 'gzip')])))
+        assert_that(page_representations[2].content, is_(equal_to(page.render('127.0.0.3'))))
+
+    def test_variant_not_fitting_into_budget_not_sent(self):
+        # Random content is not compressible
+        page = OriginTemplate([os.urandom(2000)])
+        page_encoder = PageEncoder()
+
+        page_representation = page_encoder.represent(page, '127.0.0.1', accept_encoding='gzip')
+        next_page_representation = page_encoder.represent(page, '127.0.0.1', accept_encoding='gzip')
+
+        assert_that(page_representation.content, is_(equal_to(page.render('127.0.0.1'))))
+        assert_that(next_page_representation.headers, is_(equal_to(page_representation.headers)))
+        assert_that(page.variants, is_(equal_to({})))
+
+    @pytest.mark.parametrize('accept_encoding', [
+        pytest.param('', id='no_accept_encoding'),
+        pytest.param('gzip;q=0, identity', id='gzip_refused'),
+    ])
+    def test_page_not_compressed_if_not_accepted(self, page, accept_encoding):
+        page_representation = PageEncoder().represent(page, '127.0.0.1', accept_encoding=accept_encoding)
+
+        assert_that(page_representation.content, is_(equal_to(page.render('127.0.0.1'))))
+        assert_that([header_name for header_name, _ in page_representation.headers], is_(equal_to(['ETag', 'Vary'])))
+
+    def test_small_page_not_compressed(self, page):
+        page_encoder = PageEncoder(min_size=page.size + 1)
+
+        page_representation = page_encoder.represent(page, '127.0.0.1', accept_encoding='gzip')
+
+        assert_that(page_representation.content, is_(equal_to(page.render('127.0.0.1'))))
+
+    def test_not_modified_page_not_rendered(self, page, mocker):
+        page_encoder = PageEncoder()
+        etag = dict(page_encoder.represent(page, '127.0.0.1', accept_encoding='gzip').headers)['ETag']
+        render_spy = mocker.spy(OriginTemplate, 'render')
+
+        page_representation = page_encoder.represent(page, '127.0.0.1', accept_encoding='gzip', if_none_match=etag)
+
+        assert_that(page_representation.status, is_(equal_to(HTTPStatus.NOT_MODIFIED)))
+        assert_that(page_representation.content, is_(equal_to(b'')))
+        assert_that(render_spy.call_count, is_(equal_to(0)))
+
+    @pytest.mark.parametrize('origin,accept_encoding', [
+        pytest.param('127.0.0.2', 'gzip', id='another_origin'),
+        pytest.param('127.0.0.1', '', id='another_encoding'),
+    ])
+    def test_etag_differs_for_representations(self, page, origin, accept_encoding):
+        page_encoder = PageEncoder()
+        etag = dict(page_encoder.represent(page, '127.0.0.1', accept_encoding='gzip').headers)['ETag']
+
+        page_representation = page_encoder.represent(page, origin, accept_encoding=accept_encoding)
+
+        assert_that(dict(page_representation.headers)['ETag'], is_not(equal_to(etag)))
@@ -0,0 +1,48 @@
+from hamcrest import assert_that, equal_to, has_entries, is_
+
+from habraproxy.marking import WordMarker
+
+
+class TestWordMarker:
+    def test_marks_words(self):
+        word_marker = WordMarker()
+
+        assert_that(word_marker.mark('abcdef ghij klmnopqr'), is_(equal_to('abcdef™ ghij klmnopqr')))
+
+    def test_urls_not_marked(self):
+        word_marker = WordMarker()
+
+        marked_text = word_marker.mark('http://abcdef.com abcdef https://ghijkl.com/abcdef ghijkl')
+
+        assert_that(marked_text, is_(equal_to('http://abcdef.com abcdef™ https://ghijkl.com/abcdef ghijkl™')))
+
+    def test_url_must_start_chunk(self):
+        word_marker = WordMarker()
+
+        assert_that(word_marker.mark('abcdef_http://ghijkl'), is_(equal_to('abcdef_http://ghijkl™')))
+
+    def test_repeated_text_memoized(self):
+        word_marker = WordMarker()
+
+        word_marker.mark('abcdef')
+        word_marker.mark('abcdef')
+        word_marker.mark('ghijkl')
+
+        assert_that(word_marker.memo_stats(), has_entries(hits=1, misses=2, size=2))
+        assert_that(word_marker.memo_stats()['hit_ratio'], is_(equal_to(1 / 3)))
+
+    def test_long_text_not_memoized(self):
+        word_marker = WordMarker(memo_max_length=10)
+
+        marked_text = word_marker.mark('abcdef ghijkl')
+
+        assert_that(marked_text, is_(equal_to('abcdef™ ghijkl™')))
+        assert_that(word_marker.memo_stats(), has_entries(hits=0, misses=0, size=0, hit_ratio=0))
+
+    def test_memo_bounded(self):
+        word_marker = WordMarker(memo_size=2)
+
+        for text in ('abcdef', 'ghijkl', 'mnopqr'):
+            word_marker.mark(text)
+
+        assert_that(word_marker.memo_stats(), has_entries(size=2))
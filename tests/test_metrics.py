@@ -0,0 +1,81 @@
+from hamcrest import (
+    all_of,
+    assert_that,
+    contains_string,
+    equal_to,
+    greater_than_or_equal_to,
+    is_,
+    is_not,
+    none,
+    starts_with,
+)
+
+from habraproxy.metrics import Counter, Histogram, Metrics
+
+
+class TestHistogram:
+    def test_histogram_rendered_with_cumulative_buckets(self):
+        histogram = Histogram('duration_seconds', 'Duration.', label_name='stage', buckets=(0.1, 1))
+
+        histogram.observe('parse', 0.05)
+        histogram.observe('parse', 0.5)
+        histogram.observe('parse', 5)
+
+        assert_that(list(histogram.render()), is_(equal_to([
+            '# HELP duration_seconds Duration.',
+            '# TYPE duration_seconds histogram',
+            'duration_seconds_bucket{stage="parse",le="0.1"} 1',
+            'duration_seconds_bucket{stage="parse",le="1"} 2',
+            'duration_seconds_bucket{stage="parse",le="+Inf"} 3',
+            'duration_seconds_sum{stage="parse"} 5.55',
+            'duration_seconds_count{stage="parse"} 3',
+        ])))
+
+
+class TestCounter:
+    def test_counter_label_escaped(self):
+        counter = Counter('responses_total', 'Responses.', label_name='status')
+
+        counter.increment('"200"', 2)
+
+        assert_that(list(counter.render())[-1], is_(equal_to('responses_total{status="\\"200\\""} 2')))
+
+
+class TestMetrics:
+    def test_request_timings_collected(self):
+        metrics = Metrics()
+
+        with metrics.time_request() as request_timings:
+            with metrics.stage('parse'):
+                pass
+            metrics.observe_stage('parse', 0.002)
+
+        assert request_timings is not None
+        assert_that(request_timings.header(), all_of(starts_with('parse;dur='), contains_string(', total;dur=')))
+        assert_that(request_timings.durations['parse'], is_(greater_than_or_equal_to(0.002)))
+        assert_that(metrics.render(), contains_string('habraproxy_stage_duration_seconds_count{stage="parse"} 2'))
+
+    def test_stages_outside_of_request_recorded(self):
+        metrics = Metrics()
+
+        metrics.observe_stage('fetch', 0.1)
+
+        assert_that(metrics.render(), contains_string('habraproxy_stage_duration_seconds_count{stage="fetch"} 1'))
+
+    def test_disabled_metrics_record_nothing(self):
+        metrics = Metrics(enabled=False)
+
+        with metrics.time_request() as request_timings:
+            with metrics.stage('parse'):
+                pass
+        metrics.observe_upstream(200, 1024)
+
+        assert_that(request_timings, is_(none()))
+        assert_that(metrics.render(), is_not(contains_string('habraproxy_stage_duration_seconds_count')))
+        assert_that(metrics.render(), is_not(contains_string('habraproxy_upstream_bytes_total{')))
+
+    def test_collector_samples_rendered(self):
+        metrics = Metrics()
+        metrics.add_collector(lambda: [('cache_total', 'counter', 'Cache.', [({'outcome': 'hit'}, 3)])])
+
+        assert_that(metrics.render(), contains_string('# TYPE cache_total counter\ncache_total{outcome="hit"} 3\n'))
@@ -0,0 +1,265 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import List, Sequence
+
+import pytest
+from hamcrest import assert_that, equal_to, has_entries, has_items, is_
+
+from habraproxy.cache import MemoryCacheBackend, PageCache
+from habraproxy.metrics import Metrics, RequestTimings
+from habraproxy.pages import AsyncPageService, PageService, RecentPages
+from habraproxy.services import SiteProxy, UpstreamPage
+from habraproxy.templates import OriginTemplate
+from tests.async_runner import run_async
+
+PAGE_CONTENT = '<html><body><div>abcdef</div></body></html>'
+PROCESSED_PAGE = OriginTemplate.from_string('<html><body><div>abcdef™</div></body></html>')
+
+
+@pytest.fixture
+def site_proxy(mocker):
+    site_proxy = SiteProxy('https://habr.com')
+    fetch_page_mock = mocker.patch.object(site_proxy, 'fetch_page')
+    fetch_page_mock.return_value = UpstreamPage(
+        status=HTTPStatus.OK,
+        content=PAGE_CONTENT,
+        etag='"abc"',
+        last_modified='Wed, 18 Sep 2019 10:00:00 GMT',
+        raw_content=PAGE_CONTENT.encode('utf-8'),
+    )
+    return site_proxy
+
+
+class TestPageService:
+    def test_page_processed_without_cache(self, site_proxy):
+        page_service = PageService(site_proxy)
+
+        assert_that(page_service.get_page('/ru/'), is_(equal_to(PROCESSED_PAGE)))
+
+    def test_cached_page_reused(self, site_proxy, mocker):
+        page_service = PageService(site_proxy, cache=PageCache(MemoryCacheBackend(max_size=10000), ttl=60))
+        process_content_spy = mocker.spy(site_proxy, 'process_content')
+
+        page_service.get_page('/ru/')
+        page_content = page_service.get_page('/ru/')
+
+        assert_that(page_content, is_(equal_to(PROCESSED_PAGE)))
+        assert_that(site_proxy.fetch_page.call_count, is_(equal_to(1)))
+        assert_that(process_content_spy.call_count, is_(equal_to(1)))
+
+    def test_expired_page_revalidated(self, site_proxy, mocker):
+        page_cache = PageCache(MemoryCacheBackend(max_size=10000), ttl=-1)
+        page_service = PageService(site_proxy, cache=page_cache)
+        page_service.get_page('/ru/')
+        site_proxy.fetch_page.return_value = UpstreamPage(status=HTTPStatus.NOT_MODIFIED, content=None)
+        process_content_spy = mocker.spy(site_proxy, 'process_content')
+
+        page_content = page_service.get_page('/ru/')
+
+        assert_that(page_content, is_(equal_to(PROCESSED_PAGE)))
+        site_proxy.fetch_page.assert_called_with(
+            '/ru/',
+            etag='"abc"',
+            last_modified='Wed, 18 Sep 2019 10:00:00 GMT',
+            decode=True,
+        )
+        assert_that(process_content_spy.call_count, is_(equal_to(0)))
+        assert_that(page_cache.stats.as_dict(), has_entries(revalidations=1))
+
+    def test_error_page_not_cached(self, site_proxy):
+        page_cache = PageCache(MemoryCacheBackend(max_size=10000), ttl=60)
+        page_service = PageService(site_proxy, cache=page_cache)
+        site_proxy.fetch_page.return_value = UpstreamPage(status=HTTPStatus.NOT_FOUND, content=PAGE_CONTENT)
+
+        page_service.get_page('/ru/')
+        page_service.get_page('/ru/')
+
+        assert_that(site_proxy.fetch_page.call_count, is_(equal_to(2)))
+
+    def test_concurrent_requests_coalesced(self, site_proxy):
+        page_service = PageService(site_proxy, cache=PageCache(MemoryCacheBackend(max_size=10000), ttl=60))
+        release = threading.Event()
+        upstream_page = site_proxy.fetch_page.return_value
+        site_proxy.fetch_page.side_effect = lambda *args, **kwargs: release.wait(timeout=5) and upstream_page
+        threading.Timer(0.2, release.set).start()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            pages = list(executor.map(page_service.get_page, ['/ru/'] * 4))
+
+        assert_that(pages, is_(equal_to([PROCESSED_PAGE] * 4)))
+        assert_that(site_proxy.fetch_page.call_count, is_(equal_to(1)))
+
+    def test_page_loaded_by_another_process_reused(self, site_proxy):
+        page_cache = PageCache(MemoryCacheBackend(max_size=10000), ttl=60)
+        page_service = PageService(site_proxy, cache=page_cache)
+        page_cache.store('/ru/', OriginTemplate([b'cached content']), size=14)
+
+        page_content = page_service._load_page('/ru/')
+
+        assert_that(page_content, is_(equal_to(OriginTemplate([b'cached content']))))
+        assert_that(site_proxy.fetch_page.call_count, is_(equal_to(0)))
+
+    def test_page_streamed(self, site_proxy, mocker):
+        mocker.patch.object(site_proxy, 'stream_page', return_value=iter([PAGE_CONTENT.encode('utf-8')]))
+        page_service = PageService(site_proxy, cache=PageCache(MemoryCacheBackend(max_size=10000), ttl=60))
+
+        page_parts = list(page_service.iter_page('/ru/'))
+
+        rendered_page = b''.join(page_part.render('127.0.0.1') for page_part in page_parts)
+        assert_that(rendered_page, is_(equal_to(PROCESSED_PAGE.render('127.0.0.1'))))
+
+    def test_cached_page_not_streamed(self, site_proxy, mocker):
+        mocker.patch.object(site_proxy, 'stream_page')
+        page_service = PageService(site_proxy, cache=PageCache(MemoryCacheBackend(max_size=10000), ttl=60))
+        page_service.get_page('/ru/')
+
+        page_parts = list(page_service.iter_page('/ru/'))
+
+        assert_that(page_parts, is_(equal_to([PROCESSED_PAGE])))
+        assert_that(site_proxy.stream_page.call_count, is_(equal_to(0)))
+
+    def test_page_processed_in_transform_pool(self, site_proxy, mocker):
+        transform_pool = mocker.Mock()
+        transform_pool.process.return_value = PROCESSED_PAGE
+        page_service = PageService(site_proxy, transform_pool=transform_pool)
+
+        page = page_service.get_page('/ru/')
+
+        assert_that(page, is_(equal_to(PROCESSED_PAGE)))
+        transform_pool.process.assert_called_with(site_proxy.fetch_page.return_value, bytes_pipeline=False)
+
+    def test_page_processed_as_bytes(self, site_proxy, mocker):
+        page_service = PageService(site_proxy, bytes_pipeline=True)
+        process_content_spy = mocker.spy(site_proxy, 'process_content')
+
+        page = page_service.get_page('/ru/')
+
+        assert_that(page, is_(equal_to(PROCESSED_PAGE)))
+        site_proxy.fetch_page.assert_called_with('/ru/', decode=False)
+        assert_that(process_content_spy.call_count, is_(equal_to(0)))
+
+    def test_page_warmed_before_expiration(self, site_proxy):
+        page_service = PageService(site_proxy, cache=PageCache(MemoryCacheBackend(max_size=10000), ttl=10))
+        page_service.get_page('/ru/')
+        site_proxy.fetch_page.return_value = UpstreamPage(status=HTTPStatus.NOT_MODIFIED, content=None)
+
+        page_service.warm_page('/ru/', fresh_for=5)
+        page_service.warm_page('/ru/', fresh_for=20)
+
+        assert_that(site_proxy.fetch_page.call_count, is_(equal_to(2)))
+        site_proxy.fetch_page.assert_called_with(
+            '/ru/',
+            etag='"abc"',
+            last_modified='Wed, 18 Sep 2019 10:00:00 GMT',
+            decode=True,
+        )
+
+    def test_requested_pages_tracked(self, site_proxy):
+        recent_pages = RecentPages(max_size=2)
+        page_service = PageService(site_proxy, recent_pages=recent_pages)
+
+        for path in ('/ru/', '/ru/news/', '/ru/', '/ru/top/'):
+            page_service.get_page(path)
+
+        assert_that(recent_pages.requested_since(0), is_(equal_to(['/ru/top/', '/ru/'])))
+
+
+class TestAsyncPageService:
+    @pytest.fixture
+    def async_site_proxy(self, site_proxy, mocker):
+        async def fetch_page_async(*args, **kwargs):
+            await asyncio.sleep(0.05)
+            return site_proxy.fetch_page.return_value
+
+        mocker.patch.object(site_proxy, 'fetch_page_async', side_effect=fetch_page_async)
+        return site_proxy
+
+    def test_page_processed(self, async_site_proxy):
+        page_service = AsyncPageService(async_site_proxy)
+
+        page = run_async(page_service.get_page_async('/ru/'))
+
+        assert_that(page, is_(equal_to(PROCESSED_PAGE)))
+        async_site_proxy.fetch_page_async.assert_called_with(
+            '/ru/',
+            etag=None,
+            last_modified=None,
+            decode=True,
+            request_timings=None,
+        )
+
+    def test_page_processed_in_executor(self, async_site_proxy):
+        page_service = AsyncPageService(async_site_proxy, executor=ThreadPoolExecutor(max_workers=1))
+        processing_threads: List[threading.Thread] = []
+
+        def mark(text: str) -> str:
+            processing_threads.append(threading.current_thread())
+            return text
+
+        async_site_proxy.word_marker.mark = mark
+
+        run_async(page_service.get_page_async('/ru/'))
+
+        assert_that(processing_threads[0] is threading.main_thread(), is_(False))
+
+    def test_stages_timed_into_given_timings(self, async_site_proxy):
+        async_site_proxy.metrics = Metrics()
+        page_service = AsyncPageService(async_site_proxy, executor=ThreadPoolExecutor(max_workers=2))
+        # Context of the loop may be shared by concurrent requests (on Python 3.6), so it must not be used
+        context_timings = RequestTimings()
+        first_timings = RequestTimings()
+        second_timings = RequestTimings()
+
+        async def request_pages() -> None:
+            with async_site_proxy.metrics.bind_request(context_timings):
+                await asyncio.gather(
+                    page_service.get_page_async('/ru/', request_timings=first_timings),
+                    page_service.get_page_async('/ru/news/', request_timings=second_timings),
+                )
+
+        run_async(request_pages())
+
+        assert_that(list(first_timings.durations), has_items('parse', 'serialize'))
+        assert_that(list(second_timings.durations), has_items('parse', 'serialize'))
+        assert_that(context_timings.durations, is_(equal_to({})))
+
+    def test_concurrent_requests_coalesced(self, async_site_proxy):
+        page_service = AsyncPageService(async_site_proxy, cache=PageCache(MemoryCacheBackend(max_size=10000), ttl=60))
+
+        async def request_pages() -> List[OriginTemplate]:
+            return await asyncio.gather(*[page_service.get_page_async('/ru/') for _ in range(4)])
+
+        pages = run_async(request_pages())
+
+        assert_that(pages, is_(equal_to([PROCESSED_PAGE] * 4)))
+        assert_that(async_site_proxy.fetch_page_async.call_count, is_(equal_to(1)))
+
+    def test_expired_page_revalidated(self, async_site_proxy):
+        page_cache = PageCache(MemoryCacheBackend(max_size=10000), ttl=-1)
+        page_service = AsyncPageService(async_site_proxy, cache=page_cache)
+        run_async(page_service.get_page_async('/ru/'))
+        async_site_proxy.fetch_page.return_value = UpstreamPage(status=HTTPStatus.NOT_MODIFIED, content=None)
+
+        page = run_async(page_service.get_page_async('/ru/'))
+
+        assert_that(page, is_(equal_to(PROCESSED_PAGE)))
+        assert_that(page_cache.stats.as_dict(), has_entries(revalidations=1))
+
+    def test_warming_coalesced_with_requests(self, async_site_proxy):
+        page_service = AsyncPageService(async_site_proxy, cache=PageCache(MemoryCacheBackend(max_size=10000), ttl=60))
+
+        async def request_and_warm_page() -> Sequence[OriginTemplate]:
+            event_loop = asyncio.get_event_loop()
+            page_service.attach_event_loop(event_loop)
+            return await asyncio.gather(
+                page_service.get_page_async('/ru/'),
+                event_loop.run_in_executor(None, page_service.warm_page, '/ru/'),
+            )
+
+        pages = run_async(request_and_warm_page())
+
+        assert_that(pages, is_(equal_to([PROCESSED_PAGE] * 2)))
+        assert_that(async_site_proxy.fetch_page_async.call_count, is_(equal_to(1)))
+        assert_that(async_site_proxy.fetch_page.call_count, is_(equal_to(0)))
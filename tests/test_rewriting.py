@@ -0,0 +1,35 @@
+import pytest
+from hamcrest import assert_that, equal_to, is_
+
+from habraproxy.rewriting import MultiReplacer
+
+
+class TestMultiReplacer:
+    @pytest.mark.parametrize('replacements,text,expected_output', [
+        pytest.param([('a', 'b')], 'banana', 'bbnbnb', id='single_replacement'),
+        pytest.param([('a', 'o'), ('n', 'm')], 'banana', 'bomomo', id='multiple_replacements'),
+        pytest.param([('a', 'b'), ('b', 'c')], 'ab', 'bc', id='replacements_are_not_chained'),
+        pytest.param([('ab', '1'), ('abc', '2')], 'abcab', '21', id='longest_match_wins'),
+        pytest.param([('.*', '+')], 'a.*b', 'a+b', id='special_characters_escaped'),
+        pytest.param([('&amp;', '&'), (' ', '&nbsp;')], 'a&amp;b c', 'a&b&nbsp;c', id='entities'),
+        pytest.param([], 'banana', 'banana', id='no_replacements'),
+    ])
+    def test_replaces(self, replacements, text, expected_output):
+        replacer = MultiReplacer(replacements)
+
+        assert_that(replacer.replace(text), is_(equal_to(expected_output)))
+
+    def test_replaces_bytes(self):
+        replacer = MultiReplacer([('&amp;', '&'), ('\u00a0', '&nbsp;')])
+
+        processed_content = replacer.replace_bytes('a&amp;b\u00a0c'.encode('utf-8'))
+
+        assert_that(processed_content, is_(equal_to(b'a&b&nbsp;c')))
+
+    @pytest.mark.parametrize('replacements', [
+        pytest.param([('a', 'b'), ('', 'c')], id='empty_substring'),
+        pytest.param([('a', 'b'), ('a', 'c')], id='duplicate_substring'),
+    ])
+    def test_invalid_replacements_rejected(self, replacements):
+        with pytest.raises(ValueError):
+            MultiReplacer(replacements)
@@ -4,11 +4,14 @@ import pathlib
 import pytest
 import requests
 import requests_mock
-from hamcrest import assert_that, equal_to, instance_of, is_
+from hamcrest import assert_that, equal_to, instance_of, is_, same_instance
 from hamcrest.core.core.isequal import IsEqual
 from hamcrest.core.string_description import StringDescription
+from lxml import etree, html
 
+from habraproxy import settings
 from habraproxy.services import SiteProxy
+from habraproxy.upstream import UpstreamClient
 
 FIXTURES_DIR: pathlib.Path = pathlib.Path(__file__).resolve().parent / 'fixtures'
 
@@ -139,6 +142,27 @@ content_processor_cases = [
         '<html><body><div><!-- Yandex.Metrika counter --></div></body></html>',
         id='html_comment',
     ),
+    pytest.param(
+        (
+            '<html><body><img src="https://habr.com/images/a.png" srcset="https://habr.com/images/a@2x.png 2x">'
+            '<form action="https://habr.com/ru/search/"></form></body></html>'
+        ),
+        (
+            '<html><body><img src="http://{{ origin }}/images/a.png" srcset="http://{{ origin }}/images/a@2x.png 2x">'
+            '<form action="http://{{ origin }}/ru/search/"></form></body></html>'
+        ),
+        id='image_and_form_urls',
+    ),
+    pytest.param(
+        '<html><body><img src="https://habr.com/ru/captcha/"></body></html>',
+        '<html><body><img src="https://habr.com/ru/captcha/"></body></html>',
+        id='image_not_served_as_asset',
+    ),
+    pytest.param(
+        '<html><head><script src="https://habr.com/js/app.js"></script></head><body></body></html>',
+        '<html><head><script src="https://habr.com/js/app.js"></script></head><body></body></html>',
+        id='script_url',
+    ),
     pytest.param(
         '<html><body><div>abc&nbsp;def</div></body></html>',
         '<html><body><div>abc&nbsp;def</div></body></html>',
@@ -164,14 +188,14 @@ class TestSiteProxy:
     ])
     def test_joins_url_parts(self, path, expected_url, mocker):
         site_proxy = SiteProxy('https://habr.com')
-        page_request_mock = mocker.patch('requests.get')
+        page_request_mock = mocker.patch.object(site_proxy.client, 'get')
         dummy_response = requests.Response()
         dummy_response._content = b''  # type: ignore
         page_request_mock.return_value = dummy_response
 
         site_proxy.request_page('/ru/news/')
 
-        page_request_mock.assert_called_with('https://habr.com/ru/news/')
+        page_request_mock.assert_called_with('https://habr.com/ru/news/', headers={})
 
     def test_method_returns_page_content(self):
         site_proxy = SiteProxy('https://habr.com')
@@ -185,6 +209,41 @@ class TestSiteProxy:
 
         assert_that(page_content, is_(instance_of(str)))
 
+    # Tests for SiteProxy.stream_page()
+    def test_page_content_streamed(self):
+        site_proxy = SiteProxy('https://habr.com')
+        mocked_response_content = FIXTURES_DIR.joinpath('example_response.html').read_bytes()
+
+        with requests_mock.Mocker() as requests_mocker:
+            requests_mocker.get('https://habr.com/ru/news/', content=mocked_response_content)
+
+            chunks = list(site_proxy.stream_page('/ru/news/', chunk_size=1024))
+
+        assert_that(b''.join(chunks), is_(equal_to(mocked_response_content)))
+        assert_that(len(chunks), is_(equal_to(len(mocked_response_content) // 1024 + 1)))
+
+    def test_uses_provided_client(self, mocker):
+        client = UpstreamClient()
+        site_proxy = SiteProxy('https://habr.com', client=client)
+        page_request_mock = mocker.patch.object(client, 'get')
+        page_request_mock.return_value.content = b''
+        page_request_mock.return_value.headers = {}
+
+        site_proxy.request_page('/ru/news/')
+
+        assert_that(site_proxy.client, is_(same_instance(client)))
+        page_request_mock.assert_called_with('https://habr.com/ru/news/', headers={})
+
+    def test_async_client_created_only_when_needed(self, mocker):
+        async_client_class = mocker.patch('habraproxy.services.AsyncUpstreamClient')
+        site_proxy = SiteProxy('https://habr.com')
+
+        site_proxy.process_content('<html><body>Text</body></html>')
+        async_client_class.assert_not_called()
+
+        assert_that(site_proxy.async_client, is_(same_instance(site_proxy.async_client)))
+        async_client_class.assert_called_once_with()
+
     # Tests for SiteProxy.process_text()
     @pytest.mark.parametrize('input_text,expected_output', [
         pytest.param('abcdef ghij klmnopqr', 'abcdef™ ghij klmnopqr', id='latin_letters'),
@@ -232,6 +291,11 @@ class TestSiteProxy:
             id='another_origin',
         ),
         pytest.param('/ru/post/467875/', '/ru/post/467875/', id='relative_url'),
+        pytest.param('https://HABR.com/ru/', 'http://{{ origin }}/ru/', id='host_case_insensitive'),
+        pytest.param('https://habr.com?page=2#top', 'http://{{ origin }}?page=2#top', id='no_path'),
+        pytest.param('habr.com.evil.org/ru/', 'habr.com.evil.org/ru/', id='host_prefix'),
+        pytest.param('https://habr.com.evil.org/ru/', 'https://habr.com.evil.org/ru/', id='another_origin_with_prefix'),
+        pytest.param('mailto:habr.com', 'mailto:habr.com', id='another_scheme'),
     ])
     def test_url_origin_changed(self, url, expected_output):
         site_proxy = SiteProxy('https://habr.com')
@@ -240,11 +304,147 @@ class TestSiteProxy:
 
         assert_that(processed_url, is_(equal_to(expected_output)))
 
+    # Tests for SiteProxy.process_srcset()
+    @pytest.mark.parametrize('srcset,expected_output', [
+        pytest.param(
+            'https://habr.com/images/a.png 1x, https://habr.com/images/a@2x.png 2x',
+            'http://{{ origin }}/images/a.png 1x, http://{{ origin }}/images/a@2x.png 2x',
+            id='descriptors',
+        ),
+        pytest.param('//habr.com/static/a.png', 'http://{{ origin }}/static/a.png', id='single_url'),
+        pytest.param(
+            ' https://habr.com/images/a,b.png 1x,\n https://habr.com/images/c.png',
+            ' http://{{ origin }}/images/a,b.png 1x,\n http://{{ origin }}/images/c.png',
+            id='comma_in_url',
+        ),
+        pytest.param('https://habr.com/ru/a.png', 'https://habr.com/ru/a.png', id='not_an_asset'),
+        pytest.param(
+            'data:image/gif;base64,R0lGOD, 1x, https://habr.com/images/a.png 2x',
+            'data:image/gif;base64,R0lGOD, 1x, https://habr.com/images/a.png 2x',
+            id='data_url',
+        ),
+        pytest.param(
+            'https://habrastorage.org/a.png 1x,  https://habrastorage.org/b.png 2x',
+            'https://habrastorage.org/a.png 1x,  https://habrastorage.org/b.png 2x',
+            id='another_origin_left_as_is',
+        ),
+    ])
+    def test_srcset_origin_changed(self, srcset, expected_output):
+        site_proxy = SiteProxy('https://habr.com')
+
+        processed_srcset = site_proxy.process_srcset(srcset)
+
+        assert_that(processed_srcset, is_(equal_to(expected_output)))
+
     # Tests for SiteProxy.process_content()
     @pytest.mark.parametrize('input_content,expected_output', content_processor_cases)
     def test_content_changed(self, input_content, expected_output):
-        site_proxy = SiteProxy('https://habr.com')
+        site_proxy = SiteProxy('https://habr.com', origin_static_paths=settings.ORIGIN_STATIC_PATHS)
 
         processed_content = site_proxy.process_content(input_content)
 
         assert_that(processed_content, has_equal_content_to(expected_output))
+
+    # Tests for SiteProxy.process_content_bytes()
+    @pytest.mark.parametrize('input_content,expected_output', content_processor_cases)
+    def test_content_changed_as_bytes(self, input_content, expected_output):
+        site_proxy = SiteProxy('https://habr.com', origin_static_paths=settings.ORIGIN_STATIC_PATHS)
+
+        processed_content = site_proxy.process_content_bytes(input_content.encode('utf-8'))
+
+        assert_that(processed_content.decode('utf-8'), has_equal_content_to(expected_output))
+
+    @pytest.mark.parametrize('input_content,encoding', [
+        pytest.param(
+            '<html><head><meta charset="windows-1251"></head><body>абвгде</body></html>'.encode('cp1251'),
+            None,
+            id='meta_charset',
+        ),
+        pytest.param(
+            '<html><body>абвгде</body></html>'.encode('cp1251'),
+            'windows-1251',
+            id='given_encoding',
+        ),
+    ])
+    def test_content_encoding_respected(self, input_content, encoding):
+        site_proxy = SiteProxy('https://habr.com')
+
+        processed_content = site_proxy.process_content_bytes(input_content, encoding=encoding)
+
+        assert_that('абвгде™'.encode('utf-8') in processed_content, is_(True))
+
+    def test_response_charset_used(self, mocker):
+        site_proxy = SiteProxy('https://habr.com')
+        page_request_mock = mocker.patch.object(site_proxy.client, 'get')
+        page_request_mock.return_value.status_code = 200
+        page_request_mock.return_value.content = 'абвгде'.encode('cp1251')
+        page_request_mock.return_value.headers = {'Content-Type': 'text/html; charset=windows-1251'}
+
+        upstream_page = site_proxy.fetch_page('/ru/', decode=False)
+
+        assert_that(upstream_page.content, is_(None))
+        assert_that(upstream_page.encoding, is_(equal_to('windows-1251')))
+        assert_that(upstream_page.raw_content, is_(equal_to('абвгде'.encode('cp1251'))))
+
+    def test_unknown_charset_ignored(self, mocker):
+        site_proxy = SiteProxy('https://habr.com')
+        page_request_mock = mocker.patch.object(site_proxy.client, 'get')
+        page_request_mock.return_value.status_code = 200
+        page_request_mock.return_value.content = 'абв'.encode('utf-8') + b'\xff'
+        page_request_mock.return_value.headers = {'Content-Type': 'text/html; charset=utf8mb4'}
+
+        upstream_page = site_proxy.fetch_page('/ru/')
+
+        assert_that(upstream_page.content, is_(equal_to('абв\ufffd')))
+        assert_that(upstream_page.encoding, is_(None))
+        assert_that(upstream_page.raw_content, is_(None))
+        assert_that(upstream_page.size, is_(equal_to(7)))
+
+    def test_deeply_nested_tree_processed(self):
+        # Parser limits depth of the document, so such tree can only be built manually
+        site_proxy = SiteProxy('https://habr.com')
+        root_element = innermost_element = html.Element('div')
+        for _ in range(5000):
+            innermost_element = etree.SubElement(innermost_element, 'div')
+        innermost_element.text = 'abcdef'
+
+        site_proxy.process_element(root_element)
+
+        assert_that(innermost_element.text, is_(equal_to('abcdef™')))
+
+    def test_extra_replacements_applied(self):
+        site_proxy = SiteProxy('https://habr.com', extra_replacements=[('/images/123/', '/static/images/123/')])
+
+        processed_content = site_proxy.process_content('<html><body><img src="/images/123/a.png"></body></html>')
+
+        assert_that(processed_content, is_(equal_to('<html><body><img src="/static/images/123/a.png"></body></html>')))
+
+    def test_extra_replacements_override_built_in_ones(self):
+        site_proxy = SiteProxy(
+            'https://habr.com',
+            extra_replacements=[('url(/fonts', 'url(/assets/fonts')],
+            origin_static_paths=['images/1/sprite.svg'],
+        )
+
+        processed_content = site_proxy.process_content(
+            '<html><body><div style="background: url(/fonts/a.woff)">'
+            '<svg><use xlink:href="https://habr.com/images/1/sprite.svg#close"/></svg></div></body></html>',
+        )
+
+        assert_that(processed_content, is_(equal_to(
+            '<html><body><div style="background: url(/assets/fonts/a.woff)">'
+            '<svg><use xlink:href="/static/images/1/sprite.svg#close"></use></svg></div></body></html>',
+        )))
+
+    def test_other_origin_processed(self):
+        site_proxy = SiteProxy('http://127.0.0.1:8001', origin_static_paths=settings.ORIGIN_STATIC_PATHS)
+
+        processed_content = site_proxy.process_content(
+            '<html><body><a href="http://127.0.0.1:8001/ru/">Link</a><svg>'
+            '<use xlink:href="http://127.0.0.1:8001/images/1567794742/common-svg-sprite.svg#close"/></svg></body></html>',
+        )
+
+        assert_that(processed_content, is_(equal_to(
+            '<html><body><a href="http://{{ origin }}/ru/">Link</a><svg>'
+            '<use xlink:href="/static/images/1567794742/common-svg-sprite.svg#close"></use></svg></body></html>',
+        )))
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Union
+
+import pytest
+from hamcrest import assert_that, equal_to, is_
+
+from habraproxy.singleflight import AsyncSingleFlight, InterruptedCallError, SingleFlight
+from tests.async_runner import run_async
+
+WORKERS = 8
+
+
+def run_concurrently(single_flight: SingleFlight, function, keys):
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        futures = [executor.submit(single_flight.do, key, function) for key in keys]
+        return [future.exception() or future.result() for future in futures]
+
+
+class BlockingFunction:
+    """Function, which doesn't return until all callers have been started."""
+
+    def __init__(self, result: Any = None, error: Optional[BaseException] = None) -> None:
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self) -> Any:
+        self.calls += 1
+        self.release.wait(timeout=5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+@pytest.fixture(params=[None, 'lock_dir'])
+def single_flight(request, tmp_path):
+    return SingleFlight(lock_dir=str(tmp_path) if request.param else None)
+
+
+class TestSingleFlight:
+    def test_returns_result(self, single_flight):
+        assert_that(single_flight.do('/ru/', lambda: 'content'), is_(equal_to('content')))
+
+    def test_concurrent_calls_coalesced(self, single_flight):
+        function = BlockingFunction(result='content')
+        timer = threading.Timer(0.2, function.release.set)
+        timer.start()
+
+        results = run_concurrently(single_flight, function, ['/ru/'] * WORKERS)
+
+        assert_that(results, is_(equal_to(['content'] * WORKERS)))
+        assert_that(function.calls, is_(equal_to(1)))
+
+    def test_error_passed_to_all_callers(self, single_flight):
+        error = ValueError('Upstream is unavailable')
+        function = BlockingFunction(error=error)
+        timer = threading.Timer(0.2, function.release.set)
+        timer.start()
+
+        results = run_concurrently(single_flight, function, ['/ru/'] * WORKERS)
+
+        assert_that(results, is_(equal_to([error] * WORKERS)))
+        assert_that(function.calls, is_(equal_to(1)))
+
+    def test_interruption_of_leader_passed_to_waiters(self, single_flight):
+        function = BlockingFunction(error=SystemExit(1))
+        timer = threading.Timer(0.2, function.release.set)
+        timer.start()
+
+        results = run_concurrently(single_flight, function, ['/ru/'] * WORKERS)
+
+        assert_that(sorted(type(result).__name__ for result in results), is_(equal_to(
+            [InterruptedCallError.__name__] * (WORKERS - 1) + ['SystemExit'],
+        )))
+        assert_that(function.calls, is_(equal_to(1)))
+
+    def test_different_keys_not_coalesced(self, single_flight):
+        function = BlockingFunction(result='content')
+        function.release.set()
+
+        run_concurrently(single_flight, function, ['/ru/', '/en/'])
+
+        assert_that(function.calls, is_(equal_to(2)))
+
+    def test_sequential_calls_not_coalesced(self, single_flight):
+        function = BlockingFunction(result='content')
+        function.release.set()
+
+        single_flight.do('/ru/', function)
+        single_flight.do('/ru/', function)
+
+        assert_that(function.calls, is_(equal_to(2)))
+
+    def test_number_of_lock_files_limited(self, tmp_path):
+        single_flight = SingleFlight(lock_dir=str(tmp_path), lock_stripes=4)
+
+        for index in range(20):
+            single_flight.do('/ru/post/{0}/'.format(index), lambda: 'content')
+
+        assert_that(len(list(tmp_path.iterdir())), is_(equal_to(4)))
+
+
+class TestAsyncSingleFlight:
+    def test_concurrent_calls_coalesced(self):
+        single_flight = AsyncSingleFlight()
+        calls: List[int] = []
+
+        async def function() -> str:
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'content'
+
+        async def call_concurrently() -> List[str]:
+            return await asyncio.gather(*[single_flight.do('/ru/', function) for _ in range(WORKERS)])
+
+        results = run_async(call_concurrently())
+
+        assert_that(results, is_(equal_to(['content'] * WORKERS)))
+        assert_that(len(calls), is_(equal_to(1)))
+
+    def test_error_passed_to_all_callers(self):
+        single_flight = AsyncSingleFlight()
+        error = ValueError('Upstream is unavailable')
+
+        async def function() -> str:
+            await asyncio.sleep(0.05)
+            raise error
+
+        async def call_concurrently() -> List[Union[str, BaseException]]:
+            calls = [single_flight.do('/ru/', function) for _ in range(WORKERS)]
+            return await asyncio.gather(*calls, return_exceptions=True)
+
+        results = run_async(call_concurrently())
+
+        assert_that(results, is_(equal_to([error] * WORKERS)))
+
+    def test_cancelled_caller_does_not_cancel_others(self):
+        single_flight = AsyncSingleFlight()
+
+        async def function() -> str:
+            await asyncio.sleep(0.1)
+            return 'content'
+
+        async def call_and_cancel() -> str:
+            cancelled_call = asyncio.ensure_future(single_flight.do('/ru/', function))
+            call = asyncio.ensure_future(single_flight.do('/ru/', function))
+            await asyncio.sleep(0.01)
+            cancelled_call.cancel()
+            return await call
+
+        assert_that(run_async(call_and_cancel()), is_(equal_to('content')))
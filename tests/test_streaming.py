@@ -0,0 +1,80 @@
+import pathlib
+from typing import Iterator, List
+
+import pytest
+from hamcrest import assert_that, equal_to, greater_than, is_
+
+from habraproxy.services import SiteProxy
+from habraproxy.streaming import StreamingTransformer
+
+FIXTURES_DIR: pathlib.Path = pathlib.Path(__file__).resolve().parent / 'fixtures'
+
+
+def split_to_chunks(content: bytes, chunk_size: int) -> List[bytes]:
+    return [content[index:index + chunk_size] for index in range(0, len(content), chunk_size)]
+
+
+class TestStreamingTransformer:
+    @pytest.mark.parametrize('content', [
+        pytest.param('<html><body><div>abcdef ghij klmnopqr</div></body></html>', id='simple_text'),
+        pytest.param(
+            '<!DOCTYPE html>\n<html lang="ru"><head><title>Заголовок</title></head>\n'
+            '<body class="page"><div title="abcdef">Some text <b>abcdef</b> tail &amp; text</div>\n'
+            '<div><div><div><p>Deeply nested</p> element</div></div></div></body></html>',
+            id='sections',
+        ),
+        pytest.param(
+            '<html><body><div><script>var abcdef = 1 < 2;</script>abcdef<!-- abcdef -->abcdef</div></body></html>',
+            id='skipped_elements',
+        ),
+        pytest.param(
+            '<html><body><div><a href="https://habr.com/ru/" title="abcdef">Follow me</a></div></body></html>',
+            id='links',
+        ),
+    ])
+    @pytest.mark.parametrize('chunk_size', [1, 16, 1024])
+    def test_same_output_as_for_whole_content(self, content, chunk_size):
+        site_proxy = SiteProxy('https://habr.com')
+        expected_output = site_proxy.process_content(content)
+
+        chunks = split_to_chunks(content.encode('utf-8'), chunk_size)
+        output = ''.join(StreamingTransformer(site_proxy).transform(chunks))
+
+        assert_that(output, is_(equal_to(expected_output)))
+
+    @pytest.mark.parametrize('content', [
+        pytest.param(
+            '<html><body><ul>\n<li class="item"><!-- abcdef --></li>\n<li class="item"></li>\n'
+            '<li class="item"><p>abcdef</p></li></ul><p></p><p><br></p></body></html>',
+            id='empty_elements',
+        ),
+        pytest.param(FIXTURES_DIR.joinpath('example_response.html').read_text(encoding='utf-8'), id='real_page'),
+    ])
+    @pytest.mark.parametrize('flush_depth', [1, 3, 4, 10, 50])
+    def test_same_output_for_any_flush_depth(self, content, flush_depth):
+        site_proxy = SiteProxy('https://habr.com')
+        expected_output = site_proxy.process_content(content)
+
+        chunks = split_to_chunks(content.encode('utf-8'), 4096)
+        output = ''.join(StreamingTransformer(site_proxy, flush_depth=flush_depth).transform(chunks))
+
+        assert_that(output, is_(equal_to(expected_output)))
+
+    def test_output_emitted_before_end_of_input(self):
+        site_proxy = SiteProxy('https://habr.com')
+        content = '<html><head><title>Title</title></head><body>{0}'.format('<div>Some text</div>' * 1000)
+        chunks = split_to_chunks(content.encode('utf-8'), 1024) + [b'</body></html>']
+        output_sizes = []
+
+        def chunks_iterator() -> Iterator[bytes]:
+            for chunk in chunks:
+                yield chunk
+                output_sizes.append(len(emitted_parts))
+
+        emitted_parts = []
+        for part in StreamingTransformer(site_proxy).transform(chunks_iterator()):
+            emitted_parts.append(part)
+
+        # Head and parts of body are emitted while body is still being received
+        assert_that(output_sizes[-2], is_(greater_than(1)))
+        assert_that(''.join(emitted_parts), is_(equal_to(site_proxy.process_content(content + '</body></html>'))))
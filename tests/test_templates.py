@@ -0,0 +1,81 @@
+import pytest
+from hamcrest import assert_that, equal_to, is_, is_not
+
+from habraproxy.templates import OriginTemplate
+
+
+class TestOriginTemplate:
+    @pytest.mark.parametrize('content,expected_output', [
+        pytest.param('<html></html>', b'<html></html>', id='no_placeholders'),
+        pytest.param(
+            '<a href="http://{{ origin }}/ru/">Link</a>',
+            b'<a href="http://127.0.0.1:5000/ru/">Link</a>',
+            id='single_placeholder',
+        ),
+        pytest.param(
+            '{{ origin }}<a href="http://{{ origin }}/">Link™</a>{{ origin }}',
+            '127.0.0.1:5000<a href="http://127.0.0.1:5000/">Link™</a>127.0.0.1:5000'.encode('utf-8'),
+            id='multiple_placeholders',
+        ),
+        pytest.param(
+            '<div>{% if x %}{{ y }}{# comment #}</div>',
+            b'<div>{% if x %}{{ y }}{# comment #}</div>',
+            id='template_syntax_not_executed',
+        ),
+    ])
+    def test_placeholders_substituted(self, content, expected_output):
+        template = OriginTemplate.from_string(content)
+
+        assert_that(template.render('127.0.0.1:5000'), is_(equal_to(expected_output)))
+
+    def test_origin_escaped(self):
+        template = OriginTemplate.from_string('<a href="http://{{ origin }}/">Link</a>')
+
+        rendered_content = template.render('evil"><script>')
+
+        assert_that(rendered_content, is_(equal_to(b'<a href="http://evil&quot;&gt;&lt;script&gt;/">Link</a>')))
+
+    def test_size(self):
+        template = OriginTemplate.from_string('абв{{ origin }}abc')
+
+        assert_that(template.size, is_(equal_to(9)))
+
+    def test_variants_limited_by_budget(self):
+        template = OriginTemplate.from_string('a' * 100)
+
+        added = [
+            template.add_variant(('127.0.0.1', 'gzip'), b'b' * 50),
+            template.add_variant(('127.0.0.2', 'gzip'), b'b' * 50),
+        ]
+
+        assert_that(added, is_(equal_to([True, False])))
+        assert_that(list(template.variants), is_(equal_to([('127.0.0.1', 'gzip')])))
+        assert_that(template.add_variant(('127.0.0.3', 'gzip'), b'b'), is_(equal_to(False)))
+        assert_that(template.size_with_variants, is_(equal_to(175)))
+
+    def test_created_from_bytes(self):
+        content = 'абв<a href="http://{{ origin }}/">Link</a>'
+
+        template = OriginTemplate.from_bytes(content.encode('utf-8'))
+
+        assert_that(template, is_(equal_to(OriginTemplate.from_string(content))))
+
+    def test_fingerprint_depends_on_content_and_origin(self):
+        template = OriginTemplate.from_string('<a href="http://{{ origin }}/">Link</a>')
+        same_template = OriginTemplate.from_string('<a href="http://{{ origin }}/">Link</a>')
+        changed_template = OriginTemplate.from_string('<a href="http://{{ origin }}/">Link™</a>')
+
+        assert_that(template.fingerprint('127.0.0.1'), is_(equal_to(same_template.fingerprint('127.0.0.1'))))
+        assert_that(template.fingerprint('127.0.0.1'), is_not(equal_to(template.fingerprint('127.0.0.2'))))
+        assert_that(template.fingerprint('127.0.0.1'), is_not(equal_to(changed_template.fingerprint('127.0.0.1'))))
+
+    def test_origin_links(self):
+        template = OriginTemplate.from_string(
+            '<a href="http://{{ origin }}/ru/post/1/#comments">Post</a>'
+            '<img src="http://{{ origin }}/images/a.png" srcset="http://{{ origin }}/images/b.png 2x">'
+            '<form action="http://{{ origin }}/ru/search/"></form>'
+            '<svg><use xlink:href="http://{{ origin }}/images/sprite.svg#icon"></use></svg>'
+            "<a class='main'\nhref='http://{{ origin }}'>Main</a>",
+        )
+
+        assert_that(list(template.origin_links()), is_(equal_to(['/ru/post/1/#comments', ''])))
@@ -0,0 +1,92 @@
+import os
+import signal
+from concurrent.futures import Future
+from http import HTTPStatus
+from typing import cast
+
+import pytest
+from hamcrest import assert_that, equal_to, is_, is_not, same_instance
+
+from habraproxy.services import PageTransformer, SiteProxy, UpstreamPage
+from habraproxy.templates import OriginTemplate
+from habraproxy.transform_pool import SiteProxyOptions, TransformPool, TransformPoolSaturatedError, _worker_transformer
+
+UPSTREAM_PAGE = UpstreamPage(
+    status=HTTPStatus.OK,
+    content='<html><body><a href="https://habr.com/ru/">abcdef</a></body></html>',
+    raw_content='<html><body><a href="https://habr.com/ru/">abcdef</a></body></html>'.encode('utf-8'),
+)
+
+
+@pytest.fixture
+def pending_executor(mocker):
+    # Executor, which never completes submitted tasks, until they are completed manually
+    executor = mocker.Mock()
+    executor.submit.side_effect = lambda *args: Future()
+    return executor
+
+
+class TestTransformPool:
+    @pytest.mark.parametrize('bytes_pipeline', [False, True])
+    def test_page_processed_in_worker(self, bytes_pipeline):
+        transform_pool = TransformPool(SiteProxyOptions('https://habr.com'), max_workers=1)
+
+        try:
+            page = transform_pool.process(UPSTREAM_PAGE, bytes_pipeline=bytes_pipeline)
+        finally:
+            transform_pool.shutdown()
+
+        assert_that(page, is_(equal_to(SiteProxy('https://habr.com').process_page(UPSTREAM_PAGE))))
+
+    def test_started_pool_has_workers(self):
+        transform_pool = TransformPool(SiteProxyOptions('https://habr.com'), max_workers=2)
+
+        try:
+            transform_pool.start()
+            processes = transform_pool._get_executor()._processes
+            process_count = len(processes) if processes is not None else 0
+        finally:
+            transform_pool.shutdown()
+
+        assert_that(process_count, is_(equal_to(2)))
+
+    def test_broken_pool_replaced(self):
+        transform_pool = TransformPool(SiteProxyOptions('https://habr.com'), max_workers=1)
+        expected_page = SiteProxy('https://habr.com').process_page(UPSTREAM_PAGE)
+
+        try:
+            transform_pool.start()
+            broken_executor = transform_pool._get_executor()
+            for process in list((broken_executor._processes or {}).values()):
+                os.kill(cast(int, process.pid), signal.SIGKILL)
+            pages = [transform_pool.process(UPSTREAM_PAGE), transform_pool.process(UPSTREAM_PAGE)]
+            executor = transform_pool._get_executor()
+        finally:
+            transform_pool.shutdown()
+
+        assert_that(pages, is_(equal_to([expected_page, expected_page])))
+        assert_that(executor, is_not(same_instance(broken_executor)))
+
+    def test_saturated_pool_rejects_pages(self, pending_executor, mocker):
+        transform_pool = TransformPool(SiteProxyOptions('https://habr.com'), max_workers=1, max_queue_size=1)
+        mocker.patch.object(transform_pool, '_get_executor', return_value=pending_executor)
+        transform_pool.submit(UPSTREAM_PAGE)
+        transform_pool.submit(UPSTREAM_PAGE)
+
+        with pytest.raises(TransformPoolSaturatedError):
+            transform_pool.submit(UPSTREAM_PAGE)
+
+    def test_completed_pages_free_queue(self, pending_executor, mocker):
+        transform_pool = TransformPool(SiteProxyOptions('https://habr.com'), max_workers=1, max_queue_size=0)
+        mocker.patch.object(transform_pool, '_get_executor', return_value=pending_executor)
+        future = transform_pool.submit(UPSTREAM_PAGE)
+        future.set_result(OriginTemplate([]))
+
+        transform_pool.submit(UPSTREAM_PAGE)
+
+        assert_that(pending_executor.submit.call_count, is_(equal_to(2)))
+
+    def test_worker_builds_transformer_only(self):
+        transformer = _worker_transformer(SiteProxyOptions('https://habr.com'))
+
+        assert_that(type(transformer), is_(equal_to(PageTransformer)))
@@ -0,0 +1,84 @@
+from typing import cast
+
+import httpx
+import pytest
+import requests_mock
+from hamcrest import assert_that, equal_to, is_, same_instance
+from requests.adapters import HTTPAdapter
+
+from habraproxy.upstream import AsyncUpstreamClient, UpstreamClient
+from tests.async_runner import run_async
+
+
+class TestUpstreamClient:
+    def test_adapter_configured(self):
+        client = UpstreamClient(pool_size=25, max_retries=4, backoff_factor=0.5)
+
+        adapter = cast(HTTPAdapter, client.session.get_adapter('https://habr.com/'))
+
+        assert_that(adapter._pool_maxsize, is_(equal_to(25)))
+        assert_that(adapter.max_retries.total, is_(equal_to(4)))
+        assert_that(adapter.max_retries.backoff_factor, is_(equal_to(0.5)))
+
+    def test_same_adapter_for_both_schemes(self):
+        client = UpstreamClient()
+
+        http_adapter = client.session.get_adapter('http://habr.com/')
+        https_adapter = client.session.get_adapter('https://habr.com/')
+
+        assert_that(http_adapter, is_(same_instance(https_adapter)))
+
+    def test_timeouts_passed_to_request(self):
+        client = UpstreamClient(connect_timeout=1.5, read_timeout=7)
+
+        with requests_mock.Mocker() as requests_mocker:
+            requests_mocker.get('https://habr.com/ru/', text='')
+
+            client.get('https://habr.com/ru/')
+
+            assert_that(requests_mocker.last_request.timeout, is_(equal_to((1.5, 7))))
+
+    def test_headers_passed_to_request(self):
+        client = UpstreamClient()
+
+        with requests_mock.Mocker() as requests_mocker:
+            requests_mocker.get('https://habr.com/ru/', text='')
+
+            client.get('https://habr.com/ru/', headers={'If-None-Match': '"abc"'})
+
+            assert_that(requests_mocker.last_request.headers['If-None-Match'], is_(equal_to('"abc"')))
+
+
+class TestAsyncUpstreamClient:
+    def test_failed_request_retried(self, mocker):
+        client = AsyncUpstreamClient(max_retries=2, backoff_factor=0)
+        request = httpx.Request('GET', 'https://habr.com/ru/')
+        responses = [
+            httpx.ConnectError('Connection refused', request=request),
+            httpx.Response(503, request=request),
+            httpx.Response(200, request=request),
+        ]
+        get_mock = mocker.patch.object(client.client, 'get', side_effect=responses)
+
+        response = run_async(client.get('https://habr.com/ru/'))
+
+        assert_that(response.status_code, is_(equal_to(200)))
+        assert_that(get_mock.call_count, is_(equal_to(3)))
+
+    def test_last_response_returned_when_retries_exhausted(self, mocker):
+        client = AsyncUpstreamClient(max_retries=1, backoff_factor=0)
+        request = httpx.Request('GET', 'https://habr.com/ru/')
+        get_mock = mocker.patch.object(client.client, 'get', return_value=httpx.Response(503, request=request))
+
+        response = run_async(client.get('https://habr.com/ru/'))
+
+        assert_that(response.status_code, is_(equal_to(503)))
+        assert_that(get_mock.call_count, is_(equal_to(2)))
+
+    def test_error_raised_when_retries_exhausted(self, mocker):
+        client = AsyncUpstreamClient(max_retries=1, backoff_factor=0)
+        request = httpx.Request('GET', 'https://habr.com/ru/')
+        mocker.patch.object(client.client, 'get', side_effect=httpx.ConnectTimeout('Timed out', request=request))
+
+        with pytest.raises(httpx.ConnectTimeout):
+            run_async(client.get('https://habr.com/ru/'))
@@ -1,7 +1,15 @@
+import zlib
 from http import HTTPStatus
 
 import pytest
-from hamcrest import assert_that, equal_to, is_
+from hamcrest import all_of, assert_that, contains_string, equal_to, has_entries, instance_of, is_, none
+
+from habraproxy.app import app
+from habraproxy.assets import AssetStore
+from habraproxy.compression import GZIP_WBITS
+from habraproxy.services import UpstreamPage
+from habraproxy.transform_pool import TransformPoolSaturatedError
+from habraproxy.views import match_page_path
 
 
 class TestHabrProxyView:
@@ -12,13 +20,13 @@ class TestHabrProxyView:
         pytest.param('/news/2019/', id='multiple_chunks'),
     ])
     def test_view_works_for_any_content_url(self, client, path, mocker):
-        mocked_page_request = mocker.patch('habraproxy.services.SiteProxy.request_page')
-        mocked_page_request.return_value = """
+        mocked_page_request = mocker.patch('habraproxy.services.SiteProxy.fetch_page')
+        mocked_page_request.return_value = UpstreamPage(status=HTTPStatus.OK, content="""
         <html><body><div>
         Some text to process.
         <a href="https://habr.com/ru/news">Internal link that should be replaced.</a>
         </div></body></html>
-        """
+        """)
         expected_rescponse_content = b"""
         <html><body><div>
         Some text to process.
@@ -32,7 +40,157 @@ class TestHabrProxyView:
         assert_that(response.content_type, is_(equal_to('text/html; charset=utf-8')))
         assert_that(response.data, is_(equal_to(expected_rescponse_content)))
 
-    def test_view_raises_404_for_image(self, client):
-        response = client.get('http://127.0.0.1:5000{0}'.format('/images/unknown_image.png'))
+    def test_view_compresses_page(self, client, mocker):
+        mocked_page_request = mocker.patch('habraproxy.services.SiteProxy.fetch_page')
+        page_content = '<html><body>{0}</body></html>'.format('<p>abc</p>' * 200)
+        mocked_page_request.return_value = UpstreamPage(status=HTTPStatus.OK, content=page_content)
+        mocker.patch.object(app.extensions['page_encoder'], 'min_size', 0)
+
+        response = client.get('http://127.0.0.1:5000/ru/', headers={'Accept-Encoding': 'gzip'})
+        not_modified_response = client.get(
+            'http://127.0.0.1:5000/ru/',
+            headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']},
+        )
+
+        assert_that(response.headers['Content-Encoding'], is_(equal_to('gzip')))
+        assert_that(zlib.decompress(response.data, GZIP_WBITS), is_(equal_to(page_content.encode('utf-8'))))
+        assert_that(not_modified_response.status_code, is_(equal_to(HTTPStatus.NOT_MODIFIED)))
+
+    def test_view_streams_page(self, client, mocker):
+        mocker.patch.dict(app.config, {'STREAMING': True})
+        mocked_page_request = mocker.patch('habraproxy.services.SiteProxy.stream_page')
+        mocked_page_request.return_value = iter([
+            b'<html><head><title>Title</title></head><body><div>',
+            b'<a href="https://habr.com/ru/news">Link</a></div></body></html>',
+        ])
+
+        response = client.get('http://127.0.0.1:5000/ru/')
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.OK)))
+        assert_that(response.is_streamed, is_(True))
+        assert_that(response.data, is_(equal_to(
+            b'<html><head><title>Title</title></head><body><div>'
+            b'<a href="http://127.0.0.1:5000/ru/news">Link</a></div></body></html>',
+        )))
+
+    def test_view_returns_503_when_overloaded(self, client, mocker):
+        mocker.patch('habraproxy.pages.PageService.get_page', side_effect=TransformPoolSaturatedError)
+
+        response = client.get('http://127.0.0.1:5000/ru/')
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.SERVICE_UNAVAILABLE)))
+        assert_that(response.headers['Retry-After'], is_(equal_to('1')))
+
+    def test_view_reports_server_timing(self, client, mocker):
+        mocked_page_request = mocker.patch('habraproxy.services.SiteProxy.fetch_page')
+        mocked_page_request.return_value = UpstreamPage(status=HTTPStatus.OK, content='<html><body></body></html>')
+        mocker.patch.object(app.extensions['metrics'], 'enabled', True)
+
+        response = client.get('http://127.0.0.1:5000/ru/')
+
+        assert_that(response.headers['Server-Timing'], all_of(
+            contains_string('parse;dur='),
+            contains_string('render;dur='),
+            contains_string('total;dur='),
+        ))
+
+    def test_view_skips_server_timing_when_metrics_disabled(self, client, mocker):
+        mocked_page_request = mocker.patch('habraproxy.services.SiteProxy.fetch_page')
+        mocked_page_request.return_value = UpstreamPage(status=HTTPStatus.OK, content='<html><body></body></html>')
+        mocker.patch.object(app.extensions['metrics'], 'enabled', False)
+
+        response = client.get('http://127.0.0.1:5000/ru/')
+
+        assert_that(response.headers.get('Server-Timing'), is_(none()))
+
+
+class TestAssetView:
+    @pytest.fixture
+    def asset_store(self, tmp_path, mocker):
+        asset_store = AssetStore(str(tmp_path), max_size=10000)
+        mocker.patch.object(app.extensions['asset_proxy'], 'store', asset_store)
+        return asset_store
+
+    def test_view_serves_stored_asset(self, client, asset_store):
+        asset = asset_store.put('https://habr.com/images/a.png', [b'abcdef'], 'image/png')
+
+        response = client.get('http://127.0.0.1:5000/images/a.png')
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.OK)))
+        assert_that(response.get_data(), is_(equal_to(b'abcdef')))
+        assert_that(response.headers['ETag'], is_(equal_to('"{0}"'.format(asset.etag))))
+        response.close()
+
+    def test_view_serves_requested_range(self, client, asset_store):
+        asset_store.put('https://habr.com/images/a.png', [b'abcdef'], 'image/png')
+
+        response = client.get('http://127.0.0.1:5000/images/a.png', headers={'Range': 'bytes=1-3'})
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.PARTIAL_CONTENT)))
+        assert_that(response.headers['Content-Range'], is_(equal_to('bytes 1-3/6')))
+        assert_that(response.get_data(), is_(equal_to(b'bcd')))
+        response.close()
+
+    def test_view_redirects_to_origin_for_not_an_asset(self, client, asset_store, mocker):
+        mocked_request = mocker.patch.object(app.extensions['asset_proxy'].client, 'get')
+        mocked_request.return_value.status_code = HTTPStatus.OK
+        mocked_request.return_value.headers = {'Content-Type': 'text/html; charset=utf-8'}
+
+        response = client.get('http://127.0.0.1:5000/static/ru/post/1/')
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.FOUND)))
+        assert_that(response.headers['Location'], is_(equal_to('https://habr.com/ru/post/1/')))
+        assert_that(asset_store.get('https://habr.com/ru/post/1/'), is_(none()))
+
+
+class TestCacheStatsView:
+    def test_view_returns_counters(self, client, mocker):
+        mocked_page_request = mocker.patch('habraproxy.services.SiteProxy.fetch_page')
+        mocked_page_request.return_value = UpstreamPage(status=HTTPStatus.OK, content='<html><body></body></html>')
+        client.get('http://127.0.0.1:5000/ru/')
+        client.get('http://127.0.0.1:5000/ru/')
+
+        response = client.get('http://127.0.0.1:5000/cache-stats')
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.OK)))
+        assert_that(response.get_json(), has_entries(
+            page_cache=has_entries(enabled=True),
+            text_memo=has_entries(hit_ratio=instance_of(float)),
+        ))
+        assert_that(mocked_page_request.call_count, is_(equal_to(1)))
+
+
+class TestMetricsView:
+    def test_view_renders_metrics(self, client, mocker):
+        mocked_page_request = mocker.patch('habraproxy.services.SiteProxy.fetch_page')
+        mocked_page_request.return_value = UpstreamPage(status=HTTPStatus.OK, content='<html><body></body></html>')
+        mocker.patch.object(app.extensions['metrics'], 'enabled', True)
+        client.get('http://127.0.0.1:5000/ru/')
+
+        response = client.get('http://127.0.0.1:5000/metrics')
+
+        assert_that(response.status_code, is_(equal_to(HTTPStatus.OK)))
+        assert_that(response.content_type, is_(equal_to('text/plain; version=0.0.4; charset=utf-8')))
+        assert_that(response.get_data(as_text=True), all_of(
+            contains_string('habraproxy_stage_duration_seconds_count{stage="parse"}'),
+            contains_string('habraproxy_page_cache_events_total{outcome="misses"}'),
+        ))
+
+    def test_view_not_found_when_metrics_disabled(self, client, mocker):
+        mocker.patch.object(app.extensions['metrics'], 'enabled', False)
+
+        response = client.get('http://127.0.0.1:5000/metrics')
 
         assert_that(response.status_code, is_(equal_to(HTTPStatus.NOT_FOUND)))
+
+
+class TestMatchPagePath:
+    @pytest.mark.parametrize('url, expected_path', [
+        ('http://127.0.0.1:5000/ru/post/1/?page=2#comments', 'ru/post/1/'),
+        ('/ru/', 'ru/'),
+        ('/', ''),
+        ('/static/logo.png', None),
+        ('/cache-stats', None),
+    ])
+    def test_page_path_matched(self, url, expected_path):
+        assert_that(match_page_path(app.url_map, url), is_(equal_to(expected_path)))
@@ -0,0 +1,171 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from typing import Any, Callable, Dict, List, Optional
+
+import pytest
+from hamcrest import assert_that, contains_inanyorder, equal_to, greater_than, greater_than_or_equal_to, is_
+
+from habraproxy.app import app
+from habraproxy.cache import MemoryCacheBackend, PageCache
+from habraproxy.pages import PageService, RecentPages
+from habraproxy.services import SiteProxy, UpstreamPage
+from habraproxy.views import match_page_path
+from habraproxy.warmer import CacheWarmer, RateLimiter
+
+# Links of each page, by path
+SITE_LINKS: Dict[str, List[str]] = {
+    'ru/': ['/ru/news/', '/ru/top/', '/images/logo.png'],
+    'ru/news/': ['/ru/post/1/', '/ru/'],
+    'ru/top/': ['/ru/post/2/#comments'],
+    'ru/post/1/': [],
+    'ru/post/2/': [],
+    'ru/hub/python/': ['/ru/post/3/'],
+}
+
+
+def fetch_page(
+    path: str,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+    decode: bool = True,
+) -> UpstreamPage:
+    if etag is not None:
+        return UpstreamPage(status=HTTPStatus.NOT_MODIFIED, content=None)
+    links = ''.join('<a href="https://habr.com{0}">Link</a>'.format(link) for link in SITE_LINKS.get(path, []))
+    return UpstreamPage(status=HTTPStatus.OK, content='<html><body>{0}</body></html>'.format(links), etag='"abc"')
+
+
+@pytest.fixture
+def page_service(mocker):
+    site_proxy = SiteProxy('https://habr.com')
+    mocker.patch.object(site_proxy, 'fetch_page', side_effect=fetch_page)
+    return PageService(
+        site_proxy,
+        cache=PageCache(MemoryCacheBackend(max_size=10 ** 6), ttl=60),
+        recent_pages=RecentPages(max_size=10),
+    )
+
+
+def create_warmer(page_service: PageService, **kwargs: Any) -> CacheWarmer:
+    return CacheWarmer(
+        page_service,
+        seeds=['/ru/'],
+        page_path=partial(match_page_path, app.url_map),
+        recent_pages=page_service.recent_pages,
+        rate_limit=0,
+        **kwargs,
+    )
+
+
+def fetched_paths(page_service: Any) -> List[str]:
+    return [fetch_call[0][0] for fetch_call in page_service.site_proxy.fetch_page.call_args_list]
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+class TestCacheWarmer:
+    def test_links_crawled_up_to_max_depth(self, page_service):
+        cache_warmer = create_warmer(page_service, max_depth=1)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            visited_count = cache_warmer.run_round(executor)
+
+        assert_that(visited_count, is_(equal_to(3)))
+        assert_that(fetched_paths(page_service), contains_inanyorder('ru/', 'ru/news/', 'ru/top/'))
+
+    def test_number_of_pages_limited(self, page_service):
+        cache_warmer = create_warmer(page_service, max_depth=5, max_pages=4)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            visited_count = cache_warmer.run_round(executor)
+
+        assert_that(visited_count, is_(equal_to(4)))
+        assert_that(len(fetched_paths(page_service)), is_(equal_to(4)))
+
+    def test_cached_pages_not_fetched(self, page_service):
+        cache_warmer = create_warmer(page_service, max_depth=1, refresh_ahead=0)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            cache_warmer.run_round(executor)
+            cache_warmer.run_round(executor)
+
+        assert_that(len(fetched_paths(page_service)), is_(equal_to(3)))
+
+    def test_popular_pages_refreshed_before_expiration(self, page_service):
+        cache_warmer = create_warmer(page_service, max_depth=1, refresh_ahead=120)
+        page_service.get_page('ru/hub/python/')
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            cache_warmer.run_round(executor)
+        page_service.site_proxy.fetch_page.reset_mock()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            cache_warmer.run_round(executor)
+
+        # Seed and requested page are revalidated, pages discovered via links are still fresh
+        assert_that(fetched_paths(page_service), contains_inanyorder('ru/', 'ru/hub/python/'))
+        assert_that(
+            [fetch_call[1]['etag'] for fetch_call in page_service.site_proxy.fetch_page.call_args_list],
+            is_(equal_to(['"abc"', '"abc"'])),
+        )
+
+    def test_failed_page_skipped(self, page_service):
+        def fetch_only_seed(path, **kwargs):
+            if path != 'ru/':
+                raise ConnectionError('Origin is not available')
+            return fetch_page(path, **kwargs)
+
+        page_service.site_proxy.fetch_page.side_effect = fetch_only_seed
+        cache_warmer = create_warmer(page_service, max_depth=1)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            visited_count = cache_warmer.run_round(executor)
+
+        assert_that(visited_count, is_(equal_to(3)))
+        assert_that(page_service.cache.backend.get('ru/') is not None, is_(True))
+
+    def test_warmer_started_and_stopped(self, page_service):
+        cache_warmer = create_warmer(page_service, max_depth=0, interval=60)
+
+        cache_warmer.start()
+        deadline = time.monotonic() + 5
+        while page_service.cache.backend.get('ru/') is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        cache_warmer.stop()
+
+        assert_that(fetched_paths(page_service), is_(equal_to(['ru/'])))
+
+    def test_single_warmer_runs_with_shared_lock(self, page_service, tmp_path, mocker):
+        lock_path = str(tmp_path / 'warmer.lock')
+        first_warmer = create_warmer(page_service, max_depth=0, interval=0.01, lock_path=lock_path)
+        second_warmer = create_warmer(page_service, max_depth=0, interval=0.01, lock_path=lock_path)
+        first_rounds = mocker.spy(first_warmer, 'run_round')
+        second_rounds = mocker.spy(second_warmer, 'run_round')
+
+        first_warmer.start()
+        wait_for(lambda: first_rounds.call_count > 0)
+        second_warmer.start()
+        time.sleep(0.1)
+        second_rounds_while_first_running = second_rounds.call_count
+        first_warmer.stop()
+        wait_for(lambda: second_rounds.call_count > 0)
+        second_warmer.stop()
+
+        assert_that(second_rounds_while_first_running, is_(equal_to(0)))
+        assert_that(second_rounds.call_count, is_(greater_than(0)))
+
+
+class TestRateLimiter:
+    def test_calls_spread_in_time(self):
+        rate_limiter = RateLimiter(rate=100)
+
+        started_at = time.monotonic()
+        for _ in range(5):
+            rate_limiter.wait()
+
+        assert_that(time.monotonic() - started_at, is_(greater_than_or_equal_to(0.04)))